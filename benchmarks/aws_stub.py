@@ -0,0 +1,45 @@
+# Cost Explorer without AWS: botocore Stubber fixtures serving generated GetCostAndUsage pages.
+import threading
+import boto3
+from botocore.stub import Stubber
+from finops_crawler.aws.api import AWSAPI
+
+import data
+
+
+class StubbedClientPool:
+    """
+    Stands in for `ClientPool`: every thread gets a Cost Explorer client whose Stubber has the
+    generated pages queued `repeat` times, so several `get_cost` calls can run one after another.
+    """
+
+    def __init__(self, pages: int, groups_per_page: int, repeat: int = 1, seed: int = 0):
+        self.responses = data.aws_cost_pages(pages, groups_per_page, seed=seed)
+        self.repeat = repeat
+        self._local = threading.local()
+        # Stubber only needs credentials and a region to build the client, nothing is sent
+        self.session = boto3.Session(aws_access_key_id='benchmark', aws_secret_access_key='benchmark', region_name='us-east-1')
+        self._lock = threading.Lock()
+
+    def client(self, service_name: str):
+        clients = getattr(self._local, 'clients', None)
+        if clients is None:
+            clients = self._local.clients = {}
+        if service_name not in clients:
+            with self._lock:
+                client = self.session.client(service_name)
+            stubber = Stubber(client)
+            if service_name == 'ce':
+                for _ in range(self.repeat):
+                    for response in self.responses:
+                        stubber.add_response('get_cost_and_usage', response)
+            stubber.activate()
+            clients[service_name] = client
+        return clients[service_name]
+
+
+def stubbed_client(pages: int, groups_per_page: int, repeat: int = 1, seed: int = 0):
+    """
+    Returns an `AWSAPI` whose Cost Explorer calls are answered by the stub.
+    """
+    return AWSAPI(client_pool=StubbedClientPool(pages, groups_per_page, repeat=repeat, seed=seed))
@@ -0,0 +1,128 @@
+# Synthetic cost data at configurable scale, shaped like what the APIs return. Deterministic
+# for a given seed, so runs of different versions see exactly the same data.
+import csv
+import datetime
+import io
+import random
+
+AZURE_QUERY_COLUMNS = [
+    {'name': 'Cost', 'type': 'Number'},
+    {'name': 'UsageDate', 'type': 'Number'},
+    {'name': 'ResourceId', 'type': 'String'},
+    {'name': 'ChargeType', 'type': 'String'},
+    {'name': 'Currency', 'type': 'String'},
+]
+
+AZURE_DETAILED_COLUMNS = [
+    'InvoiceSectionName', 'AccountName', 'AccountOwnerId', 'SubscriptionId', 'SubscriptionName', 'ResourceGroup',
+    'ResourceLocation', 'Date', 'ProductName', 'MeterCategory', 'MeterSubCategory', 'MeterId', 'MeterName',
+    'MeterRegion', 'UnitOfMeasure', 'Quantity', 'EffectivePrice', 'CostInBillingCurrency', 'CostCenter',
+    'ConsumedService', 'ResourceId', 'Tags', 'OfferId', 'AdditionalInfo', 'ServiceInfo1', 'ServiceInfo2',
+    'ResourceName', 'ReservationId', 'ReservationName', 'UnitPrice', 'ProductOrderId', 'ProductOrderName',
+    'Term', 'PublisherType', 'PublisherName', 'ChargeType', 'Frequency', 'PricingModel', 'AvailabilityZone',
+    'BillingAccountId', 'BillingAccountName', 'BillingCurrencyCode', 'BillingPeriodStartDate', 'BillingPeriodEndDate',
+    'BillingProfileId', 'BillingProfileName', 'IsAzureCreditEligible', 'PartNumber', 'PayGPrice', 'PlanName',
+    'ServiceFamily', 'CostAllocationRuleName', 'benefitId', 'benefitName',
+]
+
+SERVICES = ['Microsoft.Compute', 'Microsoft.Storage', 'Microsoft.Network', 'Microsoft.Sql', 'Microsoft.Web', 'Microsoft.KeyVault']
+AWS_SERVICES = ['Amazon Elastic Compute Cloud - Compute', 'Amazon Simple Storage Service', 'AWS Lambda',
+                'Amazon Relational Database Service', 'Amazon CloudFront', 'Amazon DynamoDB']
+
+
+def _resource_ids(rng: random.Random, subscription_id: str, count: int):
+    return [
+        f'/subscriptions/{subscription_id}/resourcegroups/rg-{i % 17}/providers/{rng.choice(SERVICES).lower()}/things/resource-{i}'
+        for i in range(count)
+    ]
+
+
+def _days(start: datetime.date, days: int):
+    return [start + datetime.timedelta(days=i) for i in range(days)]
+
+
+def azure_query_page(subscription_id: str, page: int, rows: int, days: int = 30, seed: int = 0):
+    """
+    Returns the `properties` of one page of the query API, without `nextLink`.
+    """
+    rng = random.Random(f'{seed}-{subscription_id}-{page}')
+    resource_ids = _resource_ids(rng, subscription_id, max(1, rows // days))
+    usage_dates = [int(day.strftime('%Y%m%d')) for day in _days(datetime.date(2023, 10, 1), days)]
+    return {
+        'columns': AZURE_QUERY_COLUMNS,
+        'rows': [
+            [round(rng.random() * 10, 6), usage_dates[i % days], resource_ids[i % len(resource_ids)], rng.choice(('Usage', 'Purchase')), 'EUR']
+            for i in range(rows)
+        ],
+    }
+
+
+def azure_detailed_csv(subscription_id: str, blob: int, rows: int, seed: int = 0):
+    """
+    Returns one blob of a cost details report as CSV bytes (with a BOM, like Azure writes them).
+    Every tenth row has tags with a quoted line break.
+    """
+    rng = random.Random(f'{seed}-{subscription_id}-blob-{blob}')
+    resource_ids = _resource_ids(rng, subscription_id, max(1, rows // 30))
+    dates = [day.strftime('%m/%d/%Y') for day in _days(datetime.date(2023, 10, 1), 30)]
+    output = io.StringIO(newline='')
+    writer = csv.writer(output)
+    writer.writerow(AZURE_DETAILED_COLUMNS)
+    for i in range(rows):
+        row = dict.fromkeys(AZURE_DETAILED_COLUMNS, '')
+        row.update({
+            'SubscriptionId': subscription_id,
+            'SubscriptionName': f'subscription {subscription_id[:8]}',
+            'ResourceGroup': f'rg-{i % 17}',
+            'ResourceLocation': 'westeurope',
+            'Date': dates[i % len(dates)],
+            'MeterCategory': rng.choice(('Virtual Machines', 'Storage', 'Bandwidth', 'SQL Database')),
+            'MeterSubCategory': rng.choice(('D2s v3', 'Standard SSD', 'Inter-Region', 'General Purpose')),
+            'MeterName': 'meter',
+            'Quantity': f'{rng.random() * 24:.6f}',
+            'EffectivePrice': f'{rng.random():.6f}',
+            'CostInBillingCurrency': f'{rng.random() * 10:.8f}',
+            'ResourceId': resource_ids[i % len(resource_ids)],
+            'Tags': '"env": "prod",\n"team": "finops"' if i % 10 == 0 else '"env": "dev"',
+            'ChargeType': 'Usage',
+            'BillingCurrencyCode': 'EUR',
+            'PricingModel': 'OnDemand',
+        })
+        writer.writerow(row.values())
+    return b'\xef\xbb\xbf' + output.getvalue().encode('utf-8')
+
+
+def aws_cost_pages(pages: int, groups_per_page: int, days: int = 30, seed: int = 0):
+    """
+    Returns GetCostAndUsage responses, chained with NextPageToken.
+    """
+    rng = random.Random(f'{seed}-aws')
+    responses = []
+    days_per_page = max(1, days // pages)
+    start = datetime.date(2023, 10, 1)
+    for page in range(pages):
+        results = []
+        for day in range(days_per_page):
+            date = start + datetime.timedelta(days=page * days_per_page + day)
+            groups = [
+                {
+                    'Keys': [AWS_SERVICES[g % len(AWS_SERVICES)], f'EUC1-UsageType-{g}'],
+                    'Metrics': {'UnblendedCost': {'Amount': f'{rng.random() * 10:.10f}', 'Unit': 'USD'}},
+                }
+                for g in range(max(1, groups_per_page // days_per_page))
+            ]
+            results.append({
+                'TimePeriod': {'Start': date.isoformat(), 'End': (date + datetime.timedelta(days=1)).isoformat()},
+                'Total': {},
+                'Groups': groups,
+                'Estimated': False,
+            })
+        response = {'ResultsByTime': results, 'DimensionValueAttributes': []}
+        if page < pages - 1:
+            response['NextPageToken'] = f'token-{page + 1}'
+        responses.append(response)
+    return responses
+
+
+def subscription_ids(count: int):
+    return [f'00000000-0000-0000-0000-{i:012d}' for i in range(count)]
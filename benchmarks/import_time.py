@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Measures how long importing the package (and each provider) takes in a fresh interpreter, and
+# which heavy dependencies every import pulls in. Run from the repository root:
+#
+#   python benchmarks/import_time.py                       # print a table
+#   python benchmarks/import_time.py --json > baseline.json
+#   python benchmarks/import_time.py --compare baseline.json --tolerance 0.2
+#
+# Exits with 1 if an import got slower than the baseline by more than the tolerance, or if an
+# import loads a dependency it must not (e.g. botocore for Azure).
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+HEAVY_MODULES = ('boto3', 'botocore', 'requests', 'yaml', 'pyarrow', 'aiohttp')
+
+# statement -> heavy modules it must not load
+TARGETS = {
+    'import finops_crawler': HEAVY_MODULES,
+    'from finops_crawler import azure, aws, openai, credentials_provider': ('boto3', 'botocore', 'yaml', 'pyarrow', 'aiohttp'),
+    'from finops_crawler.azure import costs_api': ('boto3', 'botocore', 'yaml', 'pyarrow', 'aiohttp'),
+    'from finops_crawler.aws import costs_api': ('requests', 'yaml', 'pyarrow', 'aiohttp'),
+    'from finops_crawler.openai import api': ('boto3', 'botocore', 'yaml', 'pyarrow', 'aiohttp'),
+    'from finops_crawler.credentials_provider import api': ('boto3', 'botocore', 'requests', 'pyarrow', 'aiohttp'),
+    'from finops_crawler.crawler import Crawler': HEAVY_MODULES,
+}
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def measure(statement: str, repeat: int):
+    env = dict(os.environ, PYTHONPATH=SRC_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    timings = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE.format(statement=statement, heavy=HEAVY_MODULES)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output)
+        timings.append(result['ms'])
+        loaded = result['loaded']
+    return {'median_ms': statistics.median(timings), 'min_ms': min(timings), 'loaded': loaded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the import time of finops_crawler.')
+    parser.add_argument('--repeat', type=int, default=7, help='fresh interpreters per import, the median is reported')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--compare', help='baseline JSON file from an earlier --json run')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against the baseline, 0.25 = 25%%')
+    args = parser.parse_args()
+
+    results = {statement: measure(statement, args.repeat) for statement in TARGETS}
+
+    failed = False
+    for statement, result in results.items():
+        forbidden = [module for module in result['loaded'] if module in TARGETS[statement]]
+        if forbidden:
+            print(f"{statement!r} loads {', '.join(forbidden)}", file=sys.stderr)
+            failed = True
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for statement, result in results.items():
+            print(f"{result['median_ms']:8.1f} ms  {statement}  [{', '.join(result['loaded'])}]")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for statement, result in results.items():
+            if statement not in baseline:
+                continue
+            before = baseline[statement]['median_ms']
+            # a couple of milliseconds is noise, whatever the tolerance
+            if result['median_ms'] > before * (1 + args.tolerance) + 2:
+                print(f"{statement!r} got slower: {before:.1f} ms -> {result['median_ms']:.1f} ms", file=sys.stderr)
+                failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# A local stand-in for the Azure endpoints the crawler uses: the token endpoint, subscriptions,
+# the query API with nextLink pagination, generateCostDetailsReport with 202 polling, and the
+# report blobs. It can throttle every n-th request with a 429 and Retry-After, break blob
+# downloads off halfway, and expire the blob links it handed out (403, like an expired SAS).
+#
+# The clients are pointed at it with `redirect_session()`, which rewrites the https URLs of
+# login.microsoftonline.com and management.azure.com to the mock.
+import json
+import re
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from finops_crawler.session import PooledSession
+
+import data
+
+AZURE_HOSTS = ('https://login.microsoftonline.com', 'https://management.azure.com')
+
+
+class MockAzureConfig:
+    def __init__(self, subscriptions: int = 4, pages: int = 4, rows_per_page: int = 5000, blobs: int = 2,
+                 rows_per_blob: int = 20000, report_polls: int = 2, throttle_every: int = 0, retry_after: str = '0',
+                 latency: float = 0.0, blob_failures: int = 0, seed: int = 0):
+        """
+        Args:
+            subscriptions (int): Number of subscriptions listed.
+            pages (int): Pages of every query result.
+            rows_per_page (int): Rows on every page.
+            blobs (int): Blobs of every cost details report.
+            rows_per_blob (int): Rows in every blob.
+            report_polls (int): How many polls of a report answer 202 before it's done.
+            throttle_every (int): Answer every n-th management API request with 429. 0 disables throttling.
+            retry_after (str): Retry-After of the 429 and 202 responses.
+            latency (float): Seconds every request takes on the server side.
+            blob_failures (int): The first n downloads of every blob send half of it and hang up.
+            seed (int): Seed of the generated data.
+        """
+        self.subscriptions = subscriptions
+        self.pages = pages
+        self.rows_per_page = rows_per_page
+        self.blobs = blobs
+        self.rows_per_blob = rows_per_blob
+        self.report_polls = report_polls
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.latency = latency
+        self.blob_failures = blob_failures
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class MockAzure:
+    """
+    Serves generated data on 127.0.0.1. Responses are generated once and kept, so serving them
+    costs the crawler under test as little as possible.
+    """
+
+    def __init__(self, config: MockAzureConfig):
+        self.config = config
+        self.subscriptions = data.subscription_ids(config.subscriptions)
+        self.requests = 0
+        self.throttled = 0
+        self.blob_downloads = {}
+        self._pages = {}
+        self._blobs = {}
+        self._polls = {}
+        # blob links of reports before this one are answered with 403
+        self._links_valid_from = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        self._thread = None
+
+    def start(self):
+        # generate everything up front, outside of the measurements
+        for subscription_id in self.subscriptions:
+            for page in range(self.config.pages):
+                self._page(subscription_id, page)
+            for blob in range(self.config.blobs):
+                self._blob(subscription_id, blob)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _page(self, subscription_id: str, page: int):
+        key = (subscription_id, page)
+        if key not in self._pages:
+            properties = data.azure_query_page(subscription_id, page, self.config.rows_per_page, seed=self.config.seed)
+            if page < self.config.pages - 1:
+                properties['nextLink'] = (f'https://management.azure.com/subscriptions/{subscription_id}/providers/'
+                                          f'Microsoft.CostManagement/query?api-version=2019-11-01&page={page + 1}')
+            self._pages[key] = json.dumps({'properties': properties}).encode()
+        return self._pages[key]
+
+    def _blob(self, subscription_id: str, blob: int):
+        key = (subscription_id, blob)
+        if key not in self._blobs:
+            self._blobs[key] = data.azure_detailed_csv(subscription_id, blob, self.config.rows_per_blob, seed=self.config.seed)
+        return self._blobs[key]
+
+    def expire_links(self):
+        """
+        Makes the blob links of every report generated so far answer 403, like expired SAS links.
+        """
+        with self._lock:
+            self._links_valid_from = len(self._polls)
+
+    def _count_download(self, key):
+        # returns whether this download of a blob should break off
+        with self._lock:
+            self.blob_downloads[key] = self.blob_downloads.get(key, 0) + 1
+            return self.blob_downloads[key] <= self.config.blob_failures
+
+    def _throttle(self):
+        with self._lock:
+            self.requests += 1
+            throttle = self.config.throttle_every and self.requests % self.config.throttle_every == 0
+            if throttle:
+                self.throttled += 1
+        return throttle
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b'', headers=None, content_type='application/json'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, status, value, headers=None):
+                self._send(status, json.dumps(value).encode(), headers)
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def do_POST(self):
+                self._read_body()
+                self._route('POST')
+
+            def do_GET(self):
+                self._route('GET')
+
+            def _route(self, method):
+                if mock.config.latency:
+                    threading.Event().wait(mock.config.latency)
+                url = urllib.parse.urlsplit(self.path)
+                query = urllib.parse.parse_qs(url.query)
+                path = url.path
+
+                if path.endswith('/oauth2/v2.0/token'):
+                    return self._json(200, {'token_type': 'Bearer', 'expires_in': 3600, 'access_token': 'mock-token'})
+
+                if path.startswith('/mock/blobs/'):
+                    _, _, _, subscription_id, blob = path.split('/')
+                    if int(query.get('report', ['0'])[0]) < mock._links_valid_from:
+                        return self._json(403, {'error': {'code': 'AuthenticationFailed', 'message': 'Signature expired'}})
+                    body = mock._blob(subscription_id, int(blob[:-len('.csv')]))
+                    if mock._count_download((subscription_id, blob)):
+                        return self._break_off(body)
+                    return self._send(200, body, content_type='text/csv')
+
+                if mock._throttle():
+                    return self._json(429, {'error': {'code': 'TooManyRequests', 'message': 'Throttled'}},
+                                      {'Retry-After': mock.config.retry_after})
+
+                if path == '/subscriptions':
+                    return self._json(200, {'value': [{'subscriptionId': s} for s in mock.subscriptions]})
+
+                match = re.match(r'^/subscriptions/([^/]+)/providers/Microsoft.CostManagement/(\w+)$', path)
+                if match and method == 'POST':
+                    subscription_id, operation = match.groups()
+                    if operation == 'query':
+                        page = int(query.get('page', ['0'])[0])
+                        return self._send(200, mock._page(subscription_id, page))
+                    if operation == 'generateCostDetailsReport':
+                        with mock._lock:
+                            report_id = str(len(mock._polls))
+                            mock._polls[report_id] = 0
+                        return self._accepted(subscription_id, report_id)
+
+                match = re.match(r'^/mock/reports/([^/]+)/([^/]+)$', path)
+                if match:
+                    subscription_id, report_id = match.groups()
+                    with mock._lock:
+                        mock._polls[report_id] += 1
+                        polls = mock._polls[report_id]
+                    if polls < mock.config.report_polls:
+                        return self._accepted(subscription_id, report_id)
+                    blobs = [{'blobLink': f'{mock.url}/mock/blobs/{subscription_id}/{i}.csv?report={report_id}',
+                              'byteCount': len(mock._blob(subscription_id, i))}
+                             for i in range(mock.config.blobs)]
+                    return self._json(200, {'status': 'Completed', 'manifest': {'blobCount': len(blobs), 'blobs': blobs}})
+
+                self._json(404, {'error': {'code': 'NotFound', 'message': f'No mock for {method} {path}'}})
+
+            def _break_off(self, body):
+                # promises the whole blob, sends half of it and closes the connection
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body[:len(body) // 2])
+                self.close_connection = True
+
+            def _accepted(self, subscription_id, report_id):
+                location = f'https://management.azure.com/mock/reports/{subscription_id}/{report_id}'
+                self._send(202, headers={'Location': location, 'Retry-After': mock.config.retry_after})
+
+        return Handler
+
+
+class _RedirectAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, target: str, **kwargs):
+        self.target = target
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        for host in AZURE_HOSTS:
+            if request.url.startswith(host):
+                request.url = self.target + request.url[len(host):]
+        return super().send(request, **kwargs)
+
+
+def redirect_session(target: str, pool_maxsize: int = 32):
+    """
+    Returns a pooled session that sends the requests meant for Azure to `target` instead.
+    """
+    session = PooledSession(pool_maxsize=pool_maxsize)
+    adapter = _RedirectAdapter(target, pool_connections=10, pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
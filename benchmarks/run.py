@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# Offline benchmarks of the crawler against local stand-ins of the provider APIs (see
+# mock_azure.py and aws_stub.py), with synthetic data at a configurable scale. Every scenario
+# runs in a fresh interpreter, so peak memory is measured per scenario. Run from the repository root:
+#
+#   python benchmarks/run.py --scale small
+#   python benchmarks/run.py --scale medium --json > baseline.json
+#   python benchmarks/run.py --scale medium --compare baseline.json
+#   python benchmarks/run.py --scenario azure_detailed_stream --rows-per-blob 500000
+#
+# Reported per scenario: rows per second, wall time (median and p95 over the repeats) and the
+# peak memory the scenario added on top of the interpreter. --compare exits with 1 if the
+# throughput dropped or the peak memory grew by more than the tolerance.
+
+import argparse
+import json
+import os
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path[:0] = [os.path.join(ROOT_DIR, 'src'), BENCHMARKS_DIR]
+
+SCALES = {
+    'small': {'subscriptions': 2, 'pages': 2, 'rows_per_page': 2000, 'blobs': 2, 'rows_per_blob': 5000, 'aws_pages': 3, 'aws_groups': 2000},
+    'medium': {'subscriptions': 4, 'pages': 4, 'rows_per_page': 5000, 'blobs': 4, 'rows_per_blob': 25000, 'aws_pages': 10, 'aws_groups': 5000},
+    'large': {'subscriptions': 8, 'pages': 8, 'rows_per_page': 10000, 'blobs': 8, 'rows_per_blob': 100000, 'aws_pages': 20, 'aws_groups': 10000},
+}
+
+# scenario -> mock server settings it needs on top of the scale
+SCENARIOS = {
+    'azure_query': {},
+    'azure_query_throttled': {'throttle_every': 5},
+    'azure_query_arrow': {},
+    'azure_detailed_stream': {},
+    'azure_detailed_parallel': {},
+    'azure_detailed_columns': {},
+    'azure_report_jobs': {'report_polls': 3},
+    'aws_cost_explorer': None,
+    'normalize_azure': None,
+}
+
+
+# scenarios, run in the child process; each returns the number of rows it processed
+
+def _azure_client(mock_url):
+    from finops_crawler import ratelimit
+    from finops_crawler.azure.api import AzureAPI
+    from finops_crawler.azure.auth import TokenProvider
+    import mock_azure
+    # measure the crawler, not the default politeness towards the real API
+    ratelimit.configure('azure', rate=1000, capacity=100, max_rate=1000)
+    session = mock_azure.redirect_session(mock_url)
+    return AzureAPI('benchmark', 'benchmark', 'benchmark', session=session, token_provider=TokenProvider(session=session))
+
+
+def run_azure_query(mock_url, scale):
+    from finops_crawler.crawler import Crawler
+    client = _azure_client(mock_url)
+    crawler = Crawler(max_workers=scale['subscriptions'])
+    crawler.add(client, max_concurrency=scale['subscriptions'])
+    result = crawler.crawl('2023-10-01', '2023-10-31')
+    if result.errors:
+        raise next(iter(result.errors.values()))
+    return sum(len(rows) for rows in result.results.values())
+
+
+run_azure_query_throttled = run_azure_query
+
+
+def run_azure_query_arrow(mock_url, scale):
+    client = _azure_client(mock_url)
+    return sum(client.get_cost_table(subscription_id, '2023-10-01', '2023-10-31').num_rows for subscription_id in client.get_scopes())
+
+
+def run_azure_detailed_stream(mock_url, scale):
+    client = _azure_client(mock_url)
+    subscription_id = client.get_scopes()[0]
+    return sum(1 for _ in client.iter_cost_detailed(subscription_id, '2023-10-01', '2023-10-31'))
+
+
+def run_azure_detailed_parallel(mock_url, scale):
+    client = _azure_client(mock_url)
+    subscription_id = client.get_scopes()[0]
+    return sum(1 for _ in client.iter_cost_detailed(subscription_id, '2023-10-01', '2023-10-31', max_workers=4, ordered=False))
+
+
+def run_azure_detailed_columns(mock_url, scale):
+    client = _azure_client(mock_url)
+    subscription_id = client.get_scopes()[0]
+    return sum(len(batch['Date']) for batch in client.iter_cost_detailed_columns(subscription_id, '2023-10-01', '2023-10-31'))
+
+
+def run_azure_report_jobs(mock_url, scale):
+    from finops_crawler.azure.jobs import ReportJobManager
+    client = _azure_client(mock_url)
+    manager = ReportJobManager(client, download=lambda job, manifest: sum(1 for _ in client.iter_manifest_rows(manifest)))
+    manager.submit_many(client.get_scopes(), '2023-10-01', '2023-10-31')
+    result = manager.run()
+    if result.errors:
+        raise next(iter(result.errors.values()))
+    return sum(result.results.values())
+
+
+def run_aws_cost_explorer(mock_url, scale):
+    from finops_crawler import schema
+    import aws_stub
+    client = aws_stub.stubbed_client(scale['aws_pages'], scale['aws_groups'])
+    return len(schema.from_aws(client.get_cost('2023-10-01', '2023-10-31')))
+
+
+def run_normalize_azure(mock_url, scale):
+    from finops_crawler import schema
+    import data
+    pages = [data.azure_query_page('benchmark', page, scale['rows_per_page']) for page in range(scale['pages'] * scale['subscriptions'])]
+    start = time.perf_counter()
+    rows = len(schema.from_azure_query_pages(pages, 'benchmark'))
+    # only the conversion is measured, not generating the data
+    return rows, time.perf_counter() - start
+
+
+def _max_rss_mb():
+    # on Linux ru_maxrss can carry over the peak of the parent across fork and exec (and the
+    # parent holds the mock data), VmHWM belongs to this process only
+    try:
+        with open('/proc/self/status') as f:
+            return int(re.search(r'^VmHWM:\s+(\d+) kB', f.read(), re.MULTILINE).group(1)) / 1024
+    except (OSError, AttributeError):
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 / 1024 if sys.platform == 'darwin' else maxrss / 1024
+
+
+def child(scenario, mock_url, scale):
+    function = globals()[f'run_{scenario}']
+    baseline_mb = _max_rss_mb()
+    start = time.perf_counter()
+    rows = function(mock_url, scale)
+    seconds = time.perf_counter() - start
+    if isinstance(rows, tuple):
+        rows, seconds = rows
+    print(json.dumps({'rows': rows, 'seconds': seconds, 'peak_mb': max(0.0, _max_rss_mb() - baseline_mb)}))
+
+
+def run_scenario(scenario, scale, repeat):
+    import mock_azure
+    mock = None
+    mock_url = ''
+    if SCENARIOS[scenario] is not None:
+        settings = {key: scale[key] for key in ('subscriptions', 'pages', 'rows_per_page', 'blobs', 'rows_per_blob')}
+        settings.update(SCENARIOS[scenario])
+        mock = mock_azure.MockAzure(mock_azure.MockAzureConfig(**settings)).start()
+        mock_url = mock.url
+    try:
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', scenario, '--mock-url', mock_url, '--scale-json', json.dumps(scale)],
+                capture_output=True, text=True,
+            )
+            if output.returncode != 0:
+                raise RuntimeError(f"{scenario} failed:\n{output.stderr}")
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    seconds = sorted(run['seconds'] for run in runs)
+    result = {
+        'rows': runs[0]['rows'],
+        'rows_per_second': runs[0]['rows'] / statistics.median(seconds) if statistics.median(seconds) else 0.0,
+        'median_seconds': statistics.median(seconds),
+        'p95_seconds': seconds[min(len(seconds) - 1, int(round(0.95 * (len(seconds) - 1))))],
+        'peak_mb': max(run['peak_mb'] for run in runs),
+    }
+    if mock is not None:
+        result['requests'] = mock.requests
+        result['throttled'] = mock.throttled
+    return result
+
+
+def _version():
+    with open(os.path.join(ROOT_DIR, 'pyproject.toml')) as f:
+        match = re.search(r'^version = "([^"]+)"', f.read(), re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def compare(results, baseline, tolerance):
+    failed = False
+    for scenario, result in results.items():
+        before = baseline.get('scenarios', {}).get(scenario)
+        if before is None:
+            continue
+        change = result['rows_per_second'] / before['rows_per_second'] - 1 if before['rows_per_second'] else 0.0
+        memory_change = result['peak_mb'] - before['peak_mb']
+        print(f"{scenario:26} throughput {change:+7.1%}   peak memory {memory_change:+8.1f} MB")
+        if change < -tolerance:
+            print(f"  {scenario} throughput regressed: {before['rows_per_second']:.0f} -> {result['rows_per_second']:.0f} rows/s", file=sys.stderr)
+            failed = True
+        # a few MB is noise, whatever the tolerance
+        if memory_change > max(8.0, before['peak_mb'] * tolerance):
+            print(f"  {scenario} peak memory grew: {before['peak_mb']:.1f} -> {result['peak_mb']:.1f} MB", file=sys.stderr)
+            failed = True
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of finops_crawler.')
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='run only these scenarios (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario')
+    for key in SCALES['small']:
+        parser.add_argument(f"--{key.replace('_', '-')}", type=int, help=f'override {key} of the scale')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--compare', help='baseline JSON file from an earlier --json run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression against the baseline, 0.2 = 20%%')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--mock-url', help=argparse.SUPPRESS)
+    parser.add_argument('--scale-json', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.mock_url, json.loads(args.scale_json))
+        return
+
+    scale = dict(SCALES[args.scale])
+    for key in scale:
+        value = getattr(args, key)
+        if value is not None:
+            scale[key] = value
+
+    results = {}
+    for scenario in args.scenario or SCENARIOS:
+        results[scenario] = run_scenario(scenario, scale, args.repeat)
+        if not args.json:
+            result = results[scenario]
+            print(f"{scenario:26} {result['rows']:>10} rows  {result['rows_per_second']:>12,.0f} rows/s  "
+                  f"{result['median_seconds']:7.2f} s (p95 {result['p95_seconds']:.2f} s)  {result['peak_mb']:7.1f} MB", flush=True)
+
+    report = {'version': _version(), 'python': sys.version.split()[0], 'scale': scale, 'scenarios': results}
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != scale:
+            print("The baseline was run at a different scale, the numbers aren't comparable", file=sys.stderr)
+        sys.exit(1 if compare(results, baseline, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+from finops_crawler._lazy import lazy_exports
+
+# the provider subpackages are imported on first use, so a job using one platform never loads
+# the SDKs of the others (e.g. botocore for an Azure-only job)
+__getattr__, __dir__ = lazy_exports(__name__, {
+    name: (f'.{name}', None) for name in ('aws', 'azure', 'openai', 'credentials_provider')
+})
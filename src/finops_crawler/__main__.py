@@ -0,0 +1,5 @@
+import sys
+from finops_crawler.cli import main
+
+# python -m finops_crawler, same as the finops-crawler command
+sys.exit(main())
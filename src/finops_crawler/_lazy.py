@@ -0,0 +1,32 @@
+import importlib
+import sys
+from typing import Dict, Optional, Tuple
+
+
+def lazy_exports(module_name: str, exports: Dict[str, Tuple[str, Optional[str]]]):
+    """
+    Returns the `__getattr__` and `__dir__` of a package whose exports are imported on first use.
+
+    Example:
+        __getattr__, __dir__ = lazy_exports(__name__, {'costs_api': ('.api', 'AWSAPI')})
+
+    Args:
+        module_name (str): `__name__` of the package.
+        exports (dict): Exported name -> (module, relative to the package, attribute of that
+            module). With the attribute None the module itself is exported.
+    """
+    def __getattr__(name):
+        if name in exports:
+            source, attribute = exports[name]
+            value = importlib.import_module(source, module_name)
+            if attribute is not None:
+                value = getattr(value, attribute)
+            # later lookups find it in the package and don't come here again
+            setattr(sys.modules[module_name], name, value)
+            return value
+        raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[module_name])) | set(exports))
+
+    return __getattr__, __dir__
@@ -0,0 +1,263 @@
+import asyncio
+import codecs
+import csv
+import datetime
+import io
+import time
+from typing import Callable, Iterable, Optional, Union
+from finops_crawler import ratelimit
+from finops_crawler import metrics
+from finops_crawler.base import EmptyResultError
+from finops_crawler.crawler import CrawlResult
+from finops_crawler.session import DEFAULT_TIMEOUT
+
+
+def _aiohttp():
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise ImportError("The async clients require aiohttp, install it with `pip install finops_crawler[async]`") from e
+    return aiohttp
+
+
+def create_session(limit: int = 100, limit_per_host: int = 32, timeout=DEFAULT_TIMEOUT):
+    """
+    Creates an `aiohttp.ClientSession` with a bounded keep-alive connection pool and default timeouts.
+
+    Must be called from a running event loop. The session can be shared by any number of
+    async clients on that loop.
+
+    Args:
+        limit (int, optional): Maximum number of open connections.
+        limit_per_host (int, optional): Maximum number of open connections per host.
+        timeout (tuple, optional): (connect, read) timeout in seconds.
+    """
+    aiohttp = _aiohttp()
+    connect_timeout, read_timeout = timeout
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host),
+        timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+    )
+
+
+async def acquire(limiter: Optional[ratelimit.TokenBucket]):
+    """
+    Waits for a token of a (thread-safe) limiter without blocking the event loop.
+
+    Returns:
+        float: The number of seconds waited.
+    """
+    if limiter is not None:
+        wait = limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+    return 0.0
+
+
+async def request(session, method: str, url: str, limiter: Optional[ratelimit.TokenBucket] = None,
+                  retry_policy: Optional[ratelimit.RetryPolicy] = None, labels: Optional[dict] = None, **kwargs):
+    """
+    The asyncio counterpart of `ratelimit.request`, recording the same metrics.
+
+    Returns:
+        aiohttp.ClientResponse: The response of the last attempt, with the body already read,
+        so `await response.json()` works after the connection went back to the pool.
+    """
+    aiohttp = _aiohttp()
+    retry_policy = retry_policy or ratelimit.DEFAULT_RETRY_POLICY
+    labels = labels or {}
+    operation_labels = {label: value for label, value in labels.items() if label != 'operation'}
+    attempt = 0
+    while True:
+        wait = await acquire(limiter)
+        if wait > 0:
+            metrics.inc('sleep_seconds', wait, reason='rate_limit', **operation_labels)
+        start = time.perf_counter()
+        try:
+            response = await session.request(method, url, **kwargs)
+            body = await response.read()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            metrics.observe('request_seconds', time.perf_counter() - start, status='error', **labels)
+            if attempt >= retry_policy.max_retries:
+                raise
+            delay = retry_policy.backoff(attempt)
+            metrics.inc('retries', reason='connection', **labels)
+            metrics.inc('sleep_seconds', delay, reason='retry', **operation_labels)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        metrics.observe('request_seconds', time.perf_counter() - start, status=response.status, **labels)
+        metrics.inc('bytes', len(body), **labels)
+
+        if response.status not in ratelimit.RETRYABLE_STATUS_CODES:
+            if limiter is not None:
+                if ratelimit.quota_exhausted(response.headers):
+                    limiter.on_throttled()
+                else:
+                    limiter.on_success()
+            return response
+
+        if attempt >= retry_policy.max_retries:
+            return response
+        delay = ratelimit.retry_after(response.headers)
+        if delay is None:
+            delay = retry_policy.backoff(attempt)
+        metrics.inc('retries', reason=response.status, **labels)
+        if limiter is not None and response.status == 429:
+            limiter.on_throttled()
+            limiter.pause(delay)
+        else:
+            metrics.inc('sleep_seconds', delay, reason='retry', **operation_labels)
+            await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def raise_for_status(response):
+    # same error reporting as the synchronous clients
+    if response.status >= 400:
+        try:
+            message = (await response.json(content_type=None))['error']['message']
+        except Exception:
+            message = await response.text()
+        print(f"API returned error {response.status}: {response.reason}. Message: {message}")
+        response.raise_for_status()
+
+
+async def iter_csv_rows(chunks):
+    """
+    Parses CSV rows from an async iterable of byte chunks, e.g. `response.content.iter_chunked()`.
+
+    Chunks are decoded incrementally and parsed up to the last complete record, so only the
+    unfinished tail of the stream is kept between chunks. Quoted fields may contain line breaks.
+
+    Yields:
+        dict: One row of the CSV, keyed by the header.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    fieldnames = None
+    buffer = ''
+
+    def parse(text):
+        nonlocal fieldnames
+        reader = csv.reader(io.StringIO(text, newline=''))
+        if fieldnames is None:
+            fieldnames = next(reader, None)
+        return [dict(zip(fieldnames, row)) for row in reader if row]
+
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        end = _last_record_end(buffer)
+        if end:
+            for row in parse(buffer[:end]):
+                yield row
+            buffer = buffer[end:]
+    buffer += decoder.decode(b'', final=True)
+    if buffer:
+        for row in parse(buffer):
+            yield row
+
+
+def _last_record_end(text: str):
+    # a line break ends a record only if it isn't inside quotes, i.e. the number of quotes before it is even
+    position = text.rfind('\n')
+    while position >= 0:
+        if text.count('"', 0, position) % 2 == 0:
+            return position + 1
+        position = text.rfind('\n', 0, position)
+    return 0
+
+
+class AsyncCloudAPI:
+    """
+    The asyncio counterpart of `CloudAPI`.
+
+    Clients create their own `aiohttp` session on first use unless one is passed in, and
+    should be closed with `await client.close()` or used as `async with client:`.
+    """
+
+    name = None
+
+    def __init__(self, session=None):
+        self._session = session
+        self._owns_session = session is None
+
+    async def _get_session(self):
+        if self._session is None:
+            self._session = create_session()
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def get_cost(self, start_date, end_date):
+        raise NotImplementedError("This method should be overridden in subclass")
+
+    async def get_scopes(self):
+        return [None]
+
+    async def get_scope_cost(self, scope, start_date, end_date, detailed=False):
+        return await self.get_cost(start_date, end_date)
+
+
+async def crawl(client: AsyncCloudAPI, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                scopes: Optional[Iterable] = None, max_concurrency: int = 32, detailed: bool = False,
+                progress: Optional[Callable] = None):
+    """
+    Fetches the cost of many scopes of one async client concurrently on the running event loop.
+
+    The asyncio counterpart of `Crawler`: failing and empty scopes are collected in the result
+    instead of aborting the batch.
+
+    Args:
+        client (AsyncCloudAPI): An async API client.
+        start_date, end_date: The date range, as for the client's `get_cost`.
+        scopes (iterable, optional): Scopes to fetch. Defaults to everything `client.get_scopes()` returns.
+        max_concurrency (int, optional): Maximum number of scopes fetched at the same time.
+        detailed (bool, optional): Fetch detailed costs where the platform supports it (Azure).
+        progress (callable, optional): Called as `progress(completed, total, provider, scope, error)`.
+
+    Returns:
+        CrawlResult
+    """
+    result = CrawlResult()
+    if scopes is None:
+        try:
+            scopes = await client.get_scopes()
+        except Exception as e:
+            print(f"Listing scopes for {client.name} failed: {e}")
+            result.errors[(client.name, '*')] = e
+            return result
+    scopes = list(scopes)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    completed = 0
+
+    async def fetch(scope):
+        nonlocal completed
+        error = None
+        async with semaphore:
+            try:
+                data = await client.get_scope_cost(scope, start_date, end_date, detailed=detailed)
+                if data:
+                    result.results[(client.name, scope)] = data
+                else:
+                    result.empty.append((client.name, scope))
+            except EmptyResultError:
+                result.empty.append((client.name, scope))
+            except Exception as e:
+                result.errors[(client.name, scope)] = e
+                error = e
+        completed += 1
+        if progress:
+            progress(completed, len(scopes), client.name, scope, error)
+
+    await asyncio.gather(*(fetch(scope) for scope in scopes))
+    return result
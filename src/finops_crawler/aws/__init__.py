@@ -1 +1,7 @@
-from .api import AWSAPI as costs_api
+from finops_crawler._lazy import lazy_exports
+
+# the clients are imported on first use, so that importing the package stays cheap
+__getattr__, __dir__ = lazy_exports(__name__, {
+    'costs_api': ('.api', 'AWSAPI'),
+    'async_costs_api': ('.aio', 'AsyncAWSAPI'),
+})
@@ -0,0 +1,62 @@
+import asyncio
+import datetime
+from typing import Optional, Union
+from finops_crawler import aio
+from finops_crawler.aws.api import AWSAPI
+from finops_crawler.cache import CostCache
+from finops_crawler.checkpoints import CheckpointStore
+from finops_crawler.query import CostQuery
+
+
+class AsyncAWSAPI(aio.AsyncCloudAPI):
+    """
+    The asyncio counterpart of `AWSAPI`.
+
+    boto3 has no asyncio support, so every call runs the synchronous client in a worker thread
+    (`asyncio.to_thread`). The calls still share the rate limiter and retries of `AWSAPI`, and
+    the event loop stays free for the other clients in the meantime.
+    """
+
+    name = AWSAPI.name
+    end_date_inclusive = AWSAPI.end_date_inclusive
+
+    def __init__(self, aws_access_key_id: Optional[str] = None, aws_secret_access_key: Optional[str] = None, cache: Optional[CostCache] = None,
+                 checkpoints: Optional[CheckpointStore] = None):
+        """
+        Args:
+            aws_access_key_id (str, optional): AWS Access Key ID. If not provided, boto3 will
+                fall back to the credentials stored in your environment.
+            aws_secret_access_key (str, optional): AWS Secret Access Key. If not provided, boto3
+                will fall back to the credentials stored in your environment.
+            cache (CostCache, optional): Cache for `get_cost` results.
+            checkpoints (CheckpointStore, optional): Resume interrupted pagination, see `AWSAPI`.
+        """
+        super().__init__()
+        self.api = AWSAPI(aws_access_key_id, aws_secret_access_key, cache=cache, checkpoints=checkpoints)
+
+    async def close(self):
+        # no HTTP session of its own
+        pass
+
+    async def get_account_info(self):
+        return await asyncio.to_thread(self.api.get_account_info)
+
+    async def get_all_accounts(self):
+        return await asyncio.to_thread(self.api.get_all_accounts)
+
+    async def get_scopes(self):
+        return await asyncio.to_thread(self.api.get_scopes)
+
+    async def get_scope_cost(self, scope: Optional[str], start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], detailed: bool = False):
+        return await asyncio.to_thread(self.api.get_scope_cost, scope, start_date, end_date, detailed)
+
+    def split_by_day(self, data):
+        return self.api.split_by_day(data)
+
+    async def get_cost(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], account_id: Optional[str] = None,
+                       max_workers: int = 1, shard_days: Optional[int] = None, query: Optional[CostQuery] = None):
+        """
+        Same as `AWSAPI.get_cost`, run in a worker thread.
+        """
+        return await asyncio.to_thread(self.api.get_cost, start_date, end_date, account_id=account_id,
+                                       max_workers=max_workers, shard_days=shard_days, query=query)
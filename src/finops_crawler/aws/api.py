@@ -1,11 +1,29 @@
+import concurrent.futures
 import datetime
-import boto3
 from typing import Optional, Union
-from botocore.exceptions import BotoCoreError
+from botocore.exceptions import BotoCoreError, ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+from finops_crawler.aws.clients import ClientPool, DEFAULT_ROLE_NAME, role_arn
 from finops_crawler.base import CloudAPI
+from finops_crawler import ratelimit
+from finops_crawler import metrics
+from finops_crawler.cache import CostCache
+from finops_crawler.checkpoints import CheckpointStore, paginate
+from finops_crawler import columnar
+from finops_crawler.dates import split_range
+from finops_crawler.query import CostQuery
+
+# daily unblended cost per service and usage type, what get_cost returns without a query
+DEFAULT_QUERY = CostQuery(granularity='daily', metrics=['cost'], group_by=['service', 'usage_type'])
+
+# botocore's errors of failed connections and timeouts, retried by ratelimit.call
+CONNECTION_ERRORS = (BotoConnectionError, HTTPClientError)
 
 class AWSAPI(CloudAPI):
-    def __init__(self, aws_access_key_id: Optional[str] = None, aws_secret_access_key: Optional[str] = None):
+    name = 'aws'
+
+    def __init__(self, aws_access_key_id: Optional[str] = None, aws_secret_access_key: Optional[str] = None, cache: Optional[CostCache] = None,
+                 role_name: Optional[str] = None, client_pool: Optional[ClientPool] = None, checkpoints: Optional[CheckpointStore] = None):
         """
         Initialize AWSAPI.
 
@@ -14,11 +32,53 @@ class AWSAPI(CloudAPI):
                 fall back to the credentials stored in your environment.
             aws_secret_access_key (str, optional): AWS Secret Access Key. If not provided, boto3 
                 will fall back to the credentials stored in your environment.
+            cache (CostCache, optional): Cache for `get_cost` results, so that repeated queries don't
+                call (and pay for) Cost Explorer again.
+            role_name (str, optional): Assume this role in every member account when crawling the
+                accounts of an organization (see `get_scope_cost`), instead of filtering the costs
+                of the management account by linked account.
+            client_pool (ClientPool, optional): Where to get boto3 clients from. Overrides the keys.
+            checkpoints (CheckpointStore, optional): Store every page of a paginated `get_cost`, so that
+                a crawl that dies midway resumes at the next page instead of paying for the first ones again.
+        """
+        self.cache = cache
+        self.checkpoints = checkpoints
+        self.role_name = role_name
+        # the account whose role this client assumed, see for_account()
+        self.account_id = None
+        # the account of the credentials themselves, see get_scope_cost()
+        self._caller_account_id = None
+        self.clients = client_pool if client_pool is not None else ClientPool(aws_access_key_id, aws_secret_access_key)
+
+    @property
+    def session(self):
+        # the boto3 session of the current thread
+        return self.clients.session
+
+    def _client(self, service_name: str):
+        # cached per thread, boto3 sessions are not thread-safe
+        return self.clients.client(service_name)
+
+    def for_account(self, account_id: str, role_name: Optional[str] = None, external_id: Optional[str] = None):
+        """
+        Returns a client for a member account of the organization, acting as a role in that account.
+
+        The STS credentials are cached and refreshed before they expire, and the clients of the
+        account are reused, so asking for the same account again costs nothing.
+
+        Args:
+            account_id (str): AWS account ID, e.g. from `get_all_accounts()`.
+            role_name (str, optional): Name of the role to assume. Defaults to the client's `role_name`,
+                or OrganizationAccountAccessRole.
+            external_id (str, optional): External ID required by the role's trust policy.
+
+        Returns:
+            AWSAPI: A client sharing this client's cache and checkpoints.
         """
-        self.session = boto3.Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-        )
+        role_name = role_name or self.role_name or DEFAULT_ROLE_NAME
+        client = AWSAPI(cache=self.cache, checkpoints=self.checkpoints, client_pool=self.clients.assume_role(role_arn(account_id, role_name), external_id=external_id))
+        client.account_id = account_id
+        return client
 
     def get_account_info(self):
         """
@@ -36,7 +96,7 @@ class AWSAPI(CloudAPI):
             found in the AWS documentation: 
             https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sts.html#STS.Client.get_caller_identity
         """
-        client = self.session.client('sts') 
+        client = self._client('sts') 
         identity = client.get_caller_identity()
         return identity['Account']
 
@@ -59,14 +119,20 @@ class AWSAPI(CloudAPI):
             More information about the AWS Organizations ListAccounts operation can be found in the 
             AWS documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/organizations.html#Organizations.Client.list_accounts
         """
-        client = self.session.client('organizations') 
-        paginator = client.get_paginator('list_accounts')
+        client = self._client('organizations') 
+        limiter = ratelimit.get_limiter(self.name, 'organizations')
+        labels = {'provider': self.name, 'scope': None, 'operation': 'list_accounts'}
         accounts = []
+        request = {}
         try:
-            for page in paginator.paginate():
+            # paged by hand rather than with a paginator, so every page goes through the limiter and its retries
+            while True:
+                page = ratelimit.call(client.list_accounts, limiter=limiter, labels=labels, connection_errors=CONNECTION_ERRORS, **request)
                 for account in page['Accounts']:
                     accounts.append(account['Id'])
-                    # print(account['Id'])
+                if not page.get('NextToken'):
+                    break
+                request['NextToken'] = page['NextToken']
         except client.exceptions.AWSOrganizationsNotInUseException as e:
             print("Your account is not a member of an organization.")
             return False
@@ -76,13 +142,40 @@ class AWSAPI(CloudAPI):
 
         return accounts
 
-    def get_cost(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+    def get_scopes(self):
+        """
+        Returns the accounts of the organization, or just the current account if it's not part of one.
+        """
+        accounts = self.get_all_accounts()
+        if not accounts:
+            accounts = [self.get_account_info()]
+        return accounts
+
+    def get_scope_cost(self, scope: Optional[str], start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], detailed: bool = False):
+        # the caller's own account (usually the management account) has no role to assume, its credentials already see the costs
+        if self.role_name and scope and scope != self._get_caller_account_id():
+            return self.for_account(scope).get_cost(start_date, end_date)
+        return self.get_cost(start_date, end_date, account_id=scope)
+
+    def _get_caller_account_id(self):
+        if self._caller_account_id is None:
+            self._caller_account_id = self.get_account_info()
+        return self._caller_account_id
+
+    def split_by_day(self, data):
+        days = {}
+        for result in data or []:
+            days.setdefault(result['TimePeriod']['Start'][:10], []).append(result)
+        return days
+
+    def get_cost(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], account_id: Optional[str] = None,
+                 max_workers: int = 1, shard_days: Optional[int] = None, query: Optional[CostQuery] = None):
         """
         Retrieves the cost of AWS services used over a specified time period.
 
         This function calls the AWS Cost Explorer GetCostAndUsage operation, which
         provides metrics associated with your AWS costs, split by service and usage type.
-        Costs are presented on a daily basis.
+        Costs are presented on a daily basis, unless a `query` asks for something else.
 
         Args:
             start_date (datetime.datetime): The start date for retrieving AWS cost data.
@@ -91,10 +184,21 @@ class AWSAPI(CloudAPI):
             end_date (datetime.datetime): The end date for retrieving AWS cost data.
                 Data is returned for a time period that begins at the start date and
                 ends at the end date.
+            account_id (str, optional): Only return the costs of this linked account. Without it
+                the costs of all accounts visible to the caller are returned. Note that every
+                Cost Explorer request is billed, so fetching accounts one by one costs more.
+            max_workers (int, optional): With more than one worker the range is split into shards
+                (calendar months unless `shard_days` is given) that are fetched concurrently, each
+                following its own pagination, and the results are merged in date order.
+            shard_days (int, optional): Split the range into shards of this many days instead of months.
+                Each shard is cached separately, so closed months are reused across queries. Ignored
+                with monthly granularity: the shards are calendar months, so no month is split up.
+            query (CostQuery, optional): Granularity, metrics, grouping and filters to ask Cost Explorer
+                for, so it aggregates and filters the data instead of the caller. Defaults to `DEFAULT_QUERY`.
 
         Returns:
             list: A list of results by time. Each result includes the time period and metrics
-            associated with the AWS costs, grouped by service and usage type.
+            associated with the AWS costs, grouped by service and usage type (or as the query says).
 
         Raises:
             botocore.exceptions.BotoCoreError: If there's an issue when making the request to AWS.
@@ -111,47 +215,69 @@ class AWSAPI(CloudAPI):
 
         start_date_str = start_date.strftime('%Y-%m-%d')
         end_date_str = end_date.strftime('%Y-%m-%d')
-        results_by_time = []
 
-        client = self.session.client('ce')
-
-        response = client.get_cost_and_usage(
-            TimePeriod={
-                'Start': start_date_str,
-                'End': end_date_str
-            },
-            Granularity='DAILY',
-            Metrics=[
-                'UnblendedCost',
-            ],
-            GroupBy=[
-                {'Type': 'DIMENSION', 'Key': 'SERVICE'},
-                {'Type': 'DIMENSION', 'Key': 'USAGE_TYPE'},
-            ],
-        )
-        results_by_time += response['ResultsByTime']
-        if 'NextPageToken' in response:
-            next_page_token = response['NextPageToken']
-            while True:
-                response = client.get_cost_and_usage(
-                    TimePeriod={
-                        'Start': start_date_str,
-                        'End': end_date_str
-                    },
-                    Granularity='DAILY',
-                    Metrics=[
-                        'UnblendedCost',
-                    ],
-                    GroupBy=[
-                        {'Type': 'DIMENSION', 'Key': 'SERVICE'},
-                        {'Type': 'DIMENSION', 'Key': 'USAGE_TYPE'},
-                    ],
-                    NextPageToken = next_page_token
-                )
-                results_by_time += response['ResultsByTime']
-                if 'NextPageToken' in response:
-                    next_page_token = response['NextPageToken']
-                else:
-                    break
+        request = (query or DEFAULT_QUERY).aws_request(start_date_str, end_date_str, account_id=account_id)
+
+        if max_workers <= 1 and not shard_days:
+            return self._cached(account_id or self.account_id, request, end_date, lambda: self._get_cost_and_usage(request, account_id))
+
+        if request['Granularity'] == 'MONTHLY':
+            # a month split over two shards would come back as two partial periods
+            shard_days = None
+        shard_requests = []
+        for shard_start, shard_end in split_range(start_date, end_date, days=shard_days):
+            shard_request = dict(request, TimePeriod={'Start': shard_start.isoformat(), 'End': shard_end.isoformat()})
+            shard_requests.append((shard_request, shard_end))
+        max_workers = max(1, min(max_workers, len(shard_requests)))
+
+        def fetch_shard(shard_request, shard_end):
+            # every worker thread gets a client of its own from the pool
+            return self._cached(account_id or self.account_id, shard_request, shard_end, lambda: self._get_cost_and_usage(shard_request, account_id))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            shard_results = list(executor.map(lambda shard: fetch_shard(*shard), shard_requests))
+
+        results_by_time = [result for shard_result in shard_results for result in shard_result]
+        results_by_time.sort(key=lambda result: result['TimePeriod']['Start'])
+        return results_by_time
+
+    def get_cost_table(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], account_id: Optional[str] = None,
+                       query: Optional[CostQuery] = None):
+        """
+        Same as `get_cost`, but flattened into a `pyarrow.Table` with one row per day, service
+        and usage type (or per period and group of the `query`), and a float column per metric,
+        e.g. `UnblendedCost`. Requires pyarrow (`pip install finops_crawler[arrow]`).
+        """
+        query = query or DEFAULT_QUERY
+        group_by = [group['Key'] for group in query.aws_group_by]
+        return columnar.aws_results_to_arrow(self.get_cost(start_date, end_date, account_id=account_id, query=query), group_by=group_by)
+
+    def _get_cost_and_usage(self, request: dict, account_id: Optional[str] = None):
+        client = self._client('ce')
 
+        # Cost Explorer throttles per account, all clients of an account share one limiter and back off together
+        limiter = ratelimit.get_limiter(self.name, 'ce' if self.account_id is None else f'ce:{self.account_id}')
+        # the linked account the request is filtered on, not whatever the first filter of a query happens to be
+        labels = {'provider': self.name, 'scope': account_id or self.account_id, 'operation': 'get_cost_and_usage'}
+
+        def fetch_page(next_page_token):
+            page_request = dict(request, NextPageToken=next_page_token) if next_page_token else request
+            response = ratelimit.call(client.get_cost_and_usage, limiter=limiter, labels=labels, connection_errors=CONNECTION_ERRORS,
+                                      **page_request)
+            self._count_page(response, labels)
+            return response['ResultsByTime'], response.get('NextPageToken')
+
+        results_by_time = []
+        # with checkpoints, the pages fetched before an interrupted run are read from the store
+        for page in paginate(self.checkpoints, self.name, labels['scope'], request, fetch_page, is_expired=self._is_expired_token):
+            results_by_time += page
         return results_by_time
+
+    @staticmethod
+    def _is_expired_token(error: Exception):
+        return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') == 'InvalidNextTokenException'
+
+    @staticmethod
+    def _count_page(response: dict, labels: dict):
+        metrics.inc('pages', **labels)
+        metrics.inc('rows', sum(len(result.get('Groups') or ()) or 1 for result in response['ResultsByTime']), **labels)
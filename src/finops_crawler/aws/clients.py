@@ -0,0 +1,130 @@
+import threading
+from typing import Optional
+import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.credentials import CredentialProvider, DeferredRefreshableCredentials
+
+DEFAULT_ROLE_NAME = 'OrganizationAccountAccessRole'
+
+# the calls of these services are retried by ratelimit.call, botocore retrying them as well would hide the throttling from the limiter
+# (botocore's `max_attempts` counts the retries, `total_max_attempts` the first attempt as well)
+_RATE_LIMITED_CONFIG = Config(retries={'total_max_attempts': 1, 'mode': 'standard'})
+SERVICE_CONFIGS = {
+    'ce': _RATE_LIMITED_CONFIG,
+    'organizations': _RATE_LIMITED_CONFIG,
+}
+
+
+class _PoolCredentialProvider(CredentialProvider):
+    # hands the credentials of a pool to the botocore sessions of its threads, ahead of the environment and config files
+    METHOD = 'finops-crawler-pool'
+
+    def __init__(self, credentials):
+        super().__init__()
+        self._credentials = credentials
+
+    def load(self):
+        return self._credentials
+
+
+class ClientPool:
+    """
+    Lazily created boto3 clients, cached per thread and service.
+
+    Creating a client loads and parses the service model, which takes tens of milliseconds
+    and several MB, and boto3 sessions must not be shared between threads. The pool keeps
+    one session per thread and reuses its clients for every later call from that thread.
+
+    `assume_role` returns a pool for another account, whose STS credentials are cached and
+    refreshed automatically before they expire. They're shared by all threads of that pool.
+    """
+
+    def __init__(self, aws_access_key_id: Optional[str] = None, aws_secret_access_key: Optional[str] = None,
+                 aws_session_token: Optional[str] = None, region_name: Optional[str] = None, credentials=None):
+        """
+        Args:
+            aws_access_key_id (str, optional): AWS Access Key ID. If not provided, boto3 will
+                fall back to the credentials stored in your environment.
+            aws_secret_access_key (str, optional): AWS Secret Access Key.
+            aws_session_token (str, optional): AWS session token, for temporary credentials.
+            region_name (str, optional): Region of the clients.
+            credentials (botocore.credentials.Credentials, optional): Use these credentials instead
+                of the keys, e.g. refreshable ones.
+        """
+        self._session_args = {
+            'aws_access_key_id': aws_access_key_id,
+            'aws_secret_access_key': aws_secret_access_key,
+            'aws_session_token': aws_session_token,
+            'region_name': region_name,
+        }
+        self._credentials = credentials
+        self._local = threading.local()
+        self._role_pools = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        The boto3 session of the current thread.
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            if self._credentials is not None:
+                botocore_session = botocore.session.get_session()
+                botocore_session.get_component('credential_provider').insert_before('env', _PoolCredentialProvider(self._credentials))
+                session = boto3.Session(botocore_session=botocore_session, region_name=self._session_args['region_name'])
+            else:
+                session = boto3.Session(**self._session_args)
+            self._local.session = session
+            self._local.clients = {}
+        return session
+
+    def client(self, service_name: str):
+        """
+        Returns the client of a service for the current thread, creating it on first use.
+        """
+        session = self.session
+        clients = self._local.clients
+        if service_name not in clients:
+            clients[service_name] = session.client(service_name, config=SERVICE_CONFIGS.get(service_name))
+        return clients[service_name]
+
+    def assume_role(self, role_arn: str, session_name: str = 'finops_crawler', external_id: Optional[str] = None):
+        """
+        Returns a pool whose clients act as `role_arn`. The pool is cached, so asking for the
+        same role again reuses its clients and credentials.
+
+        The role is assumed on the first request of the pool rather than here, so the STS call
+        doesn't hold up the threads asking for other roles.
+
+        Args:
+            role_arn (str): ARN of the role to assume, see `role_arn()`.
+            session_name (str, optional): Role session name, shows up in CloudTrail.
+            external_id (str, optional): External ID required by the role's trust policy.
+        """
+        key = (role_arn, session_name, external_id)
+        with self._lock:
+            pool = self._role_pools.get(key)
+            if pool is None:
+                def refresh():
+                    # uses the STS client of whichever thread happens to trigger the refresh
+                    request = {'RoleArn': role_arn, 'RoleSessionName': session_name}
+                    if external_id:
+                        request['ExternalId'] = external_id
+                    credentials = self.client('sts').assume_role(**request)['Credentials']
+                    return {
+                        'access_key': credentials['AccessKeyId'],
+                        'secret_key': credentials['SecretAccessKey'],
+                        'token': credentials['SessionToken'],
+                        'expiry_time': credentials['Expiration'].isoformat(),
+                    }
+                # fetched (and refreshed) under the credentials' own lock, not the pool's
+                credentials = DeferredRefreshableCredentials(refresh_using=refresh, method='sts-assume-role')
+                pool = ClientPool(region_name=self._session_args['region_name'], credentials=credentials)
+                self._role_pools[key] = pool
+            return pool
+
+
+def role_arn(account_id: str, role_name: str = DEFAULT_ROLE_NAME):
+    return f'arn:aws:iam::{account_id}:role/{role_name}'
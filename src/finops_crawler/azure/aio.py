@@ -0,0 +1,240 @@
+import asyncio
+import datetime
+import os
+from typing import Optional, Union
+from finops_crawler import aio
+from finops_crawler import ratelimit
+from finops_crawler import metrics
+from finops_crawler.azure import blobs
+from finops_crawler.azure.api import AzureAPI
+from finops_crawler.azure.auth import TokenProvider, get_token_provider
+from finops_crawler.base import EmptyResultError
+from finops_crawler.cache import CostCache
+from finops_crawler.query import CostQuery
+
+
+class AsyncAzureAPI(aio.AsyncCloudAPI):
+    """
+    The asyncio counterpart of `AzureAPI`. Builds the same requests and returns the same data.
+
+    The access token is fetched on the first request instead of in the constructor. Tokens come
+    from the same `TokenProvider` as for the synchronous clients. Unlike `AzureAPI` it takes no
+    `checkpoints`: an interrupted query is fetched again from the first page.
+
+    Example:
+        async with AsyncAzureAPI(*credentials.get_credentials('azure')) as client:
+            result = await aio.crawl(client, '2023-10-01', '2023-10-31')
+    """
+
+    name = AzureAPI.name
+    end_date_inclusive = AzureAPI.end_date_inclusive
+
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str, session=None, cache: Optional[CostCache] = None,
+                 token_provider: Optional[TokenProvider] = None):
+        """
+        Args:
+            tenant_id (str): Azure tenant ID. Falls back to the AZURE_TENANT_ID environment variable if None.
+            client_id (str): Service principal client (app) ID. Falls back to AZURE_CLIENT_ID if None.
+            client_secret (str): Service principal secret. Falls back to AZURE_CLIENT_SECRET if None.
+            session (aiohttp.ClientSession, optional): Session used for all requests, see `aio.create_session`.
+            cache (CostCache, optional): Cache for `get_cost` results.
+            token_provider (TokenProvider, optional): Where to get access tokens from. Defaults to the process-wide provider.
+        """
+        super().__init__(session)
+        self.cache = cache
+        if tenant_id is None:
+            tenant_id = os.getenv('AZURE_TENANT_ID')
+        if not tenant_id:
+            raise ValueError('AZURE_TENANT_ID not set')
+
+        if client_id is None:
+            client_id = os.getenv('AZURE_CLIENT_ID')
+        if not client_id:
+            raise ValueError('AZURE_CLIENT_ID not set')
+
+        if client_secret is None:
+            client_secret = os.getenv('AZURE_CLIENT_SECRET')
+        if not client_secret:
+            raise ValueError('AZURE_CLIENT_SECRET not set')
+
+        self.token_provider = token_provider if token_provider is not None else get_token_provider()
+        self._credentials = (tenant_id, client_id, client_secret)
+
+    async def _get_headers(self):
+        token = self.token_provider.cached_token(*self._credentials[:2])
+        if token is None:
+            # the token request is rare and short, run it off the event loop rather than duplicating the provider
+            token = await asyncio.to_thread(self.token_provider.get_token, *self._credentials)
+        return {'Authorization': f'Bearer {token}'}
+
+    async def _request(self, method: str, url: str, scope: Optional[str] = None, operation: Optional[str] = None, **kwargs):
+        # shares the per-subscription rate limiters with the synchronous clients
+        limiter = ratelimit.get_limiter(self.name, scope)
+        labels = {'provider': self.name, 'scope': scope, 'operation': operation}
+        session = await self._get_session()
+        response = await aio.request(session, method, url, limiter=limiter, labels=labels, headers=await self._get_headers(), **kwargs)
+        if response.status == 401:
+            metrics.inc('retries', reason='401', **labels)
+            self.token_provider.invalidate(*self._credentials[:2])
+            response = await aio.request(session, method, url, limiter=limiter, labels=labels, headers=await self._get_headers(), **kwargs)
+        await aio.raise_for_status(response)
+        return response
+
+    async def get_all_subscriptions(self):
+        url = 'https://management.azure.com/subscriptions?api-version=2020-01-01'
+        response = await self._request('GET', url, operation='subscriptions')
+        result = (await response.json())['value']
+        if len(result) == 0:
+            print("Result retrieved successfully, but it contains no data.")
+            raise EmptyResultError("Empty result")
+        return [s['subscriptionId'] for s in result]
+
+    async def get_scopes(self):
+        return await self.get_all_subscriptions()
+
+    async def get_scope_cost(self, scope: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], detailed: bool = False):
+        if detailed:
+            return await self.get_cost_detailed(scope, start_date, end_date)
+        return await self.get_cost(scope, start_date, end_date)
+
+    def split_by_day(self, data):
+        return AzureAPI.split_by_day(self, data)
+
+    async def get_cost(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                       chunk_days: Optional[int] = None, query: Optional[CostQuery] = None):
+        """
+        Retrieves the daily cost of a subscription, grouped by ResourceId and ChargeType.
+
+        Same as `AzureAPI.get_cost`; when the range is split into windows, they are all fetched concurrently.
+
+        Returns:
+            list: A list of dicts with the fields UsageDate, ResourceId, ChargeType, Currency and Cost,
+            or None if there is no data.
+        """
+        async def fetch_chunk(chunk):
+            body = AzureAPI._chunk_body(chunk, query)
+            try:
+                return await self._cached_query(subscription_id, body, chunk[1])
+            except EmptyResultError:
+                return []
+
+        chunk_results = await asyncio.gather(*(fetch_chunk(chunk) for chunk in AzureAPI._chunks(start_date, end_date, chunk_days)))
+        data = AzureAPI._merge_chunks(chunk_results, query)
+
+        if len(data) > 0:
+            return data
+        else:
+            print("Result retreived successfully, but it contains no data. It might be a very new subscription.")
+            return None
+
+    async def _cached_query(self, subscription_id: str, body: dict, end_date):
+        if self.cache is None:
+            return await self._query(subscription_id, body)
+        key = self.cache.key(self.name, subscription_id, body)
+        data = self.cache.get(key)
+        if data is None:
+            data = await self._query(subscription_id, body)
+            if data:
+                self.cache.set(key, data, end_date)
+        return data
+
+    async def _query(self, subscription_id: str, body: dict):
+        url = f'https://management.azure.com/subscriptions/{subscription_id}/providers/Microsoft.CostManagement/query?api-version=2019-11-01'
+        data = []
+        next_link = url
+        while next_link:
+            response = await self._request('POST', next_link, scope=subscription_id, operation='query', json=body)
+            result = (await response.json())['properties']
+            if len(result['rows']) == 0:
+                print("Result retrieved successfully, but it contains no data. It might be a very new subscription.")
+                raise EmptyResultError("Empty result")
+            metrics.inc('pages', provider=self.name, scope=subscription_id, operation='query')
+            metrics.inc('rows', len(result['rows']), provider=self.name, scope=subscription_id, operation='query')
+            data += AzureAPI._page_rows(result)
+            next_link = result.get('nextLink')
+        return data
+
+    async def get_cost_detailed(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+        data = [row async for row in self.iter_cost_detailed(subscription_id, start_date, end_date)]
+        if len(data) > 0:
+            return data
+        else:
+            print("Result retreived successfully, but it contains no data. It might be a very new subscription.")
+            return None
+
+    async def iter_cost_detailed(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                                 blob_retries: int = 3):
+        """
+        Streams the amortized cost details of a subscription row by row, like `AzureAPI.iter_cost_detailed`.
+
+        Polling the report generation sleeps on the event loop, so many reports can be
+        waited for at the same time.
+
+        Args:
+            subscription_id (str): Azure subscription ID.
+            start_date (datetime.datetime): The start date of the report.
+            end_date (datetime.datetime): The end date of the report.
+            blob_retries (int, optional): How many times to retry a failed blob download. The blob is
+                requested again and the rows it already yielded are skipped.
+
+        Yields:
+            dict: One row of the cost details CSV.
+        """
+        manifest = await self._generate_cost_details_report(subscription_id, start_date, end_date)
+        session = await self._get_session()
+        labels = {'provider': self.name, 'scope': subscription_id, 'operation': 'blob'}
+        metrics.inc('pages', manifest['blobCount'], **labels)
+        for i in range(manifest['blobCount']):
+            async for row in _iter_blob_rows(session, manifest['blobs'][i]['blobLink'], blob_retries, labels):
+                yield row
+
+    async def _generate_cost_details_report(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+        body = AzureAPI._report_body(start_date, end_date)
+        url = f'https://management.azure.com/subscriptions/{subscription_id}/providers/Microsoft.CostManagement/generateCostDetailsReport?api-version=2022-05-01'
+        response = await self._request('POST', url, scope=subscription_id, operation='report_submit', json=body)
+
+        while response.status == 202:
+            retry_after = int(response.headers.get('Retry-After', 5))
+            url = response.headers.get('Location')
+            if url is None:
+                raise ValueError("Location for polling missing")
+            metrics.inc('sleep_seconds', retry_after, provider=self.name, scope=subscription_id, reason='report_poll')
+            await asyncio.sleep(retry_after)
+            response = await self._request('GET', url, scope=subscription_id, operation='report_poll')
+
+        result = await response.json()
+        if result['status'] != 'Completed':
+            print(f"Result retrieved successfully, but status is {result['status']} instead of Completed")
+            raise EmptyResultError("Empty result")
+
+        return result['manifest']
+
+
+async def _iter_blob_rows(session, blob_link: str, retries: int, labels: dict, backoff: float = 1.0):
+    # the asyncio counterpart of blobs.iter_blob_rows: after a failed download the blob is requested again
+    # and the rows that were already yielded are skipped
+    aiohttp = aio._aiohttp()
+    yielded = 0
+    attempt = 0
+    while True:
+        try:
+            # the blob links are pre-signed, so no authorization header
+            async with session.get(blob_link) as response:
+                await aio.raise_for_status(response)
+                rows = 0
+                try:
+                    async for row in aio.iter_csv_rows(response.content.iter_chunked(1024 * 1024)):
+                        rows += 1
+                        if rows > yielded:
+                            yielded = rows
+                            yield row
+                finally:
+                    metrics.inc('rows', rows, **labels)
+                    metrics.inc('bytes', response.content.total_bytes, **labels)
+            return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            delay = blobs._retry_delay(getattr(e, 'status', None), attempt, retries, backoff, labels)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -1,15 +1,56 @@
+import concurrent.futures
 import datetime
 import time
 import requests
 import os
-import csv
-import io
-from typing import Union
-from finops_crawler.base import CloudAPI
+import itertools
+import tempfile
+from typing import Optional, Union
+from finops_crawler.base import CloudAPI, EmptyResultError
+from finops_crawler.azure import blobs
+from finops_crawler.azure.csvparse import BlobParser
+from finops_crawler.azure.auth import TokenProvider, get_token_provider
+from finops_crawler.session import get_shared_session
+from finops_crawler import ratelimit
+from finops_crawler import metrics
+from finops_crawler.cache import CostCache
+from finops_crawler.checkpoints import CheckpointStore, paginate
+from finops_crawler import columnar
+from finops_crawler import schema
+from finops_crawler.dates import split_range, to_date
+from finops_crawler.query import CostQuery
+
+# daily actual cost per resource and charge type, what get_cost returns without a query
+DEFAULT_QUERY = CostQuery(granularity='daily', metrics=['cost'], group_by=['resource', 'charge_type'])
+
+# the longest time period a single query may cover, a year
+MAX_QUERY_DAYS = 366
 
 class AzureAPI(CloudAPI):
-    def __init__(self, tenant_id: str, client_id: str, client_secret: str):
-        # https://learn.microsoft.com/en-us/azure/active-directory/develop/v2-oauth2-client-creds-grant-flow#first-case-access-token-request-with-a-shared-secret
+    name = 'azure'
+    # the query API returns the last day of the timePeriod as well
+    end_date_inclusive = True
+
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str, session: Optional[requests.Session] = None,
+                 cache: Optional[CostCache] = None, token_provider: Optional[TokenProvider] = None,
+                 checkpoints: Optional[CheckpointStore] = None):
+        """
+        Initialize AzureAPI and get an access token for the Azure management API.
+
+        Args:
+            tenant_id (str): Azure tenant ID. Falls back to the AZURE_TENANT_ID environment variable if None.
+            client_id (str): Service principal client (app) ID. Falls back to AZURE_CLIENT_ID if None.
+            client_secret (str): Service principal secret. Falls back to AZURE_CLIENT_SECRET if None.
+            session (requests.Session, optional): HTTP session used for all requests. Defaults to the
+                process-wide pooled session, see `finops_crawler.session`.
+            cache (CostCache, optional): Cache for `get_cost` results.
+            token_provider (TokenProvider, optional): Where to get access tokens from. Defaults to the
+                process-wide provider, which caches and refreshes tokens for all clients, see `finops_crawler.azure.auth`.
+            checkpoints (CheckpointStore, optional): Store every page of a query as it arrives, so that a crawl
+                that dies midway through a nextLink chain resumes at the next page.
+        """
+        self.cache = cache
+        self.checkpoints = checkpoints
         if tenant_id is None:
             tenant_id = os.getenv('AZURE_TENANT_ID')
         if not tenant_id:
@@ -25,45 +66,115 @@ class AzureAPI(CloudAPI):
         if not client_secret:
             raise ValueError('AZURE_CLIENT_SECRET not set')
 
-        url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-
-        payload = {
-            'grant_type': 'client_credentials',
-            'client_id': client_id,
-            'client_secret': client_secret,
-            'scope': 'https://management.azure.com/.default'
-        }
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        response = requests.post(url, headers=headers, data=payload, timeout=10)
-        response_json = response.json()
-
-        access_token = response_json.get('access_token')
-
-        self.headers = {'Authorization': f'Bearer {access_token}'}
-
+        self.session = session if session is not None else get_shared_session()
+        self.token_provider = token_provider if token_provider is not None else get_token_provider()
+        self._credentials = (tenant_id, client_id, client_secret)
+        # fail early on wrong credentials; the token is cached, so further clients don't fetch it again
+        self.token_provider.get_token(*self._credentials)
+
+    @property
+    def headers(self):
+        return {'Authorization': f'Bearer {self.token_provider.get_token(*self._credentials)}'}
+
+    def _request(self, method: str, url: str, scope: Optional[str] = None, operation: Optional[str] = None, **kwargs):
+        # management API calls are paced by a rate limiter per subscription shared by all clients,
+        # and retried when throttled (honoring Retry-After and the x-ms-ratelimit-* headers)
+        limiter = ratelimit.get_limiter(self.name, scope)
+        labels = {'provider': self.name, 'scope': scope, 'operation': operation}
+        response = ratelimit.request(self.session, method, url, limiter=limiter, labels=labels, headers=self.headers, **kwargs)
+        if response.status_code == 401:
+            # the token was revoked or expired early, try once more with a new one
+            metrics.inc('retries', reason='401', **labels)
+            self.token_provider.invalidate(*self._credentials[:2])
+            response = ratelimit.request(self.session, method, url, limiter=limiter, labels=labels, headers=self.headers, **kwargs)
+        return response
 
     def get_all_subscriptions(self):
         # https://azuresdkdocs.blob.core.windows.net/$web/python/azure-mgmt-resource/23.0.0/azure.mgmt.resource.subscriptions.html#module-azure.mgmt.resource.subscriptions
         # make the POST request to the Cost Management API
         url = 'https://management.azure.com/subscriptions?api-version=2020-01-01'
 
-        response = requests.get(url=url, headers=self.headers)
+        response = self._request('GET', url, operation='subscriptions')
         try:
             response.raise_for_status()
         except requests.HTTPError as e:
-            print(f"API returned error {response.status_code}: {response.reason}. Message: {response.json()['error']['message']}")
+            print(f"API returned error {response.status_code}: {response.reason}. Message: {_error_message(response)}")
             raise
 
         result = response.json()['value']
         if len(result) == 0:
             print("Result retrieved successfully, but it contains no data.")
-            raise ValueError("Empty result")
+            raise EmptyResultError("Empty result")
 
         subscriptions = [s['subscriptionId'] for s in result]
         return subscriptions
 
+    def get_scopes(self):
+        return self.get_all_subscriptions()
+
+    def get_scope_cost(self, scope: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], detailed: bool = False):
+        if detailed:
+            return self.get_cost_detailed(scope, start_date, end_date)
+        return self.get_cost(scope, start_date, end_date)
+
+
+    def split_by_day(self, data):
+        # monthly rows (BillingMonth) are keyed by the first day of their month
+        if not data:
+            return {}
+        column = schema.azure_query_date_column(data[0])
+        days = {}
+        for row, day in zip(data, schema.azure_query_dates([row[column] for row in data], column)):
+            days.setdefault(day, []).append(row)
+        return days
+
+    def get_cost(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                 max_workers: int = 1, chunk_days: Optional[int] = None, query: Optional[CostQuery] = None):
+        """
+        Retrieves the daily cost of a subscription, grouped by ResourceId and ChargeType.
+
+        Ranges longer than the query API accepts (`MAX_QUERY_DAYS`) are split into monthly
+        windows, or `chunk_days` long ones if given, which also keeps the nextLink chains short.
+        Shorter ranges are a single query, as every query counts against the quota. The windows
+        can be fetched concurrently; they still share the rate limit of the subscription. The
+        results are stitched together in date order and de-duplicated by (UsageDate, ResourceId,
+        ChargeType). With a coarser granularity than daily, the rows of the same period from
+        different windows are added up.
+
+        Args:
+            subscription_id (str): Azure subscription ID.
+            start_date (datetime.datetime): The first day of the range.
+            end_date (datetime.datetime): The last day of the range, included in the result.
+            max_workers (int, optional): Number of windows fetched concurrently.
+            chunk_days (int, optional): Split the range into windows of this many days, however long it is.
+            query (CostQuery, optional): Granularity, metrics, grouping and filters to ask Cost Management
+                for, so it aggregates and filters the data instead of the caller. Defaults to `DEFAULT_QUERY`.
+
+        Returns:
+            list: A list of dicts with the fields UsageDate, ResourceId, ChargeType, Currency and Cost
+            (or the columns of the query), or None if there is no data.
+        """
+        data = self._query_chunks(subscription_id, self._chunks(start_date, end_date, chunk_days), max_workers, query)
+
+        if len(data) > 0:
+            return data
+        else:
+            print("Result retreived successfully, but it contains no data. It might be a very new subscription.")
+            return None
+
+    def get_cost_table(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                       query: Optional[CostQuery] = None):
+        """
+        Same as `get_cost`, but returns a `pyarrow.Table` built directly from the positional rows of the API.
+
+        `UsageDate` becomes a date column and `Cost` a float column. Requires pyarrow
+        (`pip install finops_crawler[arrow]`).
+        """
+        body = self._chunk_body((to_date(start_date), to_date(end_date)), query)
+        return columnar.azure_query_to_arrow(self._iter_query_pages(subscription_id, body))
 
-    def get_cost(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+    @staticmethod
+    def _query_body(start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], query: Optional[CostQuery] = None):
         if isinstance(start_date, str):
             start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d')
         if isinstance(end_date, str):
@@ -73,74 +184,105 @@ class AzureAPI(CloudAPI):
         end_date_str = end_date.strftime('%Y-%m-%dT%H:%M:%SZ')
 
         # build the body for the request
-        body = {
-            'type': 'ActualCost',
-            'timeframe': 'Custom',
-            'timePeriod': {
-            'from': start_date_str,
-            'to': end_date_str
-            },
-            'dataset': {
-            'granularity': 'Daily',
-            'aggregation': {
-                'totalCost': {
-                'name': 'Cost',
-                'function': 'Sum'
-                }
-            },
-            'grouping': [
-                {'type': 'Dimension', 'name': 'ResourceId'},
-                {'type': 'Dimension', 'name': 'ChargeType'}
-            ]
-            }
-        }
+        return (query or DEFAULT_QUERY).azure_body(start_date_str, end_date_str)
+
+    @staticmethod
+    def _chunks(start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], chunk_days: Optional[int] = None):
+        # the (first day, last day) windows of a range, a single one unless it has to be split
+        start, end = to_date(start_date), to_date(end_date)
+        if chunk_days or (end - start).days + 1 > MAX_QUERY_DAYS:
+            return split_range(start, end, days=chunk_days, end_inclusive=True)
+        return [(start, end)]
+
+    def _query_chunks(self, subscription_id: str, chunks: list, max_workers: int, query: Optional[CostQuery] = None):
+        def fetch_chunk(chunk):
+            body = self._chunk_body(chunk, query)
+            try:
+                return self._cached(subscription_id, body, chunk[1], lambda: self._query(subscription_id, body))
+            except EmptyResultError:
+                # e.g. the subscription didn't exist yet at the start of the range
+                return []
 
+        if len(chunks) <= 1 or max_workers <= 1:
+            chunk_results = [fetch_chunk(chunk) for chunk in chunks]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+                chunk_results = list(executor.map(fetch_chunk, chunks))
+        return self._merge_chunks(chunk_results, query)
+
+    @staticmethod
+    def _chunk_body(chunk, query: Optional[CostQuery] = None):
+        chunk_start, chunk_end = chunk
+        # the window ends at the end of its last day, so consecutive windows neither overlap nor leave gaps
+        return AzureAPI._query_body(chunk_start, datetime.datetime.combine(chunk_end, datetime.time(23, 59, 59)), query)
+
+    @staticmethod
+    def _merge_chunks(chunk_results, query: Optional[CostQuery] = None):
+        if not any(chunk_results):
+            print("Result retrieved successfully, but it contains no data. It might be a very new subscription.")
+            raise EmptyResultError("Empty result")
+        if len(chunk_results) == 1:
+            return chunk_results[0]
+        query = query or DEFAULT_QUERY
+        metric_columns = query.azure_metric_columns
+        data = {}
+        for rows in chunk_results:
+            for row in rows:
+                key = tuple(value for column, value in row.items() if column not in metric_columns)
+                if query.granularity == 'daily' or key not in data:
+                    data[key] = row
+                else:
+                    # a month (or the total) that spans several windows
+                    data[key] = dict(data[key], **{column: data[key][column] + row[column] for column in metric_columns})
+        return list(data.values())
+
+    def _query(self, subscription_id: str, body: dict):
         data = []
+        for result in self._iter_query_pages(subscription_id, body):
+            data += self._page_rows(result)
+        return data
+
+    @staticmethod
+    def _page_rows(result: dict):
+        column_names = [column['name'] for column in result['columns']]
+        return [dict(zip(column_names, row)) for row in result['rows']]
+
+    def _iter_query_pages(self, subscription_id: str, body: dict):
+        # yields the 'properties' of every page of the result, with 'columns' and positional 'rows'
 
         # make the POST request to the Cost Management API
         url = f'https://management.azure.com/subscriptions/{subscription_id}/providers/Microsoft.CostManagement/query?api-version=2019-11-01'
-        response = requests.post(url=url, headers=self.headers, json=body)
-        try:
-            response.raise_for_status()
-        except requests.HTTPError as e:
-            print(f"API returned error {response.status_code}: {response.reason}. Message: {response.json()['error']['message']}")
-            raise
 
-        result = response.json()['properties']
-        if len(result['rows']) > 0:
-            column_names = [column['name'] for column in result['columns']]
-            rows = [dict(zip(column_names, row)) for row in result['rows']]
-        else:
-            print("Result retrieved successfully, but it contains no data. It might be a very new subscription.")
-            raise ValueError("Empty result")
-
-        data += rows
+        def fetch_page(next_link):
+            response = self._request('POST', next_link or url, scope=subscription_id, operation='query', json=body)
+            try:
+                response.raise_for_status()
+            except requests.HTTPError as e:
+                print(f"API returned error {response.status_code}: {response.reason}. Message: {_error_message(response)}")
+                raise
 
-        # check if there's a nextLink field in the response
-        if 'nextLink' in result:
-            next_link = result['nextLink']
+            result = response.json()['properties']
+            if len(result['rows']) == 0:
+                print("Result retrieved successfully, but it contains no data. It might be a very new subscription.")
+                raise EmptyResultError("Empty result")
+            metrics.inc('pages', provider=self.name, scope=subscription_id, operation='query')
+            metrics.inc('rows', len(result['rows']), provider=self.name, scope=subscription_id, operation='query')
 
             # while there is a next link, get the next page of results
-            while next_link:
-                response = requests.post(next_link, headers=self.headers, json=body)
-                if response.status_code == 429:
-                    time.sleep(10)
-                    continue
-                result = response.json()['properties']
-                if len(result['rows']) > 0:
-                    column_names = [column['name'] for column in result['columns']]
-                    rows = [dict(zip(column_names, row)) for row in result['rows']]
-                else:
-                    print("Result retrieved successfully, but it contains no data. It might be a very new subscription.")
-                    raise ValueError("Empty result")
+            return result, result.get('nextLink')
 
-                # print(f"Results in this batch: {len(rows)}")
-                data += rows
+        # with checkpoints, the pages fetched before an interrupted run are read from the store
+        yield from paginate(self.checkpoints, self.name, subscription_id, body, fetch_page, is_expired=self._is_expired_link)
 
-                # update the next_link value
-                next_link = result.get('nextLink')
-        # print(f"Total rows found: {len(data)}")
+    @staticmethod
+    def _is_expired_link(error: Exception):
+        # the skiptoken of a nextLink is rejected once it has expired
+        return isinstance(error, requests.HTTPError) and error.response is not None and error.response.status_code in (400, 404, 410)
 
+    def get_cost_detailed(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+        # info: https://learn.microsoft.com/en-us/azure/cost-management-billing/automate/automation-ingest-usage-details-overview
+        # result: https://learn.microsoft.com/en-us/azure/cost-management-billing/automate/understand-usage-details-fields
+        data = list(self.iter_cost_detailed(subscription_id, start_date, end_date))
 
         if len(data) > 0:
             return data
@@ -148,9 +290,222 @@ class AzureAPI(CloudAPI):
             print("Result retreived successfully, but it contains no data. It might be a very new subscription.")
             return None
 
-    def get_cost_detailed(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
-        # info: https://learn.microsoft.com/en-us/azure/cost-management-billing/automate/automation-ingest-usage-details-overview
-        # result: https://learn.microsoft.com/en-us/azure/cost-management-billing/automate/understand-usage-details-fields
+    def iter_cost_detailed(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                           batch_size: Optional[int] = None, max_workers: int = 1, ordered: bool = True, blob_retries: int = 3):
+        """
+        Streams the amortized cost details of a subscription row by row.
+
+        Generates a cost details report the same way as `get_cost_detailed`, but instead of
+        downloading every blob into memory it reads each blob over the HTTP connection and
+        parses it incrementally, so peak memory does not depend on the size of the report.
+
+        Args:
+            subscription_id (str): Azure subscription ID.
+            start_date (datetime.datetime): The start date of the report.
+            end_date (datetime.datetime): The end date of the report.
+            batch_size (int, optional): If set, rows are yielded as lists of at most this many
+                rows instead of one by one.
+            max_workers (int, optional): Number of blobs to download concurrently. With more than one
+                worker the blobs are downloaded to temporary files in the background while the
+                previous blob is being parsed.
+            ordered (bool, optional): Keep the rows in blob order. Only relevant with `max_workers` > 1.
+            blob_retries (int, optional): How many times to retry a failed blob download. Only the
+                failing blob is downloaded again; a streamed blob skips the rows it already yielded.
+
+        Yields:
+            dict: One row of the cost details CSV, or a list of rows if `batch_size` is set.
+
+        Raises:
+            requests.HTTPError: If generating the report or downloading a blob fails.
+            ValueError: If the report does not complete.
+        """
+        manifest = self._generate_cost_details_report(subscription_id, start_date, end_date)
+        yield from self.iter_manifest_rows(manifest, batch_size=batch_size, max_workers=max_workers, ordered=ordered, blob_retries=blob_retries,
+                                           scope=subscription_id)
+
+    def iter_manifest_rows(self, manifest: dict, batch_size: Optional[int] = None, max_workers: int = 1, ordered: bool = True, blob_retries: int = 3,
+                           scope: Optional[str] = None):
+        """
+        Streams the rows of an already generated cost details report, see `iter_cost_detailed`.
+
+        Args:
+            manifest (dict): The `manifest` of a completed report, e.g. from `ReportJobManager`.
+            scope (str, optional): Subscription the report belongs to, used as a metrics label.
+        """
+        blob_links = [manifest['blobs'][i]['blobLink'] for i in range(manifest['blobCount'])]
+        labels = {'provider': self.name, 'scope': scope}
+        metrics.inc('pages', len(blob_links), operation='blob', **labels)
+        if max_workers > 1:
+            files = blobs.iter_downloaded_blobs(blob_links, max_workers=max_workers, ordered=ordered, retries=blob_retries,
+                                                 session=self.session, labels=labels)
+            rows = itertools.chain.from_iterable(blobs.read_blob_rows(file, labels=labels) for file in files)
+        else:
+            rows = itertools.chain.from_iterable(blobs.iter_blob_rows(blob_link, session=self.session, labels=labels, retries=blob_retries)
+                                                 for blob_link in blob_links)
+        if batch_size:
+            yield from _batched(rows, batch_size)
+        else:
+            yield from rows
+
+    def iter_cost_detailed_columns(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                                   columns: Optional[dict] = None, batch_size: int = 50000, max_workers: int = 1, ordered: bool = True,
+                                   blob_retries: int = 3):
+        """
+        Streams the amortized cost details of a subscription as batches of typed columns.
+
+        Same as `iter_cost_detailed`, but the blobs are parsed by a `csvparse.BlobParser`: only the
+        projected columns are kept, converted to floats, dates and interned strings, which is several
+        times faster and takes a fraction of the memory of a dict per row.
+
+        Args:
+            subscription_id (str): Azure subscription ID.
+            start_date (datetime.datetime): The start date of the report.
+            end_date (datetime.datetime): The end date of the report.
+            columns (dict, optional): Column name -> type, see `BlobParser`. Defaults to `csvparse.DEFAULT_COLUMNS`.
+            batch_size (int, optional): Rows per batch. Batches don't span blobs, so the last batch of a blob can be smaller.
+            max_workers (int, optional): Number of blobs to download concurrently, see `iter_cost_detailed`.
+            ordered (bool, optional): Keep the batches in blob order. Only relevant with `max_workers` > 1.
+            blob_retries (int, optional): How many times to retry a failed blob download, see `iter_cost_detailed`.
+
+        Yields:
+            dict: Column name -> list of values.
+        """
+        parser = BlobParser(columns)
+        manifest = self._generate_cost_details_report(subscription_id, start_date, end_date)
+        blob_links = [manifest['blobs'][i]['blobLink'] for i in range(manifest['blobCount'])]
+        labels = {'provider': self.name, 'scope': subscription_id}
+        metrics.inc('pages', len(blob_links), operation='blob', **labels)
+        if max_workers > 1:
+            files = blobs.iter_downloaded_blobs(blob_links, max_workers=max_workers, ordered=ordered, retries=blob_retries,
+                                                 session=self.session, labels=labels)
+            for file in files:
+                yield from blobs.read_blob_columns(file, parser, batch_size=batch_size, labels=labels)
+        else:
+            for blob_link in blob_links:
+                yield from blobs.iter_blob_columns(blob_link, parser, batch_size=batch_size, session=self.session, labels=labels,
+                                                   retries=blob_retries)
+
+    def get_cost_detailed_columns(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                                  columns: Optional[dict] = None, processes: int = 1):
+        """
+        Same as `iter_cost_detailed_columns`, but returns all columns at once.
+
+        Args:
+            columns (dict, optional): Column name -> type, see `BlobParser`. Defaults to `csvparse.DEFAULT_COLUMNS`.
+            processes (int, optional): With more than one, every blob is downloaded to a temporary file
+                and split between this many processes for parsing, see `BlobParser.parse_file`. Worth it
+                for reports with blobs of hundreds of MB.
+
+        Returns:
+            dict: Column name -> list of values, or None if the report is empty.
+        """
+        parser = BlobParser(columns)
+        result = {name: [] for name in parser.names}
+        if processes > 1:
+            manifest = self._generate_cost_details_report(subscription_id, start_date, end_date)
+            labels = {'provider': self.name, 'scope': subscription_id}
+            metrics.inc('pages', manifest['blobCount'], operation='blob', **labels)
+            for i in range(manifest['blobCount']):
+                file = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
+                try:
+                    blobs.download_blob(manifest['blobs'][i]['blobLink'], session=self.session, labels=labels, file=file).close()
+                    with metrics.span('blob_parse', operation='blob', **labels):
+                        blob_columns = parser.parse_file(file.name, processes=processes)
+                finally:
+                    os.unlink(file.name)
+                metrics.inc('rows', len(next(iter(blob_columns.values()), ())), operation='blob', **labels)
+                for name, values in blob_columns.items():
+                    result[name].extend(values)
+        else:
+            for batch in self.iter_cost_detailed_columns(subscription_id, start_date, end_date, columns=columns):
+                for name, values in batch.items():
+                    result[name].extend(values)
+
+        if any(result.values()):
+            return result
+        else:
+            print("Result retreived successfully, but it contains no data. It might be a very new subscription.")
+            return None
+
+    def iter_cost_detailed_batches(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                                   blob_retries: int = 3):
+        """
+        Streams the amortized cost details of a subscription as `pyarrow.RecordBatch` objects.
+
+        Column types are inferred from the first blob (costs are always floats, dates timestamps)
+        and reused for the rest, with integers widened to floats, so all batches share one schema.
+        A failed blob is retried up to `blob_retries` times, see `iter_cost_detailed`. Requires pyarrow.
+        """
+        manifest = self._generate_cost_details_report(subscription_id, start_date, end_date)
+        column_types = None
+        for i in range(manifest['blobCount']):
+            for batch in blobs.iter_blob_batches(manifest['blobs'][i]['blobLink'], session=self.session, column_types=column_types,
+                                                 labels={'provider': self.name, 'scope': subscription_id}, retries=blob_retries):
+                if column_types is None:
+                    column_types = columnar.widen_types(batch.schema)
+                yield columnar.cast_batch(batch, column_types)
+
+    def get_cost_detailed_table(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+        """
+        Same as `get_cost_detailed`, but returns a `pyarrow.Table`. Requires pyarrow.
+        """
+        batches = list(self.iter_cost_detailed_batches(subscription_id, start_date, end_date))
+        if len(batches) > 0:
+            return columnar.table_from_batches(batches)
+        else:
+            print("Result retreived successfully, but it contains no data. It might be a very new subscription.")
+            return None
+
+    def _generate_cost_details_report(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+        with metrics.span('report', provider=self.name, scope=subscription_id):
+            response = self._submit_cost_details_report(subscription_id, start_date, end_date)
+
+            while response.status_code == 202:
+                retry_after = int(response.headers.get('Retry-After', 5))
+                url = response.headers.get('Location')
+                if url is None:
+                    raise ValueError("Location for polling missing")
+                metrics.inc('sleep_seconds', retry_after, provider=self.name, scope=subscription_id, reason='report_poll')
+                time.sleep(retry_after)
+                response = self._poll_cost_details_report(subscription_id, url)
+
+            return self._report_manifest(response.json())
+
+    def _submit_cost_details_report(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+        body = self._report_body(start_date, end_date)
+
+        # scope here can be many different things, we're using subscriptions to keep the function parameters the same
+        # https://learn.microsoft.com/en-us/azure/cost-management-billing/costs/understand-work-scopes#identify-the-resource-id-for-a-scope
+        scope = f"subscriptions/{subscription_id}"
+        # make the POST request to the Cost Management API
+        url = f'https://management.azure.com/{scope}/providers/Microsoft.CostManagement/generateCostDetailsReport?api-version=2022-05-01'
+        response = self._request('POST', url, scope=subscription_id, operation='report_submit', json=body)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            print(f"API returned error {response.status_code}: {response.reason}. Message: {_error_message(response)}")
+            raise
+        return response
+
+    def _poll_cost_details_report(self, subscription_id: str, url: str):
+        response = self._request('GET', url, scope=subscription_id, operation='report_poll')
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            print(f"API returned error {response.status_code}: {response.reason}. Message: {_error_message(response)}")
+            raise
+        return response
+
+    @staticmethod
+    def _report_manifest(result: dict):
+        if result['status'] != 'Completed':
+            print(f"Result retrieved successfully, but status is {result['status']} instead of Completed")
+            raise EmptyResultError("Empty result")
+
+        return result['manifest']
+
+    @staticmethod
+    def _report_body(start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
         if isinstance(start_date, str):
             start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d')
         if isinstance(end_date, str):
@@ -158,7 +513,6 @@ class AzureAPI(CloudAPI):
 
         start_date_str = start_date.strftime('%Y-%m-%d')
         end_date_str = end_date.strftime('%Y-%m-%d')
-        # print(f"Looking for detailed cost data between {start_date_str} and {end_date_str}")
 
         body = {
             'metric': 'AmortizedCost',
@@ -167,55 +521,21 @@ class AzureAPI(CloudAPI):
                 'end': end_date_str
             }
         }
+        return body
 
-        data = []
 
-        # scope here can be many different things, we're using subscriptions to keep the function parameters the same
-        # https://learn.microsoft.com/en-us/azure/cost-management-billing/costs/understand-work-scopes#identify-the-resource-id-for-a-scope
-        scope = f"subscriptions/{subscription_id}"
-        # make the POST request to the Cost Management API
-        url = f'https://management.azure.com/{scope}/providers/Microsoft.CostManagement/generateCostDetailsReport?api-version=2022-05-01'
-        response = requests.post(url=url, headers=self.headers, json=body)
-        try:
-            response.raise_for_status()
-        except requests.HTTPError as e:
-            print(f"API returned error {response.status_code}: {response.reason}. Message: {response.json()['error']['message']}")
-            raise
+def _batched(iterable, batch_size: int):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
 
-        while response.status_code == 202:
-            retry_after = int(response.headers.get('Retry-After', 5))
-            url = response.headers.get('Location')
-            if url is None:
-                raise ValueError("Location for polling missing")
-            # print(f"Sleeping for {retry_after} seconds before polling again")
-            time.sleep(retry_after)
-            response = requests.get(url=url, headers=self.headers)
-            try:
-                response.raise_for_status()
-            except requests.HTTPError as e:
-                print(f"API returned error {response.status_code}: {response.reason}. Message: {response.json()['error']['message']}")
-                raise
-
-        result = response.json()
-        if result['status'] == 'Completed':
-            manifest = result['manifest']
-            # print(f"Result contains {manifest['blobCount']} blobs, looping through them")
-            for i in range(manifest['blobCount']):
-                # print(f"Downloading blob: {i}")
-                blob_response = requests.get(url=manifest['blobs'][i]['blobLink'])
-                csv_file_like_object = io.StringIO(blob_response.text)
-                reader = csv.DictReader(csv_file_like_object)
-                rows = list(reader)
-                data += rows
-                # print(f"Found {len(rows)} rows in blob {i}")
-        else:
-            print(f"Result retrieved successfully, but status is {result['status']} instead of Completed")
-            raise ValueError("Empty result")
 
-        # print(f"Total rows found: {len(data)}")
-
-        if len(data) > 0:
-            return data
-        else:
-            print("Result retreived successfully, but it contains no data. It might be a very new subscription.")
-            return None
+def _error_message(response: requests.Response):
+    # an error (e.g. an expired report location) may come with an empty or non-JSON body, which must not hide the HTTPError
+    try:
+        return response.json()['error']['message']
+    except Exception:
+        return response.text
@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Optional
+import requests
+from finops_crawler.session import get_shared_session
+from finops_crawler import metrics
+
+MANAGEMENT_SCOPE = 'https://management.azure.com/.default'
+# the refresh margin is capped at this fraction of a token's lifetime, so a short-lived token is still used for a while
+MAX_REFRESH_FRACTION = 0.5
+
+
+class TokenProvider:
+    """
+    A thread-safe cache of Azure AD client credentials tokens, one per (tenant, client, scope).
+
+    Tokens are refreshed `refresh_margin` seconds before they expire, so long crawls never run
+    into 401s, and only one thread fetches a token while the others wait for it. Share one
+    provider between all clients (the default) and creating another client costs nothing.
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, refresh_margin: float = 300):
+        """
+        Args:
+            session (requests.Session, optional): HTTP session for the token requests. Defaults to the
+                process-wide pooled session.
+            refresh_margin (float, optional): Seconds before expiry at which a token is refreshed.
+                At most `MAX_REFRESH_FRACTION` of the token's lifetime (`expires_in`).
+        """
+        self.session = session
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, tenant_id: str, client_id: str, client_secret: str, scope: str = MANAGEMENT_SCOPE):
+        """
+        Returns a valid access token, fetching a new one if there is none or it's about to expire.
+        """
+        key = (tenant_id, client_id, scope)
+        token = self.cached_token(tenant_id, client_id, scope)
+        if token is not None:
+            return token
+        with self._key_lock(key):
+            # another thread may have refreshed it while this one was waiting
+            token = self._valid_token(key)
+            if token is None:
+                with metrics.span('token_fetch', provider='azure'):
+                    token, expires_in = self._fetch_token(tenant_id, client_id, client_secret, scope)
+                margin = min(self.refresh_margin, expires_in * MAX_REFRESH_FRACTION)
+                self._tokens[key] = (token, time.monotonic() + expires_in - margin)
+            return token
+
+    def cached_token(self, tenant_id: str, client_id: str, scope: str = MANAGEMENT_SCOPE):
+        """
+        Returns the cached token if it's still valid, without fetching a new one.
+        """
+        return self._valid_token((tenant_id, client_id, scope))
+
+    def invalidate(self, tenant_id: str, client_id: str, scope: str = MANAGEMENT_SCOPE):
+        """
+        Forgets a cached token, e.g. after the API rejected it. Takes the same lock as fetching the
+        token, so it doesn't interleave with a refresh that is in progress.
+        """
+        key = (tenant_id, client_id, scope)
+        with self._key_lock(key):
+            self._tokens.pop(key, None)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _valid_token(self, key):
+        # tokens are stored with the time they're due for a refresh, not their expiry
+        cached = self._tokens.get(key)
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0]
+        return None
+
+    def _fetch_token(self, tenant_id: str, client_id: str, client_secret: str, scope: str):
+        # https://learn.microsoft.com/en-us/azure/active-directory/develop/v2-oauth2-client-creds-grant-flow#first-case-access-token-request-with-a-shared-secret
+        url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
+
+        payload = {
+            'grant_type': 'client_credentials',
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'scope': scope
+        }
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        session = self.session if self.session is not None else get_shared_session()
+        response = session.post(url, headers=headers, data=payload, timeout=10)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            print(f"Token request returned error {response.status_code}: {response.reason}. Message: {response.text}")
+            raise
+        response_json = response.json()
+        return response_json['access_token'], float(response_json.get('expires_in', 3600))
+
+
+_default_provider = None
+_default_provider_lock = threading.Lock()
+
+
+def get_token_provider():
+    """
+    Returns the process-wide token provider used by all Azure clients that aren't given one.
+    """
+    global _default_provider
+    with _default_provider_lock:
+        if _default_provider is None:
+            _default_provider = TokenProvider()
+        return _default_provider
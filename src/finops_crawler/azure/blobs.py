@@ -0,0 +1,320 @@
+import collections
+import concurrent.futures
+import csv
+import io
+import shutil
+import tempfile
+import time
+import requests
+import urllib3
+from typing import Optional
+from finops_crawler.session import get_shared_session
+from finops_crawler import columnar
+from finops_crawler import metrics
+from finops_crawler.azure.csvparse import BlobParser
+
+# statuses worth retrying a blob download for, anything else (e.g. an expired SAS link) fails right away
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# reading response.raw directly raises urllib3's errors (e.g. a connection reset mid-blob) rather than requests'
+DOWNLOAD_ERRORS = (requests.RequestException, urllib3.exceptions.HTTPError)
+
+
+def iter_blob_rows(blob_link: str, session: Optional[requests.Session] = None, labels: Optional[dict] = None, retries: int = 3,
+                   backoff: float = 1.0):
+    """
+    Streams the rows of a cost details CSV blob straight from the HTTP connection.
+
+    The blob is decoded as it arrives, so only the current chunk and row are held in memory.
+    If the download fails midway, the blob is requested again and the rows that were already
+    yielded are skipped.
+
+    Args:
+        blob_link (str): The SAS link of the blob, as found in the report manifest.
+        session (requests.Session, optional): Session to download with. Defaults to the shared session.
+        labels (dict, optional): Labels of the recorded metrics, see `finops_crawler.metrics`.
+        retries (int, optional): How many times to retry a failed download.
+        backoff (float, optional): Seconds to wait before the first retry, doubled on every retry.
+
+    Yields:
+        dict: One row of the CSV.
+
+    Raises:
+        requests.RequestException: If the download still fails after all retries. A connection that
+            breaks off while the blob is read raises urllib3's errors instead, see `DOWNLOAD_ERRORS`.
+    """
+    session = session if session is not None else get_shared_session()
+    labels = dict(labels or {}, operation='blob')
+
+    def read(response):
+        # keep urllib3 from reporting the stream as closed before TextIOWrapper has drained its buffer
+        response.raw.auto_close = False
+        text_stream = io.TextIOWrapper(response.raw, encoding='utf-8-sig', newline='')
+        # downloading and parsing are interleaved here, so they are timed together
+        return metrics.timed_iter(csv.DictReader(text_stream), 'blob_stream', **labels)
+
+    return _iter_retried(blob_link, session, read, lambda row: 1, None, retries, backoff, labels)
+
+
+def iter_blob_batches(blob_link: str, session: Optional[requests.Session] = None, column_types: Optional[dict] = None,
+                      labels: Optional[dict] = None, retries: int = 3, backoff: float = 1.0):
+    """
+    Streams a cost details CSV blob as Arrow record batches, see `columnar.csv_to_batches`.
+
+    Retried like `iter_blob_rows`: the rows of the batches that were already yielded are skipped.
+
+    Args:
+        blob_link (str): The SAS link of the blob.
+        session (requests.Session, optional): Session to download with. Defaults to the shared session.
+        column_types (dict, optional): Column name -> pyarrow type to use instead of inferring it.
+        labels (dict, optional): Labels of the recorded metrics.
+        retries (int, optional): How many times to retry a failed download.
+        backoff (float, optional): Seconds to wait before the first retry, doubled on every retry.
+
+    Yields:
+        pyarrow.RecordBatch
+    """
+    session = session if session is not None else get_shared_session()
+    labels = dict(labels or {}, operation='blob')
+
+    def read(response):
+        return _timed_batches(columnar.csv_to_batches(response.raw, column_types=column_types), 'blob_stream', labels,
+                              size=lambda batch: batch.num_rows)
+
+    return _iter_retried(blob_link, session, read, lambda batch: batch.num_rows, lambda batch, rows: batch.slice(rows),
+                         retries, backoff, labels)
+
+
+def iter_blob_columns(blob_link: str, parser: BlobParser, batch_size: Optional[int] = None, session: Optional[requests.Session] = None,
+                      labels: Optional[dict] = None, retries: int = 3, backoff: float = 1.0):
+    """
+    Streams the projected, typed columns of a cost details CSV blob, see `csvparse.BlobParser`.
+
+    Retried like `iter_blob_rows`: the rows of the batches that were already yielded are skipped.
+
+    Args:
+        blob_link (str): The SAS link of the blob.
+        parser (BlobParser): Which columns to keep and how to convert them.
+        batch_size (int, optional): Rows per batch. Defaults to the `chunk_size` of the parser.
+        session (requests.Session, optional): Session to download with. Defaults to the shared session.
+        labels (dict, optional): Labels of the recorded metrics.
+        retries (int, optional): How many times to retry a failed download.
+        backoff (float, optional): Seconds to wait before the first retry, doubled on every retry.
+
+    Yields:
+        dict: Column name -> list of values.
+    """
+    session = session if session is not None else get_shared_session()
+    labels = dict(labels or {}, operation='blob')
+
+    def read(response):
+        response.raw.auto_close = False
+        return _timed_batches(parser.iter_batches(response.raw, batch_size), 'blob_stream', labels)
+
+    return _iter_retried(blob_link, session, read, _column_batch_size,
+                         lambda batch, rows: {name: values[rows:] for name, values in batch.items()}, retries, backoff, labels)
+
+
+def _iter_retried(blob_link: str, session: requests.Session, read, size, drop, retries: int, backoff: float, labels: dict):
+    # Streams the items `read(response)` makes of a blob. After a failure the blob is requested again and
+    # the rows already yielded are skipped: `size(item)` is the number of rows of an item, and
+    # `drop(item, rows)` removes the first rows of an item that was only yielded in part.
+    yielded = 0
+    attempt = 0
+    while True:
+        try:
+            with session.get(url=blob_link, stream=True) as response:
+                response.raise_for_status()
+                _prepare_raw(response)
+                try:
+                    skip = yielded
+                    for item in read(response):
+                        rows = size(item)
+                        if skip:
+                            if skip >= rows:
+                                skip -= rows
+                                continue
+                            item = drop(item, skip)
+                            rows -= skip
+                            skip = 0
+                        yield item
+                        yielded += rows
+                finally:
+                    metrics.inc('bytes', response.raw.tell(), **labels)
+            return
+        except DOWNLOAD_ERRORS as e:
+            if not _wait_for_retry(e, attempt, retries, backoff, labels):
+                raise
+            attempt += 1
+
+
+def _column_batch_size(batch: dict):
+    return len(next(iter(batch.values()), ()))
+
+
+def _timed_batches(batches, name: str, labels: dict, size=_column_batch_size):
+    # like metrics.timed_iter, for batches of columns (or, with another `size`, of record batches)
+    seconds = 0.0
+    rows = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            batch = next(batches, None)
+            seconds += time.perf_counter() - start
+            if batch is None:
+                return
+            rows += size(batch)
+            yield batch
+    finally:
+        metrics.observe(f'{name}_seconds', seconds, **labels)
+        metrics.inc('rows', rows, **labels)
+
+
+def download_blob(blob_link: str, retries: int = 3, backoff: float = 1.0, session: Optional[requests.Session] = None,
+                  labels: Optional[dict] = None, file=None):
+    """
+    Downloads a blob into an anonymous temporary file.
+
+    Failed downloads are retried with exponential backoff. Only the failing blob is
+    downloaded again, the rest of the report is not affected.
+
+    Args:
+        blob_link (str): The SAS link of the blob.
+        retries (int, optional): How many times to retry a failed download.
+        backoff (float, optional): Seconds to wait before the first retry, doubled on every retry.
+        session (requests.Session, optional): Session to download with. Defaults to the shared session.
+        labels (dict, optional): Labels of the recorded metrics.
+        file (optional): Binary file to download into instead, e.g. a named temporary file for
+            `BlobParser.parse_file`.
+
+    Returns:
+        file: A binary file object positioned at the start of the downloaded blob.
+
+    Raises:
+        requests.RequestException: If the download still fails after all retries. A connection that
+            breaks off while the blob is read raises urllib3's errors instead, see `DOWNLOAD_ERRORS`.
+    """
+    session = session if session is not None else get_shared_session()
+    labels = dict(labels or {}, operation='blob')
+    file = file if file is not None else tempfile.TemporaryFile()
+    attempt = 0
+    while True:
+        try:
+            with metrics.span('blob_download', **labels):
+                with session.get(url=blob_link, stream=True) as response:
+                    response.raise_for_status()
+                    _prepare_raw(response)
+                    shutil.copyfileobj(response.raw, file, 1024 * 1024)
+                    metrics.inc('bytes', response.raw.tell(), **labels)
+            file.seek(0)
+            return file
+        except DOWNLOAD_ERRORS as e:
+            if not _wait_for_retry(e, attempt, retries, backoff, labels):
+                file.close()
+                raise
+            attempt += 1
+            file.seek(0)
+            file.truncate()
+
+
+def _prepare_raw(response: requests.Response):
+    response.raw.decode_content = True
+    # urllib3 1.x ends a chunked read of a cut connection silently, raise IncompleteRead instead of losing the rest of the blob
+    response.raw.enforce_content_length = True
+
+
+def _wait_for_retry(error: Exception, attempt: int, retries: int, backoff: float, labels: dict):
+    # sleeps before the next attempt of a failed download, or returns False if it shouldn't be retried
+    response = getattr(error, 'response', None)
+    delay = _retry_delay(response.status_code if response is not None else None, attempt, retries, backoff, labels)
+    if delay is None:
+        return False
+    time.sleep(delay)
+    return True
+
+
+def _retry_delay(status_code: Optional[int], attempt: int, retries: int, backoff: float, labels: dict):
+    # the seconds to wait before the next attempt of a failed download (also used by the async client),
+    # or None if it shouldn't be retried; `status_code` is None for a connection error
+    if attempt >= retries or (status_code is not None and status_code not in RETRYABLE_STATUS_CODES):
+        return None
+    delay = backoff * 2 ** attempt
+    metrics.inc('retries', reason=status_code or 'connection', **labels)
+    metrics.inc('sleep_seconds', delay, reason='retry', **{label: value for label, value in labels.items() if label != 'operation'})
+    return delay
+
+
+def read_blob_rows(file, labels: Optional[dict] = None):
+    """
+    Parses a blob downloaded by `download_blob` and closes the file once all rows are read.
+
+    Args:
+        file: The downloaded blob.
+        labels (dict, optional): Labels of the recorded metrics.
+
+    Yields:
+        dict: One row of the CSV.
+    """
+    with file:
+        text_stream = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        yield from metrics.timed_iter(csv.DictReader(text_stream), 'blob_parse', **dict(labels or {}, operation='blob'))
+
+
+def read_blob_columns(file, parser: BlobParser, batch_size: Optional[int] = None, labels: Optional[dict] = None):
+    """
+    Parses the projected, typed columns of a blob downloaded by `download_blob` and closes the file.
+
+    Yields:
+        dict: Column name -> list of values.
+    """
+    with file:
+        yield from _timed_batches(parser.iter_batches(file, batch_size), 'blob_parse', dict(labels or {}, operation='blob'))
+
+
+def iter_downloaded_blobs(blob_links, max_workers: int = 4, ordered: bool = True, retries: int = 3,
+                          session: Optional[requests.Session] = None, labels: Optional[dict] = None):
+    """
+    Downloads blobs on a bounded thread pool while the caller is busy with the previous ones.
+
+    At most `max_workers` blobs are downloading or waiting to be consumed at any time, so
+    the disk and memory footprint stays bounded even for reports with many blobs.
+
+    Args:
+        blob_links (iterable): SAS links of the blobs.
+        max_workers (int, optional): Number of concurrent downloads.
+        ordered (bool, optional): Yield the blobs in the order of `blob_links`. If False, blobs
+            are yielded as soon as they finish downloading.
+        retries (int, optional): How many times to retry each failed blob.
+        session (requests.Session, optional): Session shared by the download threads.
+        labels (dict, optional): Labels of the recorded metrics.
+
+    Yields:
+        file: Binary file objects as returned by `download_blob`. The caller is responsible for closing them.
+    """
+    links = iter(blob_links)
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit_next():
+            link = next(links, None)
+            if link is not None:
+                pending.append(executor.submit(download_blob, link, retries, session=session, labels=labels))
+
+        for _ in range(max_workers):
+            submit_next()
+
+        try:
+            while pending:
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
+                file = future.result()
+                submit_next()
+                yield file
+        finally:
+            # the consumer stopped early or a blob failed for good: drop whatever is still queued
+            for future in pending:
+                if not future.cancel() and future.exception() is None:
+                    future.result().close()
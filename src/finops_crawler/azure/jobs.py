@@ -0,0 +1,311 @@
+import concurrent.futures
+import datetime
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable, Optional, Union
+import requests
+from finops_crawler.base import EmptyResultError
+from finops_crawler.crawler import CrawlResult
+
+# a job is polled at most this often, whatever Retry-After says
+MIN_POLL_INTERVAL = 1.0
+# statuses that mean the report location is gone and the report has to be generated again
+EXPIRED_STATUS_CODES = (404, 410)
+# statuses of a blob download that mean the SAS links of the manifest expired (or the report was deleted)
+EXPIRED_LINK_STATUS_CODES = (403, 404)
+
+
+class ReportJob:
+    """
+    The state of one cost details report: submitted, completed or downloaded.
+    """
+
+    def __init__(self, subscription_id: str, start_date: str, end_date: str, location: Optional[str] = None,
+                 status: str = 'New', manifest: Optional[dict] = None, submitted_at: Optional[float] = None):
+        self.subscription_id = subscription_id
+        self.start_date = start_date
+        self.end_date = end_date
+        self.location = location
+        self.status = status
+        self.manifest = manifest
+        self.submitted_at = submitted_at
+        self.error = None
+
+    @property
+    def key(self):
+        return (self.subscription_id, self.start_date, self.end_date)
+
+    def to_dict(self):
+        return {
+            'subscription_id': self.subscription_id,
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'location': self.location,
+            'status': self.status,
+            'manifest': self.manifest,
+            'submitted_at': self.submitted_at,
+        }
+
+    def __repr__(self):
+        return f"ReportJob({self.subscription_id}, {self.start_date} - {self.end_date}, status={self.status})"
+
+
+class ReportJobManager:
+    """
+    Generates Azure cost details reports for many subscriptions at once.
+
+    `AzureAPI.get_cost_detailed` submits one report and blocks until it's generated, so
+    over many subscriptions the generation times add up. The manager submits all reports
+    up front and polls every outstanding `Location` from one scheduler, each job no earlier
+    than its `Retry-After` asks for. Completed reports are handed to a pool of download
+    workers while the rest are still being generated.
+
+    With a `state_path` the jobs are saved to a JSON file whenever they change, so a
+    restarted crawl resumes polling the reports it already submitted (and skips the ones it
+    already downloaded) instead of generating them again. A report whose blob links expired
+    in the meantime is generated again once its download fails.
+
+    Example:
+        manager = ReportJobManager(azure_costs_client, state_path='report_jobs.json')
+        manager.submit_many(azure_costs_client.get_all_subscriptions(), '2023-10-01', '2023-10-31')
+        result = manager.run()
+    """
+
+    def __init__(self, client, state_path: Optional[str] = None, download: Optional[Callable] = None, max_download_workers: int = 4):
+        """
+        Args:
+            client (AzureAPI): An initialized Azure client.
+            state_path (str, optional): JSON file the job state is persisted to and resumed from.
+            download (callable, optional): Called as `download(job, manifest)` for every completed
+                report, from a worker thread. Its return value ends up in the result. Defaults to
+                reading all rows of the report.
+            max_download_workers (int, optional): Number of reports downloaded concurrently.
+        """
+        self.client = client
+        self.state_path = state_path
+        self.download = download or (lambda job, manifest: list(client.iter_manifest_rows(manifest)))
+        self.max_download_workers = max_download_workers
+        self.jobs = {}
+        self._lock = threading.Lock()
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                for item in json.load(f):
+                    job = ReportJob(**item)
+                    self.jobs[job.key] = job
+
+    def submit(self, subscription_id: str, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+        """
+        Submits a report job, unless the same report was already submitted (e.g. before a restart).
+
+        Returns:
+            ReportJob
+        """
+        job = ReportJob(subscription_id, _date_str(start_date), _date_str(end_date))
+        existing = self.jobs.get(job.key)
+        if existing is not None and existing.status != 'Failed':
+            return existing
+        self.jobs[job.key] = job
+        self._submit(job)
+        return job
+
+    def submit_many(self, subscription_ids: Iterable[str], start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+        """
+        Submits a report job for every subscription. A subscription that fails to submit is
+        marked failed instead of stopping the others.
+        """
+        jobs = []
+        for subscription_id in subscription_ids:
+            try:
+                jobs.append(self.submit(subscription_id, start_date, end_date))
+            except Exception as e:
+                job = self.jobs[(subscription_id, _date_str(start_date), _date_str(end_date))]
+                self._fail(job, e)
+                jobs.append(job)
+        return jobs
+
+    def _submit(self, job: ReportJob):
+        response = self.client._submit_cost_details_report(job.subscription_id, job.start_date, job.end_date)
+        job.submitted_at = time.time()
+        self._handle_response(job, response)
+        return response
+
+    def _handle_response(self, job: ReportJob, response: requests.Response):
+        if response.status_code == 202:
+            location = response.headers.get('Location')
+            if location is None:
+                raise ValueError("Location for polling missing")
+            job.location = location
+            job.status = 'Running'
+        else:
+            try:
+                job.manifest = self.client._report_manifest(response.json())
+                job.status = 'Completed'
+            except EmptyResultError:
+                # e.g. NoDataFound for a subscription without usage in the period
+                job.status = 'Empty'
+        self._save()
+
+    def _fail(self, job: ReportJob, error: Exception):
+        job.status = 'Failed'
+        job.error = error
+        self._save()
+
+    def run(self, progress: Optional[Callable] = None):
+        """
+        Polls all outstanding jobs and downloads the completed reports, until every job is
+        downloaded or failed.
+
+        Args:
+            progress (callable, optional): Called as `progress(completed, total, provider, scope, error)`
+                whenever a job is downloaded or fails.
+
+        Returns:
+            CrawlResult: The download results by ('azure', subscription_id). Reports without data
+            are listed in `empty`, failed jobs in `errors`.
+        """
+        result = CrawlResult()
+        jobs = [job for job in self.jobs.values() if job.status in ('Running', 'Completed', 'Empty')]
+        total = len(jobs)
+        completed = 0
+
+        # (next poll time, tie breaker, job)
+        schedule = []
+        counter = itertools.count()
+        for job in jobs:
+            if job.status == 'Running':
+                heapq.heappush(schedule, (time.monotonic(), next(counter), job))
+
+        def finish(job, error=None):
+            nonlocal completed
+            completed += 1
+            if progress:
+                progress(completed, total, self.client.name, job.subscription_id, error)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.max_download_workers)) as executor:
+            downloads = {}
+            # jobs generated again because their blob links expired, at most once per run
+            resubmitted = set()
+
+            def dispatch(job, delay=0.0):
+                if job.status == 'Running':
+                    heapq.heappush(schedule, (time.monotonic() + delay, next(counter), job))
+                elif job.status == 'Empty':
+                    self._collect_empty(job, result)
+                    finish(job)
+                else:
+                    downloads[executor.submit(self.download, job, job.manifest)] = job
+
+            def fail(job, error):
+                print(f"Report for {job.subscription_id} failed: {error}")
+                self._fail(job, error)
+                result.errors[(self.client.name, job.subscription_id)] = error
+                finish(job, error)
+
+            for job in jobs:
+                if job.status != 'Running':
+                    dispatch(job)
+
+            while schedule or downloads:
+                # collect finished downloads without blocking the poll schedule
+                timeout = max(0.0, schedule[0][0] - time.monotonic()) if schedule else None
+                done, _ = concurrent.futures.wait(downloads, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    job = downloads.pop(future)
+                    if job.key not in resubmitted and _has_expired_links(future):
+                        # e.g. a manifest saved before a restart, whose SAS links are no longer valid
+                        resubmitted.add(job.key)
+                        try:
+                            self._resubmit(job)
+                        except Exception as e:
+                            fail(job, e)
+                            continue
+                        dispatch(job)
+                        continue
+                    self._collect(job, future, result)
+                    finish(job, result.errors.get((self.client.name, job.subscription_id)))
+
+                while schedule and schedule[0][0] <= time.monotonic():
+                    _, _, job = heapq.heappop(schedule)
+                    try:
+                        delay = self._poll(job)
+                    except Exception as e:
+                        fail(job, e)
+                        continue
+                    dispatch(job, delay)
+
+        for job in self.jobs.values():
+            if job.status == 'Failed' and job.error is not None and job not in jobs:
+                # failed to submit
+                result.errors[(self.client.name, job.subscription_id)] = job.error
+        return result
+
+    def _poll(self, job: ReportJob):
+        # returns the number of seconds to wait before polling again
+        try:
+            response = self.client._poll_cost_details_report(job.subscription_id, job.location)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in EXPIRED_STATUS_CODES:
+                raise
+            # the report expired while nobody was polling it (e.g. during a long restart)
+            response = self._submit(job)
+        if response.status_code == 202:
+            self._handle_response(job, response)
+            return max(MIN_POLL_INTERVAL, int(response.headers.get('Retry-After', 5)))
+        self._handle_response(job, response)
+        return 0
+
+    def _resubmit(self, job: ReportJob):
+        job.location = None
+        job.manifest = None
+        self._submit(job)
+
+    def _collect(self, job: ReportJob, future: concurrent.futures.Future, result: CrawlResult):
+        try:
+            data = future.result()
+        except EmptyResultError:
+            data = None
+        except Exception as e:
+            print(f"Downloading the report of {job.subscription_id} failed: {e}")
+            result.errors[(self.client.name, job.subscription_id)] = e
+            self._fail(job, e)
+            return
+        if data:
+            result.results[(self.client.name, job.subscription_id)] = data
+        else:
+            result.empty.append((self.client.name, job.subscription_id))
+        job.status = 'Downloaded'
+        # the manifest links are useless once downloaded, keep the state file small
+        job.manifest = None
+        self._save()
+
+    def _collect_empty(self, job: ReportJob, result: CrawlResult):
+        result.empty.append((self.client.name, job.subscription_id))
+        job.status = 'Downloaded'
+        self._save()
+
+    def _save(self):
+        if not self.state_path:
+            return
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.state_path))
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump([job.to_dict() for job in self.jobs.values()], f)
+            os.replace(temp_path, self.state_path)
+
+
+def _has_expired_links(future: concurrent.futures.Future):
+    error = future.exception()
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code in EXPIRED_LINK_STATUS_CODES
+
+
+def _date_str(value: Union[str, datetime.date, datetime.datetime]):
+    if isinstance(value, str):
+        return value[:10]
+    return value.strftime('%Y-%m-%d')
@@ -1,6 +1,49 @@
+class EmptyResultError(ValueError):
+    """Raised when the API call succeeds but returns no data, e.g. for a very new subscription."""
+
+
 class CloudAPI:
+    # short platform name, same as the key in credentials_config.yml
+    name = None
+    # whether get_cost includes the end date itself in the result
+    end_date_inclusive = False
+    # optional finops_crawler.cache.CostCache for get_cost results
+    cache = None
+
     def __init__(self, credentials):
         self.credentials = credentials
 
     def get_cost(self, start_date, end_date):
         raise NotImplementedError("This method should be overridden in subclass")
+
+    def get_scopes(self):
+        """
+        Returns the scopes (subscriptions, accounts, ...) that costs can be fetched for separately.
+
+        Platforms that have no such concept have a single scope, None.
+        """
+        return [None]
+
+    def get_scope_cost(self, scope, start_date, end_date, detailed=False):
+        """
+        Retrieves the cost of a single scope as returned by `get_scopes`.
+
+        This is what the crawler calls, so that every platform can be fanned out the same way
+        regardless of how its own `get_cost` signature looks.
+        """
+        return self.get_cost(start_date, end_date)
+
+    def split_by_day(self, data):
+        """
+        Splits the result of `get_scope_cost` into a dict of 'YYYY-MM-DD' -> list of rows.
+
+        Used by the incremental crawl to store every day separately.
+        """
+        raise NotImplementedError("This method should be overridden in subclass")
+
+    def _cached(self, scope, request, end_date, fetch):
+        # serve a repeated query from the cache, keyed by everything that determines its result
+        if self.cache is None:
+            return fetch()
+        key = self.cache.key(self.name, scope, request)
+        return self.cache.get_or_fetch(key, end_date, fetch)
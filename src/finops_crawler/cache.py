@@ -0,0 +1,242 @@
+import collections
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, List, Optional, Union
+
+
+class CacheStats:
+    """
+    Hit and miss counters of a `CostCache`.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.hits_by_tier = collections.Counter()
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self):
+        return f"CacheStats(hits={self.hits}, misses={self.misses}, hits_by_tier={dict(self.hits_by_tier)})"
+
+
+class MemoryCache:
+    """
+    In-memory cache tier, evicting the least recently used entries once `max_bytes` is exceeded.
+
+    Entries are kept serialized, so their size is known exactly and callers can't modify a cached result.
+    """
+
+    name = 'memory'
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def set(self, key: str, payload: bytes, expires_at: float):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (payload, expires_at)
+            self.size += len(payload)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        payload, _ = self._entries.pop(key)
+        self.size -= len(payload)
+
+
+class DiskCache:
+    """
+    On-disk cache tier, one file per entry, evicting the least recently used files once `max_bytes` is exceeded.
+
+    The access time of an entry is tracked with the file modification time, so the LRU order
+    survives restarts and is shared by all processes using the same directory.
+    """
+
+    name = 'disk'
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._sizes = {}
+        for file_name in os.listdir(directory):
+            if file_name.endswith('.cache'):
+                self._sizes[file_name[:-len('.cache')]] = os.path.getsize(os.path.join(directory, file_name))
+        self.size = sum(self._sizes.values())
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, f'{key}.cache')
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires_at = float(f.readline())
+                payload = f.read()
+        except (OSError, ValueError):
+            return None
+        if expires_at < time.time():
+            with self._lock:
+                self._remove(key)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return payload
+
+    def set(self, key: str, payload: bytes, expires_at: float):
+        data = f'{expires_at}\n'.encode() + payload
+        if len(data) > self.max_bytes:
+            return
+        # write to a temporary file first so other readers never see a half-written entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self._path(key))
+        with self._lock:
+            self.size += len(data) - self._sizes.get(key, 0)
+            self._sizes[key] = len(data)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        def last_used(key):
+            try:
+                return os.path.getmtime(self._path(key))
+            except OSError:
+                return 0
+        for key in sorted(self._sizes, key=last_used):
+            if self.size <= self.max_bytes:
+                break
+            self._remove(key)
+
+    def _remove(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        self.size -= self._sizes.pop(key, 0)
+
+
+class CostCache:
+    """
+    A cache of cost query results with a memory tier and an optional on-disk tier.
+
+    Results of closed billing periods hardly ever change, so they are kept for `closed_ttl`.
+    Anything touching a month that is still open (or closed less than `grace_days` ago, while
+    the platforms still restate it) is kept only for `open_ttl`.
+
+    Tiers are pluggable: anything with `get(key) -> bytes or None` and
+    `set(key, payload: bytes, expires_at: float)` methods can be used.
+
+    Example:
+        cache = CostCache(directory='.finops_cache')
+        aws_costs_client = aws.costs_api(*credentials.get_credentials('aws'), cache=cache)
+    """
+
+    def __init__(self, directory: Optional[str] = None, tiers: Optional[List] = None,
+                 max_memory_bytes: int = 64 * 1024 * 1024, max_disk_bytes: int = 1024 * 1024 * 1024,
+                 closed_ttl: float = 30 * 24 * 3600, open_ttl: float = 3600, grace_days: int = 5):
+        """
+        Args:
+            directory (str, optional): Directory of the on-disk tier. Without it only the memory tier is used.
+            tiers (list, optional): Use these tiers instead, fastest first. Overrides `directory` and the size limits.
+            max_memory_bytes (int, optional): Size limit of the memory tier.
+            max_disk_bytes (int, optional): Size limit of the on-disk tier.
+            closed_ttl (float, optional): Seconds to keep results of closed billing periods.
+            open_ttl (float, optional): Seconds to keep results that include an open billing period.
+            grace_days (int, optional): Days after the end of a month during which it is still considered open.
+        """
+        if tiers is None:
+            tiers = [MemoryCache(max_memory_bytes)]
+            if directory:
+                tiers.append(DiskCache(directory, max_disk_bytes))
+        self.tiers = tiers
+        self.closed_ttl = closed_ttl
+        self.open_ttl = open_ttl
+        self.grace_days = grace_days
+        self.stats = CacheStats()
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def key(provider: str, scope: Optional[str], request):
+        """
+        Builds a cache key from everything that determines the result: the provider, the scope
+        and the request itself (date range, granularity, metrics, grouping, filters).
+        """
+        raw = json.dumps([provider, scope, request], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def ttl(self, end_date: Union[str, datetime.date, datetime.datetime]):
+        if isinstance(end_date, str):
+            end_date = datetime.datetime.strptime(end_date[:10], '%Y-%m-%d')
+        if isinstance(end_date, datetime.datetime):
+            end_date = end_date.date()
+        next_month = (end_date.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        closes_on = next_month + datetime.timedelta(days=self.grace_days)
+        return self.closed_ttl if datetime.date.today() >= closes_on else self.open_ttl
+
+    def get(self, key: str):
+        for i, tier in enumerate(self.tiers):
+            payload = tier.get(key)
+            if payload is not None:
+                with self._stats_lock:
+                    self.stats.hits += 1
+                    self.stats.hits_by_tier[getattr(tier, 'name', type(tier).__name__)] += 1
+                # promote to the faster tiers
+                if i > 0:
+                    expires_at = time.time() + self.open_ttl
+                    for faster_tier in self.tiers[:i]:
+                        faster_tier.set(key, payload, expires_at)
+                return json.loads(payload)
+        with self._stats_lock:
+            self.stats.misses += 1
+        return None
+
+    def set(self, key: str, value, end_date: Union[str, datetime.date, datetime.datetime]):
+        payload = json.dumps(value, default=str).encode()
+        expires_at = time.time() + self.ttl(end_date)
+        for tier in self.tiers:
+            tier.set(key, payload, expires_at)
+
+    def get_or_fetch(self, key: str, end_date: Union[str, datetime.date, datetime.datetime], fetch: Callable):
+        """
+        Returns the cached value of `key`, or calls `fetch()` and caches what it returns.
+
+        Empty results (None or an empty list) are not cached.
+        """
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            if value:
+                self.set(key, value, end_date)
+        return value
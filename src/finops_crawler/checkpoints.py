@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+from finops_crawler import metrics
+
+
+class Checkpoint:
+    """
+    Progress of one paginated request.
+
+    Attributes:
+        pages (list): Results of the pages fetched so far, in order.
+        token: Continuation of the next page (AWS `NextPageToken`, Azure `nextLink`), or None if
+            the last page has been fetched.
+        updated_at (float): When the last page was stored, as a Unix timestamp.
+    """
+
+    __slots__ = ('pages', 'token', 'updated_at')
+
+    def __init__(self, pages: list, token, updated_at: float):
+        self.pages = pages
+        self.token = token
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        return f"Checkpoint({len(self.pages)} pages, token={self.token!r})"
+
+
+class CheckpointStore:
+    """
+    A local SQLite store of the progress of paginated cost queries.
+
+    Every page is stored as soon as it's fetched, together with the token or link to the next
+    page, per (provider, scope, request). A crawl that dies in the middle of a long pagination
+    loop resumes at the next page when it's run again, instead of repeating every (paid or
+    throttled) request from the first page. The checkpoint is deleted once the last page has
+    been consumed.
+
+    Continuation tokens don't live forever, so checkpoints older than `max_age` are ignored
+    and the request starts over.
+
+    The store can be shared between threads, and can use the same database file as a `WatermarkStore`.
+
+    Example:
+        checkpoints = CheckpointStore('finops_crawler.sqlite')
+        aws_costs_client = aws.costs_api(*credentials.get_credentials('aws'), checkpoints=checkpoints)
+    """
+
+    def __init__(self, path: str = 'finops_crawler.sqlite', max_age: float = 24 * 3600):
+        """
+        Args:
+            path (str, optional): Path of the SQLite database. Created if it doesn't exist.
+            max_age (float, optional): Seconds after which a checkpoint is no longer resumed.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    provider TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    token TEXT,
+                    pages INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (provider, scope, request)
+                )
+            """)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoint_pages (
+                    provider TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (provider, scope, request, page)
+                )
+            """)
+
+    @staticmethod
+    def key(request):
+        """
+        Identifies a request by everything that determines its result (date range, granularity,
+        metrics, grouping, filters), like `CostCache.key`.
+        """
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+    def load(self, provider: str, scope: Optional[str], request: str):
+        """
+        Returns the `Checkpoint` of a request, or None if there is none or it's older than `max_age`.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT token, pages, updated_at FROM checkpoints WHERE provider = ? AND scope = ? AND request = ?",
+                (provider, scope or '', request),
+            ).fetchone()
+            if row is None:
+                return None
+            token, page_count, updated_at = row
+            if time.time() - updated_at > self.max_age:
+                return None
+            pages = [json.loads(data) for data, in self._connection.execute(
+                "SELECT data FROM checkpoint_pages WHERE provider = ? AND scope = ? AND request = ? AND page < ? ORDER BY page",
+                (provider, scope or '', request, page_count),
+            )]
+        return Checkpoint(pages, json.loads(token) if token is not None else None, updated_at)
+
+    def save_page(self, provider: str, scope: Optional[str], request: str, page: int, data, token):
+        """
+        Stores the result of page number `page` (starting at 0) and the token of the next page,
+        None if it was the last one. Page 0 starts a new checkpoint.
+        """
+        now = time.time()
+        key = (provider, scope or '', request)
+        with self._lock, self._connection:
+            if page == 0:
+                self._connection.execute("DELETE FROM checkpoint_pages WHERE provider = ? AND scope = ? AND request = ?", key)
+            self._connection.execute("INSERT OR REPLACE INTO checkpoint_pages VALUES (?, ?, ?, ?, ?)", key + (page, json.dumps(data, default=str)))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+                key + (json.dumps(token) if token is not None else None, page + 1, now),
+            )
+
+    def clear(self, provider: str, scope: Optional[str], request: str):
+        """
+        Deletes the checkpoint of a request.
+        """
+        key = (provider, scope or '', request)
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM checkpoint_pages WHERE provider = ? AND scope = ? AND request = ?", key)
+            self._connection.execute("DELETE FROM checkpoints WHERE provider = ? AND scope = ? AND request = ?", key)
+
+    def pending(self):
+        """
+        Returns [(provider, scope, pages, updated_at)] of the requests that were interrupted and can be resumed.
+        """
+        with self._lock:
+            cursor = self._connection.execute("SELECT provider, scope, pages, updated_at FROM checkpoints WHERE updated_at >= ? ORDER BY updated_at",
+                                              (time.time() - self.max_age,))
+            return [(provider, scope or None, pages, updated_at) for provider, scope, pages, updated_at in cursor]
+
+    def purge(self):
+        """
+        Deletes the checkpoints older than `max_age`, which would not be resumed anymore.
+        """
+        cutoff = time.time() - self.max_age
+        with self._lock, self._connection:
+            self._connection.execute("""
+                DELETE FROM checkpoint_pages WHERE (provider, scope, request) IN
+                    (SELECT provider, scope, request FROM checkpoints WHERE updated_at < ?)
+            """, (cutoff,))
+            self._connection.execute("DELETE FROM checkpoints WHERE updated_at < ?", (cutoff,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def paginate(store: Optional[CheckpointStore], provider: str, scope: Optional[str], request, fetch_page: Callable,
+             is_expired: Optional[Callable] = None):
+    """
+    Runs a pagination loop, checkpointing every page in `store` and resuming from it.
+
+    Args:
+        store (CheckpointStore): Where to keep the progress. Without one the pages are just fetched.
+        provider (str): Name of the platform, e.g. 'aws'.
+        scope (str): The account or subscription the request is for.
+        request: Everything that identifies the request, e.g. the request body. Must be JSON-serializable.
+        fetch_page (callable): `fetch_page(token)` returns `(page, next_token)`, where `page` is what
+            is yielded (and stored as JSON) and `next_token` is None after the last page. The token
+            of the first page is None.
+        is_expired (callable, optional): `is_expired(exception)` tells whether a request failed because
+            the stored token is no longer accepted, in which case the request starts over from the first page.
+
+    Yields:
+        The result of every page, the stored ones first.
+    """
+    if store is None:
+        page, token = fetch_page(None)
+        yield page
+        while token is not None:
+            page, token = fetch_page(token)
+            yield page
+        return
+
+    key = CheckpointStore.key(request)
+    checkpoint = store.load(provider, scope, key)
+    pages = checkpoint.pages if checkpoint is not None else []
+    token = checkpoint.token if checkpoint is not None else None
+    fetched = None
+    if pages and token is not None:
+        # try the continuation before handing out the stored pages, so an expired one can still start over
+        try:
+            fetched = fetch_page(token)
+        except Exception as e:
+            if is_expired is None or not is_expired(e):
+                raise
+            store.clear(provider, scope, key)
+            pages, token = [], None
+    if pages:
+        metrics.inc('resumed_pages', len(pages), provider=provider, scope=scope)
+    yield from pages
+
+    index = len(pages)
+    while index == 0 or token is not None:
+        page, next_token = fetched if fetched is not None else fetch_page(token)
+        fetched = None
+        store.save_page(provider, scope, key, index, page, next_token)
+        index += 1
+        token = next_token
+        yield page
+    # everything has been handed out, nothing left to resume
+    store.clear(provider, scope, key)
@@ -0,0 +1,402 @@
+# The `finops-crawler` command. Discovers the platforms configured in the environment (see
+# `credentials_provider`), crawls all of them concurrently with one `Crawler` and writes the
+# normalized data to a sink, either once or on a cron schedule:
+#
+#   finops-crawler --days 7 --output sqlite:costs.sqlite
+#   finops-crawler --start 2023-01-01 --end 2024-01-01 --backfill --output parquet:costs --concurrency azure=16 --rate aws=2
+#   finops-crawler --schedule "0 6 * * *" --days 3 --incremental --output duckdb:costs.duckdb --metrics-port 9100
+import argparse
+import datetime
+import importlib
+import os
+import sys
+import time
+from typing import List, Optional
+
+# --output format -> sink class in finops_crawler.sinks
+SINKS = {
+    'csv': 'CSVSink',
+    'jsonl': 'JSONLSink',
+    'parquet': 'ParquetSink',
+    'sqlite': 'SQLiteSink',
+    'duckdb': 'DuckDBSink',
+}
+
+# scopes of a provider fetched at the same time, unless --concurrency says otherwise
+DEFAULT_CONCURRENCY = {
+    'aws': 2,
+    'azure': 8,
+    'openai': 1,
+}
+
+
+class CronSchedule:
+    """
+    A cron expression: minute, hour, day of month, month and day of week (0 or 7 is Sunday).
+
+    Fields can be `*`, numbers, ranges (`1-5`), steps (`*/15`, `0-12/3`) and lists of those
+    (`0,30`). As in cron, if both the day of month and the day of week are restricted, a day
+    matching either of them runs. `@hourly`, `@daily`, `@weekly` and `@monthly` are accepted too.
+
+    Example:
+        CronSchedule('0 6 * * 1-5').next_run(datetime.datetime.now())  # 06:00 on the next weekday
+    """
+
+    ALIASES = {
+        '@hourly': '0 * * * *',
+        '@daily': '0 0 * * *',
+        '@midnight': '0 0 * * *',
+        '@weekly': '0 0 * * 0',
+        '@monthly': '0 0 1 * *',
+    }
+    # (lowest, highest) value of every field
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        """
+        Raises:
+            ValueError: If the expression is not valid.
+        """
+        self.expression = expression
+        fields = self.ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"A cron expression has 5 fields (minute hour day month weekday), got {expression!r}")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, lowest, highest) for field, (lowest, highest) in zip(fields, self.RANGES)
+        )
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def __repr__(self):
+        return f"CronSchedule({self.expression!r})"
+
+    @staticmethod
+    def _parse(field: str, lowest: int, highest: int):
+        values = set()
+        for part in field.split(','):
+            part, _, step = part.partition('/')
+            if part == '*':
+                start, stop = lowest, highest
+            elif '-' in part:
+                start, stop = (int(value) for value in part.split('-', 1))
+            else:
+                start = int(part)
+                stop = highest if step else start
+            step = int(step) if step else 1
+            if not lowest <= start <= stop <= highest or step < 1:
+                raise ValueError(f"Invalid cron field {field!r}, values must be between {lowest} and {highest}")
+            values.update(range(start, stop + 1, step))
+        return values
+
+    def _day_matches(self, day: datetime.date):
+        day_matches = day.day in self.days
+        # cron counts weekdays from Sunday, Python from Monday
+        weekday_matches = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches
+
+    def next_run(self, after: datetime.datetime):
+        """
+        Returns the first time after `after` (at least a minute later) that matches the schedule.
+        """
+        moment = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # every valid expression matches within a few years, e.g. February 29th
+        limit = moment + datetime.timedelta(days=5 * 366)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment.date()):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"The cron expression {self.expression!r} never matches")
+
+
+def _provider_values(values: Optional[List[str]], convert, option: str):
+    # ['azure=8', 'aws=2'] -> {'azure': 8, 'aws': 2}
+    result = {}
+    for value in values or []:
+        provider, separator, setting = value.partition('=')
+        if not separator or not provider:
+            raise argparse.ArgumentTypeError(f"{option} expects PROVIDER=VALUE, got {value!r}")
+        try:
+            result[provider] = convert(setting)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid value for {option}: {value!r}") from None
+    return result
+
+
+def _rate(value: str):
+    # RATE or RATE:BURST
+    rate, _, capacity = value.partition(':')
+    return float(rate), float(capacity) if capacity else 1.0
+
+
+def _date(value: str):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected a date as YYYY-MM-DD, got {value!r}") from None
+
+
+def _parse_output(spec: str):
+    sink_format, separator, path = spec.partition(':')
+    if not separator or sink_format not in SINKS or not path:
+        raise ValueError(f"--output expects FORMAT:PATH with FORMAT one of {', '.join(SINKS)}, got {spec!r}")
+    return SINKS[sink_format], path
+
+
+def open_sink(spec: str):
+    """
+    Opens the sink of an `--output` spec, FORMAT:PATH, e.g. 'sqlite:costs.sqlite' or 'parquet:costs/'.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    sink_class, path = _parse_output(spec)
+    from finops_crawler import sinks
+    return getattr(sinks, sink_class)(path)
+
+
+def create_client(platform: str, credentials: tuple, args: argparse.Namespace, checkpoints=None):
+    """
+    Creates the API client of a platform from its credentials.
+    """
+    package = importlib.import_module(f'finops_crawler.{platform}')
+    if platform == 'aws':
+        return package.costs_api(*credentials, role_name=args.aws_role, checkpoints=checkpoints)
+    if platform == 'azure':
+        return package.costs_api(*credentials, checkpoints=checkpoints)
+    if platform == 'openai':
+        return package.api(*credentials)
+    raise ValueError(f"Unknown platform {platform}")
+
+
+def crawl_ranges(args: argparse.Namespace, today: datetime.date):
+    """
+    Returns the (start, end) date ranges one run crawls, one after another: the whole range,
+    or windows of it with --backfill. The end of every window but the last is the start of
+    the next one, so those are crawled with `end_exclusive`, see `run`.
+    """
+    if args.start is not None:
+        start_date = args.start
+        end_date = args.end or today
+    else:
+        end_date = today
+        start_date = today - datetime.timedelta(days=args.days)
+    if not args.backfill and not args.window_days:
+        return [(start_date, end_date)]
+    from finops_crawler.dates import split_range
+    return split_range(start_date, end_date, days=args.window_days)
+
+
+def run(args: argparse.Namespace, credentials_provider, today: Optional[datetime.date] = None):
+    """
+    Runs one crawl of every configured platform.
+
+    Returns:
+        bool: Whether every scope was crawled without errors.
+    """
+    from finops_crawler.crawler import Crawler
+    from finops_crawler import metrics
+
+    platforms = credentials_provider.get_credential_list()
+    if args.provider:
+        platforms = [platform for platform in platforms if platform in args.provider]
+    if not platforms:
+        print("No platform to crawl: set the environment variables of at least one (see credentials_config.yml)")
+        return False
+
+    store = checkpoints = None
+    if args.incremental:
+        from finops_crawler.incremental import WatermarkStore
+        store = WatermarkStore(args.state)
+    if args.checkpoints:
+        from finops_crawler.checkpoints import CheckpointStore
+        checkpoints = CheckpointStore(args.state)
+
+    ok = True
+    concurrency = dict(DEFAULT_CONCURRENCY, **args.concurrency)
+    crawler = Crawler(max_workers=args.max_workers or sum(concurrency.get(platform, 4) for platform in platforms),
+                      progress=_print_progress if args.verbose else None)
+    for platform in platforms:
+        try:
+            client = create_client(platform, credentials_provider.get_credentials(platform), args, checkpoints=checkpoints)
+        except Exception as e:
+            # e.g. wrong credentials; the other platforms are crawled anyway
+            print(f"Creating the {platform} client failed: {e}")
+            ok = False
+            continue
+        crawler.add(client, max_concurrency=concurrency.get(platform, 4), detailed=args.detailed, store=store,
+                    mutable_days=args.mutable_days)
+
+    try:
+        with open_sink(args.output) as sink:
+            ranges = crawl_ranges(args, today or datetime.date.today())
+            for i, (start_date, end_date) in enumerate(ranges):
+                started = time.perf_counter()
+                # the last window ends where the whole range does, for end-inclusive clients its end day is theirs to fetch
+                result = crawler.crawl(start_date.isoformat(), end_date.isoformat(), sink=sink, batch_size=args.batch_size,
+                                       end_exclusive=i < len(ranges) - 1)
+                ok = ok and result.ok
+                _print_summary(result, start_date, end_date, time.perf_counter() - started, errors_only=args.quiet)
+    finally:
+        for closeable in (store, checkpoints):
+            if closeable is not None:
+                closeable.close()
+        if args.metrics_file:
+            metrics.write_prometheus(args.metrics_file)
+    return ok
+
+
+def _print_progress(completed, total, provider, scope, error):
+    status = f"failed: {error}" if error is not None else 'done'
+    print(f"[{completed}/{total}] {provider} {scope or ''} {status}")
+
+
+def _print_summary(result, start_date: datetime.date, end_date: datetime.date, seconds: float, errors_only: bool = False):
+    providers = sorted({provider for provider, _ in list(result.results) + result.empty + list(result.errors)})
+    if not errors_only:
+        print(f"Crawled {start_date} - {end_date} in {seconds:.1f} s")
+    for provider in providers if not errors_only else ():
+        rows = sum(count for (name, _), count in result.results.items() if name == provider)
+        scopes = sum(1 for name, _ in result.results if name == provider)
+        empty = sum(1 for name, _ in result.empty if name == provider)
+        failed = sum(1 for name, _ in result.errors if name == provider)
+        print(f"  {provider}: {rows} rows from {scopes} scopes, {empty} empty, {failed} failed")
+    for (provider, scope), error in result.errors.items():
+        print(f"  {provider} {scope or ''} failed: {error}")
+
+
+def _sleep_until(moment: datetime.datetime):
+    # short sleeps, so a changed system clock (e.g. after a suspend) is noticed
+    while True:
+        remaining = (moment - datetime.datetime.now()).total_seconds()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, 60))
+
+
+def run_daemon(args: argparse.Namespace, credentials_provider):
+    """
+    Crawls whenever the --schedule matches, until interrupted. A failing run is reported and
+    the next one happens as scheduled.
+    """
+    schedule = CronSchedule(args.schedule)
+    if args.run_now:
+        _run_logged(args, credentials_provider)
+    while True:
+        next_run = schedule.next_run(datetime.datetime.now())
+        if not args.quiet:
+            print(f"Next crawl at {next_run:%Y-%m-%d %H:%M}")
+        _sleep_until(next_run)
+        _run_logged(args, credentials_provider)
+
+
+def _run_logged(args: argparse.Namespace, credentials_provider):
+    try:
+        run(args, credentials_provider)
+    except Exception as e:
+        print(f"Crawl failed: {e!r}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='finops-crawler',
+        description="Crawls the cost data of every platform configured in the environment (AWS, Azure, OpenAI) "
+                    "concurrently and writes it to a sink in a common format.",
+    )
+    dates = parser.add_argument_group('date range')
+    dates.add_argument('--days', type=int, default=7, help='crawl the last DAYS days up to today (default: 7)')
+    dates.add_argument('--start', type=_date, help='first day, YYYY-MM-DD; overrides --days')
+    dates.add_argument('--end', type=_date, help='end of the range, YYYY-MM-DD (default: today). Like get_cost, AWS and OpenAI '
+                                                 'exclude it, Azure includes it')
+    dates.add_argument('--backfill', action='store_true', help='crawl the range one calendar month after the other')
+    dates.add_argument('--window-days', type=int, help='crawl the range in windows of this many days, implies --backfill')
+
+    providers = parser.add_argument_group('platforms')
+    providers.add_argument('--provider', action='append', choices=sorted(DEFAULT_CONCURRENCY),
+                           help='only crawl this platform (repeatable); default: every platform with credentials')
+    providers.add_argument('--credentials-config', help='YAML file listing the platforms and their environment variables')
+    providers.add_argument('--concurrency', action='append', metavar='PROVIDER=N',
+                           help='scopes of a platform fetched at the same time (repeatable), '
+                                f"default: {', '.join(f'{name}={value}' for name, value in DEFAULT_CONCURRENCY.items())}")
+    providers.add_argument('--rate', action='append', metavar='PROVIDER=RATE[:BURST]',
+                           help='request budget of a platform in requests per second per scope (repeatable)')
+    providers.add_argument('--max-workers', type=int, help='total worker threads (default: the sum of the concurrencies)')
+    providers.add_argument('--detailed', action='store_true', help='fetch Azure cost details reports instead of daily costs')
+    providers.add_argument('--aws-role', help='assume this role in every member account of the AWS organization')
+
+    output = parser.add_argument_group('output')
+    output.add_argument('--output', default='sqlite:finops_crawler.sqlite', metavar='FORMAT:PATH',
+                        help=f"where to write the data, FORMAT is one of {', '.join(SINKS)} (default: sqlite:finops_crawler.sqlite)")
+    output.add_argument('--batch-size', type=int, default=50000, help='rows per batch when streaming detailed costs')
+    output.add_argument('--state', default='finops_crawler_state.sqlite', help='SQLite file of the --incremental and --checkpoints state')
+    output.add_argument('--incremental', action='store_true', help='only fetch days that are not final in the state yet')
+    output.add_argument('--mutable-days', type=int, default=3, help='trailing days that are always fetched again with --incremental')
+    output.add_argument('--checkpoints', action='store_true', help='resume interrupted paginated queries from the state')
+
+    daemon = parser.add_argument_group('daemon mode')
+    daemon.add_argument('--schedule', metavar='CRON', help='keep running and crawl on this cron schedule, e.g. "0 6 * * *"; '
+                                                           'the date range is relative to every run')
+    daemon.add_argument('--run-now', action='store_true', help='with --schedule, also crawl right away')
+    daemon.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port')
+    daemon.add_argument('--metrics-file', help='write Prometheus metrics to this file after every run')
+
+    parser.add_argument('-v', '--verbose', action='store_true', help='print every finished scope')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print errors')
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Entry point of the `finops-crawler` command.
+
+    Returns:
+        int: The exit status: 0 on success, 1 if anything failed, 2 on invalid arguments.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        args.concurrency = _provider_values(args.concurrency, int, '--concurrency')
+        rates = _provider_values(args.rate, _rate, '--rate')
+        if args.schedule:
+            CronSchedule(args.schedule)
+        _parse_output(args.output)
+    except (argparse.ArgumentTypeError, ValueError) as e:
+        parser.error(str(e))
+    if args.incremental and args.detailed:
+        parser.error("--incremental is not supported with --detailed")
+    if args.end is not None and args.start is None:
+        parser.error("--end needs --start")
+    if args.start is not None and args.end is not None and args.end <= args.start:
+        parser.error("--end must be after --start")
+
+    from finops_crawler import credentials_provider
+    from finops_crawler import ratelimit
+    from finops_crawler import metrics
+    for provider, (rate, capacity) in rates.items():
+        # a budget: the adaptive rate may slow down on throttling, but not grow beyond it
+        ratelimit.configure(provider, rate=rate, capacity=capacity, max_rate=rate)
+    # CredentialsProvider resolves relative names against the package directory
+    credentials = credentials_provider.api(os.path.abspath(args.credentials_config)) if args.credentials_config else credentials_provider.api()
+    if args.metrics_port:
+        metrics.serve_prometheus(args.metrics_port)
+
+    try:
+        if args.schedule:
+            run_daemon(args, credentials)
+            return 0
+        return 0 if run(args, credentials) else 1
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+# Columnar (Apache Arrow) versions of the crawl results. A list of per-row dicts repeats every
+# key and boxes every value, Arrow keeps typed columns that pandas and DuckDB read without copying.
+# pyarrow is an optional dependency: pip install finops_crawler[arrow]
+from typing import Iterable, Optional, Sequence
+
+# date formats found in the Azure cost details CSV files
+AZURE_TIMESTAMP_PARSERS = ['%m/%d/%Y', '%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%SZ']
+
+# numeric columns of the Azure cost details CSV files (EA and MCA spell them with a capital or a lower case first letter).
+# They're always parsed as floats: a block that happens to hold only whole numbers would otherwise become int64
+# and fail the stream at the first fraction in a later block.
+AZURE_FLOAT_COLUMNS = tuple(
+    variant
+    for name in ('Quantity', 'EffectivePrice', 'UnitPrice', 'PayGPrice', 'CostInBillingCurrency', 'CostInPricingCurrency',
+                 'CostInUsd', 'PaygCostInBillingCurrency', 'PaygCostInUsd', 'ExchangeRatePricingToBilling', 'Cost', 'PreTaxCost')
+    for variant in (name, name[0].lower() + name[1:])
+)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.csv
+    except ImportError as e:
+        raise ImportError("Columnar output requires pyarrow, install it with `pip install finops_crawler[arrow]`") from e
+    return pyarrow
+
+
+def azure_query_to_batches(pages: Iterable[dict]):
+    """
+    Converts pages of the Azure Cost Management query API into record batches.
+
+    Args:
+        pages (iterable): The `properties` of every page, each with `columns` and positional `rows`.
+
+    Yields:
+        pyarrow.RecordBatch: One batch per page. Number columns become float64, except `UsageDate`
+        (e.g. 20231001) which becomes date32. Datetime columns become timestamps.
+    """
+    pa = _pyarrow()
+    pc = pa.compute
+    for page in pages:
+        rows = page['rows']
+        arrays = []
+        names = []
+        for i, column in enumerate(page['columns']):
+            values = [row[i] for row in rows]
+            if column['name'] == 'UsageDate':
+                dates = pc.strptime(pa.array([str(value) for value in values], pa.string()), format='%Y%m%d', unit='s')
+                array = pc.cast(dates, pa.date32())
+            elif column['type'] == 'Number':
+                array = pa.array(values, pa.float64())
+            elif column['type'] == 'Datetime':
+                array = pc.cast(pa.array(values, pa.string()), pa.timestamp('s'))
+            else:
+                array = pa.array(values, pa.string())
+            arrays.append(array)
+            names.append(column['name'])
+        yield pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def azure_query_to_arrow(pages: Iterable[dict]):
+    """
+    Same as `azure_query_to_batches`, but returns a single `pyarrow.Table`.
+    """
+    pa = _pyarrow()
+    return pa.Table.from_batches(list(azure_query_to_batches(pages)))
+
+
+def table_from_batches(batches: Sequence):
+    pa = _pyarrow()
+    return pa.Table.from_batches(batches)
+
+
+def csv_to_batches(stream, column_types: Optional[dict] = None, block_size: int = 16 * 1024 * 1024):
+    """
+    Parses a CSV stream (e.g. an Azure cost details blob) into record batches without reading it all into memory.
+
+    Types are inferred from the first block: numbers become int64/float64 and dates
+    (MM/DD/YYYY or ISO format) become timestamps. The columns of `AZURE_FLOAT_COLUMNS` are
+    always float64.
+
+    Args:
+        stream: A binary file-like object.
+        column_types (dict, optional): Column name -> pyarrow type, e.g. the schema of a previous
+            blob of the same report, so that all blobs end up with the same schema. See `widen_types`.
+        block_size (int, optional): Number of bytes parsed per batch.
+
+    Yields:
+        pyarrow.RecordBatch
+    """
+    pa = _pyarrow()
+    types = {name: pa.float64() for name in AZURE_FLOAT_COLUMNS}
+    types.update(column_types or {})
+    reader = pa.csv.open_csv(
+        stream,
+        read_options=pa.csv.ReadOptions(block_size=block_size),
+        # quoted fields (e.g. tags) may contain line breaks
+        parse_options=pa.csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa.csv.ConvertOptions(column_types=types, timestamp_parsers=AZURE_TIMESTAMP_PARSERS),
+    )
+    for batch in reader:
+        yield batch
+
+
+def widen_types(schema):
+    """
+    Returns the column types of a schema to parse further CSV blocks or blobs with, with int64
+    widened to float64: a column of whole numbers so far may still hold fractions later.
+    """
+    pa = _pyarrow()
+    return {field.name: pa.float64() if pa.types.is_integer(field.type) else field.type for field in schema}
+
+
+def cast_batch(batch, column_types: dict):
+    """
+    Casts the columns of a record batch to the given types, e.g. those of `widen_types`.
+    """
+    pa = _pyarrow()
+    schema = pa.schema([pa.field(field.name, column_types.get(field.name, field.type)) for field in batch.schema])
+    if schema.equals(batch.schema):
+        return batch
+    return pa.RecordBatch.from_arrays([column.cast(field.type) for column, field in zip(batch.columns, schema)], schema=schema)
+
+
+def aws_results_to_arrow(results_by_time: Sequence[dict], group_by: Sequence[str] = ('SERVICE', 'USAGE_TYPE')):
+    """
+    Flattens the `ResultsByTime` of AWS Cost Explorer into a `pyarrow.Table`.
+
+    Every group becomes a row with the columns `start`, `end` (date32), `estimated`, one string
+    column per group-by key, and for each metric its amount (float64) and `<metric>_unit`.
+    Periods without groups contribute their `Total` as a single row.
+
+    Args:
+        results_by_time (list): As returned by `AWSAPI.get_cost`.
+        group_by (list, optional): Names of the group-by keys, in request order.
+    """
+    pa = _pyarrow()
+    starts, ends, estimated = [], [], []
+    keys = {name: [] for name in group_by}
+    metrics = {}
+    row_count = 0
+
+    for result in results_by_time:
+        groups = result.get('Groups') or [{'Keys': [None] * len(group_by), 'Metrics': result.get('Total', {})}]
+        for group in groups:
+            starts.append(result['TimePeriod']['Start'])
+            ends.append(result['TimePeriod']['End'])
+            estimated.append(result.get('Estimated'))
+            for name, key in zip(group_by, group['Keys']):
+                keys[name].append(key)
+            for metric, value in group['Metrics'].items():
+                # a metric first seen in a later period has no value in the earlier rows
+                amounts, units = metrics.setdefault(metric, ([None] * row_count, [None] * row_count))
+                amounts.append(value['Amount'])
+                units.append(value['Unit'])
+            row_count += 1
+            for amounts, units in metrics.values():
+                if len(amounts) < row_count:
+                    amounts.append(None)
+                    units.append(None)
+
+    columns = {
+        'start': pa.compute.cast(pa.array(starts, pa.string()), pa.date32()),
+        'end': pa.compute.cast(pa.array(ends, pa.string()), pa.date32()),
+        'estimated': pa.array(estimated, pa.bool_()),
+    }
+    for name, values in keys.items():
+        columns[name] = pa.array(values, pa.string())
+    for metric, (amounts, units) in metrics.items():
+        columns[metric] = pa.compute.cast(pa.array(amounts, pa.string()), pa.float64())
+        columns[f'{metric}_unit'] = pa.array(units, pa.string())
+    return pa.table(columns)
+
+
+def rows_to_arrow(rows: Sequence[dict], dates: Sequence[str] = (), timestamps: Sequence[str] = ()):
+    """
+    Converts a list of flat dicts, e.g. the rows of `OpenAIAPI.get_usage`, into a `pyarrow.Table`.
+
+    Column types are inferred from the values; a field missing in some rows is null there.
+
+    Args:
+        rows (list): Dicts of column name -> value.
+        dates (list, optional): Columns of 'YYYY-MM-DD' strings to convert to date32.
+        timestamps (list, optional): Columns of 'YYYY-MM-DDTHH:MM:SSZ' strings to convert to UTC timestamps.
+    """
+    pa = _pyarrow()
+    names = dict.fromkeys(name for row in rows for name in row)
+    columns = {}
+    for name in names:
+        values = [row.get(name) for row in rows]
+        if name in dates:
+            columns[name] = pa.compute.cast(pa.array(values, pa.string()), pa.date32())
+        elif name in timestamps:
+            columns[name] = pa.compute.strptime(pa.array(values, pa.string()), format='%Y-%m-%dT%H:%M:%SZ', unit='s').cast(pa.timestamp('s', tz='UTC'))
+        else:
+            columns[name] = pa.array(values)
+    return pa.table(columns)
+
+
+def write_parquet(data, path: str, compression: str = 'zstd', **kwargs):
+    """
+    Writes a `pyarrow.Table` or an iterable of record batches to a Parquet file.
+
+    Batches are written as they arrive, so a streamed report is never fully held in memory.
+
+    Args:
+        data: A `pyarrow.Table`, or an iterable of `pyarrow.RecordBatch` with the same schema.
+        path (str): Output file.
+        compression (str, optional): Parquet compression codec.
+        **kwargs: Passed on to `pyarrow.parquet.ParquetWriter`.
+
+    Returns:
+        int: Number of rows written.
+    """
+    pa = _pyarrow()
+    import pyarrow.parquet as pq
+
+    if isinstance(data, pa.Table):
+        pq.write_table(data, path, compression=compression, **kwargs)
+        return data.num_rows
+
+    writer = None
+    rows = 0
+    try:
+        for batch in data:
+            if writer is None:
+                writer = pq.ParquetWriter(path, batch.schema, compression=compression, **kwargs)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
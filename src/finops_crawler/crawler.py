@@ -0,0 +1,225 @@
+import concurrent.futures
+import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+from finops_crawler.base import CloudAPI, EmptyResultError
+from finops_crawler.dates import to_date
+from finops_crawler.incremental import WatermarkStore, get_cost_incremental
+from finops_crawler import schema
+from finops_crawler import metrics
+
+
+class CrawlResult:
+    """
+    Outcome of a crawl, keyed by (provider name, scope).
+
+    Attributes:
+        results (dict): Cost data of every scope that returned data.
+        empty (list): Scopes that were fetched successfully but had no data.
+        errors (dict): The exception raised for every scope that failed. Failing to list the
+            scopes of a provider is recorded with the scope '*'.
+    """
+
+    def __init__(self):
+        self.results: Dict[Tuple[str, Optional[str]], object] = {}
+        self.empty: List[Tuple[str, Optional[str]]] = []
+        self.errors: Dict[Tuple[str, Optional[str]], Exception] = {}
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+class Crawler:
+    """
+    Fetches costs for many subscriptions and accounts concurrently.
+
+    Every added client is fanned out over its scopes (see `CloudAPI.get_scopes`) on a shared
+    worker pool. Each provider has its own concurrency cap so that a large Azure tenant can't
+    starve the AWS accounts or exceed the throttling limits of one API. A failing or empty
+    scope is recorded in the result and doesn't abort the rest of the batch.
+
+    Example:
+        crawler = Crawler(max_workers=16)
+        crawler.add(azure_costs_client, max_concurrency=8)
+        crawler.add(aws_costs_client, max_concurrency=2)
+        result = crawler.crawl(seven_days_ago, today)
+    """
+
+    def __init__(self, max_workers: int = 16, progress: Optional[Callable] = None):
+        """
+        Args:
+            max_workers (int, optional): Total number of worker threads shared by all providers.
+            progress (callable, optional): Called after every finished scope as
+                `progress(completed, total, provider, scope, error)`, where `error` is None on success.
+        """
+        self.max_workers = max_workers
+        self.progress = progress
+        self.providers = []
+
+    def add(self, client: CloudAPI, max_concurrency: int = 4, scopes: Optional[Iterable] = None,
+            detailed: bool = False, name: Optional[str] = None, store: Optional[WatermarkStore] = None,
+            mutable_days: int = 3):
+        """
+        Adds a client to the crawl.
+
+        Args:
+            client (CloudAPI): An initialized API client.
+            max_concurrency (int, optional): Maximum number of scopes of this provider fetched at the same time.
+            scopes (iterable, optional): Scopes to fetch. Defaults to everything `client.get_scopes()` returns.
+            detailed (bool, optional): Fetch detailed costs where the platform supports it (Azure).
+            name (str, optional): Name used in the results. Defaults to `client.name`.
+            store (WatermarkStore, optional): Crawl incrementally, fetching only the days that aren't
+                final in this store yet. See `finops_crawler.incremental.get_cost_incremental`.
+            mutable_days (int, optional): Number of trailing days that are always fetched again
+                in incremental mode.
+        """
+        if store is not None and detailed:
+            raise ValueError("Incremental crawling is not supported for detailed costs")
+        name = name or client.name or type(client).__name__
+        self.providers.append({
+            'name': name,
+            'client': client,
+            'max_concurrency': max(1, max_concurrency),
+            'scopes': list(scopes) if scopes is not None else None,
+            'detailed': detailed,
+            'store': store,
+            'mutable_days': mutable_days,
+        })
+        return self
+
+    def crawl(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+              sink=None, batch_size: int = 50000, end_exclusive: bool = False):
+        """
+        Fetches the costs of all scopes of all added clients.
+
+        Args:
+            start_date, end_date: The date range, as for the clients' `get_cost`.
+            sink (Sink, optional): Write the data of every scope to this sink (see `finops_crawler.sinks`)
+                as soon as it's fetched, normalized with `finops_crawler.schema`, instead of keeping it.
+                Detailed Azure costs are streamed to the sink in batches.
+            batch_size (int, optional): Rows per batch when streaming detailed costs to the sink.
+            end_exclusive (bool, optional): Leave `end_date` out for every client, also for the ones
+                that include it (`CloudAPI.end_date_inclusive`), which are asked for a day less. Lets
+                consecutive windows of a longer range be crawled without fetching a boundary day twice.
+
+        Returns:
+            CrawlResult: Data, empty scopes and errors per (provider, scope). With a sink, `results`
+            holds the number of rows written instead of the data.
+        """
+        result = CrawlResult()
+        if sink is not None:
+            sink.reset()
+
+        queues = {}
+        for provider in self.providers:
+            scopes = provider['scopes']
+            if scopes is None:
+                try:
+                    scopes = provider['client'].get_scopes()
+                except Exception as e:
+                    print(f"Listing scopes for {provider['name']} failed: {e}")
+                    result.errors[(provider['name'], '*')] = e
+                    continue
+            queues[provider['name']] = [(provider, scope) for scope in scopes]
+
+        total = sum(len(tasks) for tasks in queues.values())
+        completed = 0
+        active = {name: 0 for name in queues}
+        limits = {provider['name']: provider['max_concurrency'] for provider in self.providers}
+        ends = {provider['name']: self._end_date(provider['client'], end_date, end_exclusive) for provider in self.providers}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+
+            def fill():
+                # hand out free workers round-robin, so every provider gets going right away
+                progressed = True
+                while progressed and len(running) < self.max_workers:
+                    progressed = False
+                    for name, tasks in queues.items():
+                        if tasks and active[name] < limits[name] and len(running) < self.max_workers:
+                            provider, scope = tasks.pop(0)
+                            future = executor.submit(self._fetch, provider, scope, start_date, ends[name], sink, batch_size)
+                            running[future] = (name, scope)
+                            active[name] += 1
+                            progressed = True
+
+            fill()
+            while running:
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name, scope = running.pop(future)
+                    active[name] -= 1
+                    completed += 1
+                    error = future.exception()
+                    status = 'empty'
+                    if error is None:
+                        data = future.result()
+                        if data:
+                            result.results[(name, scope)] = data
+                            status = 'ok'
+                        else:
+                            result.empty.append((name, scope))
+                    elif isinstance(error, EmptyResultError):
+                        result.empty.append((name, scope))
+                        error = None
+                    else:
+                        result.errors[(name, scope)] = error
+                        status = 'error'
+                    metrics.inc('scopes', provider=name, status=status)
+                    if self.progress:
+                        self.progress(completed, total, name, scope, error)
+                fill()
+
+        return result
+
+    @staticmethod
+    def _end_date(client: CloudAPI, end_date: Union[str, datetime.datetime], end_exclusive: bool):
+        if not end_exclusive or not client.end_date_inclusive:
+            return end_date
+        return (to_date(end_date) - datetime.timedelta(days=1)).isoformat()
+
+    @staticmethod
+    def _fetch(provider, scope, start_date, end_date, sink=None, batch_size=50000):
+        with metrics.span('scope', provider=provider['name'], scope=scope):
+            return Crawler._fetch_scope(provider, scope, start_date, end_date, sink, batch_size)
+
+    @staticmethod
+    def _fetch_scope(provider, scope, start_date, end_date, sink, batch_size):
+        if sink is None:
+            return Crawler._fetch_records(provider, scope, start_date, end_date, sink, batch_size)
+        client = provider['client']
+        # days of the range that come back without any rows are cleared as well, but only once the scope succeeded
+        sink.begin(client.name, scope, start_date, end_date, end_inclusive=client.end_date_inclusive)
+        try:
+            rows = Crawler._fetch_records(provider, scope, start_date, end_date, sink, batch_size)
+        except EmptyResultError:
+            sink.finish(client.name, scope)
+            raise
+        sink.finish(client.name, scope)
+        return rows
+
+    @staticmethod
+    def _fetch_records(provider, scope, start_date, end_date, sink, batch_size):
+        client = provider['client']
+        if sink is not None and provider['detailed'] and hasattr(client, 'iter_cost_detailed_columns'):
+            # only the columns of the common format are parsed, straight into columns
+            rows = 0
+            for batch in client.iter_cost_detailed_columns(scope, start_date, end_date, columns=schema.AZURE_DETAILED_COLUMNS,
+                                                           batch_size=batch_size):
+                # recorded under the crawled scope, which is what the sink clears stale partitions by
+                records = schema.from_azure_detailed_columns(batch, subscription_id=scope)
+                sink.write(records)
+                rows += len(records)
+            return rows
+
+        if provider['store'] is not None:
+            data = get_cost_incremental(client, provider['store'], start_date, end_date, scope=scope,
+                                        mutable_days=provider['mutable_days'])
+        else:
+            data = client.get_scope_cost(scope, start_date, end_date, detailed=provider['detailed'])
+        if sink is None:
+            return data
+        records = schema.normalize(client.name, data, scope)
+        sink.write(records)
+        return len(records)
@@ -1 +1,6 @@
-from .credentials_provider import CredentialsProvider as api
+from finops_crawler._lazy import lazy_exports
+
+# the clients are imported on first use, so that importing the package stays cheap
+__getattr__, __dir__ = lazy_exports(__name__, {
+    'api': ('.credentials_provider', 'CredentialsProvider'),
+})
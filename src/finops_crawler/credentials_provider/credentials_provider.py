@@ -1,11 +1,12 @@
 import os
-import yaml
 
 class CredentialsProvider:
 
     def __init__(self, credentials_file = 'credentials_config.yml'):
         current_dir = os.path.dirname(os.path.abspath(__file__))
         credentials_path = os.path.join(current_dir, credentials_file)
+        # imported here, only jobs reading the config file need yaml
+        import yaml
 
         with open(credentials_path, 'r') as f:
             try:
@@ -0,0 +1,47 @@
+import datetime
+from typing import Optional, Union
+
+DateLike = Union[str, datetime.date, datetime.datetime]
+
+
+def to_date(value: DateLike):
+    """
+    Converts a 'YYYY-MM-DD' string, date or datetime into a date.
+    """
+    if isinstance(value, str):
+        return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def split_range(start_date: DateLike, end_date: DateLike, days: Optional[int] = None, end_inclusive: bool = False):
+    """
+    Splits a date range into consecutive, non-overlapping shards.
+
+    Args:
+        start_date (str or date): First day of the range.
+        end_date (str or date): End of the range.
+        days (int, optional): Length of a shard in days. Without it the range is split at
+            calendar month boundaries, which keeps closed months in shards of their own.
+        end_inclusive (bool, optional): Whether `end_date` itself belongs to the range. The shards
+            follow the same convention, so they can be passed to the API as they are.
+
+    Returns:
+        list: (start, end) date tuples in date order.
+    """
+    start = to_date(start_date)
+    stop = to_date(end_date)
+    if end_inclusive:
+        stop += datetime.timedelta(days=1)
+
+    shards = []
+    while start < stop:
+        if days:
+            shard_stop = start + datetime.timedelta(days=days)
+        else:
+            shard_stop = (start.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        shard_stop = min(shard_stop, stop)
+        shards.append((start, shard_stop - datetime.timedelta(days=1) if end_inclusive else shard_stop))
+        start = shard_stop
+    return shards
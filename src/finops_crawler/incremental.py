@@ -0,0 +1,165 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from finops_crawler.base import CloudAPI, EmptyResultError
+from finops_crawler.dates import DateLike, to_date
+from finops_crawler import metrics
+
+
+class WatermarkStore:
+    """
+    A local SQLite store of already fetched cost data, one partition per day.
+
+    Every partition is stored per (provider, scope, granularity, day) together with a flag
+    telling whether the day was already final when it was fetched. The watermark of a
+    (provider, scope, granularity) is the latest day whose final data is in the store.
+
+    The store can be shared between threads.
+    """
+
+    def __init__(self, path: str = 'finops_crawler.sqlite'):
+        """
+        Args:
+            path (str, optional): Path of the SQLite database. Created if it doesn't exist.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS partitions (
+                    provider TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    granularity TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    rows TEXT NOT NULL,
+                    final INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (provider, scope, granularity, day)
+                )
+            """)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    provider TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    granularity TEXT NOT NULL,
+                    watermark TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (provider, scope, granularity)
+                )
+            """)
+
+    def get_partitions(self, provider: str, scope: Optional[str], granularity: str, start_day: datetime.date, end_day: datetime.date):
+        """
+        Returns {day: (rows, final)} of the stored partitions between `start_day` and `end_day`, both inclusive.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT day, rows, final FROM partitions WHERE provider = ? AND scope = ? AND granularity = ? AND day BETWEEN ? AND ?",
+                (provider, scope or '', granularity, start_day.isoformat(), end_day.isoformat()),
+            )
+            return {datetime.date.fromisoformat(day): (json.loads(rows), bool(final)) for day, rows, final in cursor}
+
+    def put_partitions(self, provider: str, scope: Optional[str], granularity: str, partitions: dict, final_before: datetime.date):
+        """
+        Stores {day: rows} partitions, replacing what was stored for those days.
+
+        Days before `final_before` are marked final and move the watermark forward.
+        """
+        now = time.time()
+        records = [
+            (provider, scope or '', granularity, day.isoformat(), json.dumps(rows), int(day < final_before), now)
+            for day, rows in partitions.items()
+        ]
+        final_days = [day for day in partitions if day < final_before]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO partitions VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+            if final_days:
+                self._connection.execute("""
+                    INSERT INTO watermarks VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (provider, scope, granularity) DO UPDATE
+                    SET watermark = MAX(watermark, excluded.watermark), updated_at = excluded.updated_at
+                """, (provider, scope or '', granularity, max(final_days).isoformat(), now))
+
+    def get_watermark(self, provider: str, scope: Optional[str], granularity: str = 'daily'):
+        """
+        Returns the latest day with final data in the store, or None.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT watermark FROM watermarks WHERE provider = ? AND scope = ? AND granularity = ?",
+                (provider, scope or '', granularity),
+            ).fetchone()
+        return datetime.date.fromisoformat(row[0]) if row else None
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def get_cost_incremental(client: CloudAPI, store: WatermarkStore, start_date: DateLike, end_date: DateLike,
+                         scope: Optional[str] = None, mutable_days: int = 3, today: Optional[datetime.date] = None):
+    """
+    Fetches the cost of a date range, downloading only the days that aren't final in the store.
+
+    Cloud billing keeps restating the last few days, so days within `mutable_days` of today
+    are always fetched again, as are days that were still mutable when they were fetched last
+    time. Everything older is served from the store. Missing days are fetched in as few
+    requests as possible (one per contiguous run of days) and merged with the stored history.
+
+    Args:
+        client (CloudAPI): An initialized API client.
+        store (WatermarkStore): The store to read from and write to.
+        start_date (str or date): Start of the range, as for the client's `get_cost`.
+        end_date (str or date): End of the range, as for the client's `get_cost`. Whether the end
+            date itself is included depends on the platform, like with `get_cost`.
+        scope (str, optional): Scope as returned by `client.get_scopes()`, e.g. an Azure subscription ID.
+        mutable_days (int, optional): Number of days before today that are considered still changing.
+        today (date, optional): Overrides the current date, mostly useful for backfills and testing.
+
+    Returns:
+        list: The rows of every day in the range, in date order, in the same format as `get_cost` returns them.
+    """
+    start_day = to_date(start_date)
+    end_day = to_date(end_date)
+    if not client.end_date_inclusive:
+        end_day -= datetime.timedelta(days=1)
+    if end_day < start_day:
+        return []
+
+    today = today or datetime.date.today()
+    final_before = today - datetime.timedelta(days=mutable_days)
+    granularity = 'daily'
+
+    stored = store.get_partitions(client.name, scope, granularity, start_day, end_day)
+    days = [start_day + datetime.timedelta(days=i) for i in range((end_day - start_day).days + 1)]
+    missing = [day for day in days if day not in stored or not stored[day][1]]
+
+    # fetch every contiguous run of missing days with one request
+    runs = []
+    for day in missing:
+        if runs and runs[-1][1] + datetime.timedelta(days=1) == day:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+
+    partitions = {day: rows for day, (rows, final) in stored.items()}
+    for run_start, run_end in runs:
+        request_end = run_end if client.end_date_inclusive else run_end + datetime.timedelta(days=1)
+        metrics.inc('incremental_days', (run_end - run_start).days + 1, provider=client.name, scope=scope)
+        try:
+            data = client.get_scope_cost(scope, run_start.isoformat(), request_end.isoformat())
+        except EmptyResultError:
+            data = None
+        fetched = {to_date(day): rows for day, rows in client.split_by_day(data).items()}
+        # days without data are stored too, so they aren't asked for again once final
+        fetched = {day: fetched.get(day, []) for day in days if run_start <= day <= run_end}
+        store.put_partitions(client.name, scope, granularity, fetched, final_before)
+        partitions.update(fetched)
+
+    return [row for day in days for row in partitions.get(day, [])]
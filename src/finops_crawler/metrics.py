@@ -0,0 +1,316 @@
+import contextlib
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Instrumentation of the hot paths of a crawl: every HTTP request and Cost Explorer call, token
+# fetch, report poll and blob records how long it took and how many bytes, pages and rows it
+# produced, along with retries and the time spent sleeping, labelled by provider, scope and
+# operation. The numbers are aggregated in the process-wide registry below and can be read with
+# `snapshot()` or `to_prometheus()`, watched live with `add_hook()`, and turned into
+# OpenTelemetry spans with `use_opentelemetry()`.
+#
+# Recorded metrics (counters unless noted):
+#   request_seconds   timing of every HTTP request or SDK call {provider, scope, operation, status}
+#   bytes             response bytes {provider, scope, operation}
+#   pages             result pages {provider, scope, operation}
+#   rows              rows returned or parsed {provider, scope, operation}
+#   retries           retried attempts {provider, scope, operation, reason}
+#   sleep_seconds     time spent waiting {provider, scope, reason}: rate_limit, retry or report_poll
+#   scopes            finished scopes of a crawl {provider, status}: ok, empty or error
+#   incremental_days  days fetched by an incremental crawl, as opposed to served from the store {provider, scope}
+#   resumed_pages     pages read from a checkpoint instead of fetched again {provider, scope}
+#   <span>_seconds    timing of token_fetch, report (generation and polling), blob_download, blob_parse,
+#                     blob_stream (download and parse interleaved) and scope (everything of one scope)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_counters: Dict[Tuple[str, Labels], float] = {}
+# name, labels -> [count, sum, max]
+_timings: Dict[Tuple[str, Labels], List[float]] = {}
+_lock = threading.Lock()
+_hooks: List[Callable] = []
+_tracer = None
+
+
+class MetricEvent:
+    """
+    A single measurement, as passed to the hooks.
+
+    Attributes:
+        kind (str): 'counter' or 'timing'.
+        name (str): Metric name, e.g. 'rows' or 'request_seconds'.
+        value (float): The increment of a counter, or the seconds of a timing.
+        labels (dict): Labels of the measurement, e.g. {'provider': 'azure', 'scope': subscription_id}.
+    """
+
+    __slots__ = ('kind', 'name', 'value', 'labels')
+
+    def __init__(self, kind: str, name: str, value: float, labels: Dict[str, str]):
+        self.kind = kind
+        self.name = name
+        self.value = value
+        self.labels = labels
+
+    def __repr__(self):
+        return f"MetricEvent({self.kind!r}, {self.name!r}, {self.value!r}, {self.labels!r})"
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted((label, '' if value is None else str(value)) for label, value in labels.items()))
+
+
+def _emit(kind: str, name: str, value: float, labels: dict):
+    for hook in list(_hooks):
+        try:
+            hook(MetricEvent(kind, name, value, labels))
+        except Exception as e:
+            # a broken hook must not break the crawl
+            print(f"Metrics hook {hook!r} failed: {e}")
+
+
+def inc(name: str, value: float = 1, **labels):
+    """
+    Adds `value` to a counter.
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    if _hooks:
+        _emit('counter', name, value, labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    """
+    Records one duration of a timing.
+    """
+    key = _key(name, labels)
+    with _lock:
+        timing = _timings.get(key)
+        if timing is None:
+            _timings[key] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+    if _hooks:
+        _emit('timing', name, seconds, labels)
+
+
+@contextlib.contextmanager
+def span(name: str, **labels):
+    """
+    Times a block as the timing `<name>_seconds`, and as an OpenTelemetry span if enabled.
+
+    Example:
+        with metrics.span('token_fetch', provider='azure'):
+            token = fetch()
+    """
+    start = time.perf_counter()
+    if _tracer is None:
+        try:
+            yield
+        finally:
+            observe(f'{name}_seconds', time.perf_counter() - start, **labels)
+        return
+    attributes = {f'finops.{label}': '' if value is None else str(value) for label, value in labels.items()}
+    with _tracer.start_as_current_span(name, attributes=attributes):
+        try:
+            yield
+        finally:
+            observe(f'{name}_seconds', time.perf_counter() - start, **labels)
+
+
+def timed_iter(iterable, name: str, chunk_size: int = 1000, **labels):
+    """
+    Yields the items of `iterable`, recording the time spent producing them as `<name>_seconds`
+    and their number as `rows`.
+
+    Items are taken `chunk_size` at a time, so timing a parser costs next to nothing per row
+    and the time the consumer spends on the rows is not counted.
+    """
+    iterator = iter(iterable)
+    seconds = 0.0
+    rows = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            items = []
+            for item in iterator:
+                items.append(item)
+                if len(items) >= chunk_size:
+                    break
+            seconds += time.perf_counter() - start
+            if not items:
+                return
+            rows += len(items)
+            yield from items
+    finally:
+        observe(f'{name}_seconds', seconds, **labels)
+        inc('rows', rows, **labels)
+
+
+def add_hook(hook: Callable):
+    """
+    Calls `hook(event)` with a `MetricEvent` for every measurement, from the thread that made it.
+
+    Hooks must be fast and thread-safe; exceptions they raise are printed and ignored.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Callable):
+    _hooks.remove(hook)
+
+
+def use_opentelemetry(tracer=None):
+    """
+    Makes every span also an OpenTelemetry span. Requires opentelemetry-api.
+
+    Args:
+        tracer (opentelemetry.trace.Tracer, optional): Defaults to a tracer named finops_crawler
+            from the globally configured tracer provider. Pass False to turn the spans off again.
+    """
+    global _tracer
+    if tracer is False:
+        _tracer = None
+        return
+    if tracer is None:
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImportError("OpenTelemetry spans require opentelemetry-api, install it with `pip install opentelemetry-api`") from e
+        tracer = trace.get_tracer('finops_crawler')
+    _tracer = tracer
+
+
+def snapshot():
+    """
+    Returns a copy of everything recorded so far.
+
+    Returns:
+        dict: {'counters': {(name, labels): value}, 'timings': {(name, labels): {'count', 'sum', 'max'}}},
+        where labels is a sorted tuple of (label, value) pairs.
+    """
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'timings': {key: {'count': count, 'sum': total, 'max': maximum} for key, (count, total, maximum) in _timings.items()},
+        }
+
+
+def totals(name: str, by: str = 'provider'):
+    """
+    Sums a counter, or the seconds of a timing, over all labels except `by`.
+
+    Example:
+        metrics.totals('sleep_seconds', by='reason')  # {'rate_limit': 12.5, 'report_poll': 300.0, ...}
+    """
+    result = {}
+    data = snapshot()
+    for (metric, labels), value in data['counters'].items():
+        if metric == name:
+            group = dict(labels).get(by, '')
+            result[group] = result.get(group, 0) + value
+    for (metric, labels), timing in data['timings'].items():
+        if metric == name:
+            group = dict(labels).get(by, '')
+            result[group] = result.get(group, 0) + timing['sum']
+    return result
+
+
+def reset():
+    """
+    Forgets everything recorded so far, e.g. between two crawls of a long-running process.
+    """
+    with _lock:
+        _counters.clear()
+        _timings.clear()
+
+
+def _prometheus_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + '}'
+
+
+def to_prometheus(prefix: str = 'finops_crawler_'):
+    """
+    Renders everything recorded so far in the Prometheus text exposition format.
+
+    Counters get the suffix `_total`, timings are exported as summaries (`_count` and `_sum`)
+    with their maximum as a separate `_max` gauge.
+    """
+    data = snapshot()
+    lines = []
+    counters = {}
+    for (name, labels), value in data['counters'].items():
+        counters.setdefault(name, []).append((labels, value))
+    for name in sorted(counters):
+        metric = f'{prefix}{name}_total'
+        lines.append(f'# TYPE {metric} counter')
+        lines.extend(f'{metric}{_prometheus_labels(labels)} {value}' for labels, value in sorted(counters[name]))
+
+    timings = {}
+    for (name, labels), timing in data['timings'].items():
+        timings.setdefault(name, []).append((labels, timing))
+    for name in sorted(timings):
+        metric = f'{prefix}{name}'
+        lines.append(f'# TYPE {metric} summary')
+        for labels, timing in sorted(timings[name], key=lambda item: item[0]):
+            lines.append(f"{metric}_count{_prometheus_labels(labels)} {timing['count']}")
+            lines.append(f"{metric}_sum{_prometheus_labels(labels)} {timing['sum']}")
+        lines.append(f'# TYPE {metric}_max gauge')
+        lines.extend(f"{metric}_max{_prometheus_labels(labels)} {timing['max']}" for labels, timing in sorted(timings[name], key=lambda item: item[0]))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path: str, prefix: str = 'finops_crawler_'):
+    """
+    Writes `to_prometheus()` to a file atomically, for the textfile collector of the node exporter.
+
+    Suits batch jobs like a nightly crawl, which are gone before Prometheus could scrape them.
+    """
+    import os
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(to_prometheus(prefix))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def serve_prometheus(port: int, address: str = '', prefix: str = 'finops_crawler_'):
+    """
+    Serves `to_prometheus()` on http://address:port/metrics from a daemon thread.
+
+    Returns:
+        http.server.ThreadingHTTPServer: Call `shutdown()` on it to stop serving.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = to_prometheus(prefix).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
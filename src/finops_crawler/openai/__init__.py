@@ -1 +1,9 @@
+from finops_crawler._lazy import lazy_exports
+
+# `api` is also the name of the submodule, so it's bound eagerly; importing the submodule later would shadow a lazy export
 from .api import OpenAIAPI as api
+
+# the clients are imported on first use, so that importing the package stays cheap
+__getattr__, __dir__ = lazy_exports(__name__, {
+    'async_api': ('.aio', 'AsyncOpenAIAPI'),
+})
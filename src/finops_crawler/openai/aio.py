@@ -0,0 +1,112 @@
+import asyncio
+import datetime
+import os
+from typing import Optional, Sequence, Union
+from finops_crawler import aio
+from finops_crawler import ratelimit
+from finops_crawler.openai.api import (OpenAIAPI, DEFAULT_WINDOW_DAYS, MAX_BUCKETS, MAX_COST_BUCKETS, USAGE_KINDS,
+                                       _cost_rows, _merge_windows, _page_rows, _usage_rows, _windows)
+
+
+class AsyncOpenAIAPI(aio.AsyncCloudAPI):
+    """
+    The asyncio counterpart of `OpenAIAPI`.
+    """
+
+    name = OpenAIAPI.name
+    end_date_inclusive = OpenAIAPI.end_date_inclusive
+
+    def __init__(self, openai_org_id: Optional[str] = None, openai_api_key: Optional[str] = None, session=None):
+        """
+        Args:
+            openai_org_id (str, optional): OpenAI organization ID. Falls back to the OPENAI_ORG_ID environment variable.
+            openai_api_key (str, optional): OpenAI admin API key. Falls back to the OPENAI_API_KEY environment variable.
+            session (aiohttp.ClientSession, optional): Session used for all requests, see `aio.create_session`.
+
+        Raises:
+            ValueError: If neither the parameters nor the corresponding environment variables are set.
+        """
+        super().__init__(session)
+        if openai_org_id is None:
+            openai_org_id = os.getenv('OPENAI_ORG_ID')
+        if not openai_org_id:
+            raise ValueError('OPENAI_ORG_ID not set')
+
+        if openai_api_key is None:
+            openai_api_key = os.getenv('OPENAI_API_KEY')
+        if not openai_api_key:
+            raise ValueError('OPENAI_API_KEY not set')
+
+        self.base_url = 'https://api.openai.com/v1'
+        self.headers = {'Authorization': f'Bearer {openai_api_key}', 'OpenAI-Organization': openai_org_id}
+
+    def split_by_day(self, data):
+        return OpenAIAPI.split_by_day(self, data)
+
+    async def _get(self, path: str, params: dict, operation: str, scope: Optional[str] = None):
+        labels = {'provider': self.name, 'scope': scope, 'operation': operation}
+        session = await self._get_session()
+        # aiohttp doesn't expand lists, repeat the key for every value like requests does
+        query = [(key, value) for key, values in params.items() for value in (values if isinstance(values, list) else [values])]
+        response = await aio.request(session, 'GET', f'{self.base_url}{path}', limiter=ratelimit.get_limiter(self.name),
+                                     labels=labels, headers=self.headers, params=query)
+        await aio.raise_for_status(response)
+        return await response.json()
+
+    async def get_projects(self, include_archived: bool = True):
+        """
+        Same as `OpenAIAPI.get_projects`.
+        """
+        project_ids = []
+        params = {'limit': 100, 'include_archived': str(include_archived).lower()}
+        while True:
+            result = await self._get('/organization/projects', params, 'projects')
+            project_ids += [project['id'] for project in result['data']]
+            if not result.get('has_more'):
+                return project_ids
+            params = dict(params, after=result['last_id'])
+
+    async def get_cost(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                       group_by: Sequence[str] = ('project_id', 'line_item'), project_ids: Optional[Sequence[str]] = None,
+                       window_days: Optional[int] = None):
+        """
+        Same as `OpenAIAPI.get_cost`; all windows are fetched concurrently, paced by the rate limiter.
+        """
+        params = {'bucket_width': '1d', 'limit': MAX_COST_BUCKETS}
+        if group_by:
+            params['group_by'] = list(group_by)
+        windows = _windows(start_date, end_date, window_days or DEFAULT_WINDOW_DAYS['1d'], project_ids)
+        return await self._fetch_windows('/organization/costs', params, windows, _cost_rows, 'costs')
+
+    async def get_usage(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], kind: str = 'completions',
+                        bucket_width: str = '1d', group_by: Sequence[str] = ('project_id', 'model'), project_ids: Optional[Sequence[str]] = None,
+                        window_days: Optional[int] = None):
+        """
+        Same as `OpenAIAPI.get_usage`; all windows are fetched concurrently, paced by the rate limiter.
+        """
+        if kind not in USAGE_KINDS:
+            raise ValueError(f"Unknown usage kind {kind!r}, expected one of {', '.join(USAGE_KINDS)}")
+        if bucket_width not in MAX_BUCKETS:
+            raise ValueError(f"Unknown bucket width {bucket_width!r}, expected one of {', '.join(MAX_BUCKETS)}")
+        params = {'bucket_width': bucket_width, 'limit': MAX_BUCKETS[bucket_width]}
+        if group_by:
+            params['group_by'] = list(group_by)
+        windows = _windows(start_date, end_date, window_days or DEFAULT_WINDOW_DAYS[bucket_width], project_ids)
+        return await self._fetch_windows(f'/organization/usage/{kind}', params, windows, _usage_rows, kind)
+
+    async def _fetch_windows(self, path: str, params: dict, windows: list, convert, operation: str):
+        async def fetch_window(window):
+            start_time, end_time, project_id = window
+            window_params = dict(params, start_time=start_time, end_time=end_time)
+            if project_id is not None:
+                window_params['project_ids'] = [project_id]
+            rows = []
+            while True:
+                page = await self._get(path, window_params, operation, scope=project_id)
+                rows += _page_rows(page, convert, self.name, operation, project_id)
+                if not page.get('has_more') or not page.get('next_page'):
+                    return rows
+                window_params = dict(window_params, page=page['next_page'])
+
+        window_rows = await asyncio.gather(*(fetch_window(window) for window in windows))
+        return _merge_windows(window_rows, windows)
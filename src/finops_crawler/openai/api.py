@@ -1,11 +1,31 @@
+import concurrent.futures
+import json
 import requests
 import datetime
 import os
-from typing import Optional, Union
+from typing import Optional, Sequence, Union
 from finops_crawler.base import CloudAPI
+from finops_crawler.session import get_shared_session
+from finops_crawler import ratelimit
+from finops_crawler import metrics
+from finops_crawler import columnar
+from finops_crawler.dates import split_range
+
+# the usage endpoints, /organization/usage/<kind>
+USAGE_KINDS = ('completions', 'embeddings', 'moderations', 'images', 'audio_speeches', 'audio_transcriptions',
+               'vector_stores', 'code_interpreter_sessions')
+
+# the most buckets a page can hold per bucket width; the costs endpoint only has daily buckets
+MAX_BUCKETS = {'1d': 31, '1h': 168, '1m': 1440}
+MAX_COST_BUCKETS = 180
+
+# length of the windows fetched concurrently, so that every window fits in a single page
+DEFAULT_WINDOW_DAYS = {'1d': 7, '1h': 7, '1m': 1}
 
 class OpenAIAPI(CloudAPI):
-    def __init__(self, openai_org_id: Optional[str] = None, openai_api_key: Optional[str] = None):
+    name = 'openai'
+
+    def __init__(self, openai_org_id: Optional[str] = None, openai_api_key: Optional[str] = None, session: Optional[requests.Session] = None):
         """
             Initialize OpenAIApi instance with OpenAI organization ID and API key.
 
@@ -13,13 +33,15 @@ class OpenAIAPI(CloudAPI):
 
             Args:
                 openai_org_id (str, optional): OpenAI organization ID. If not provided, the function attempts to get the value from an environment variable named 'OPENAI_ORG_ID'.
-                openai_api_key (str, optional): OpenAI API key. If not provided, the function attempts to get the value from an environment variable named 'OPENAI_API_KEY'.
+                openai_api_key (str, optional): OpenAI admin API key. If not provided, the function attempts to get the value from an environment variable named 'OPENAI_API_KEY'.
+                    The usage and costs endpoints only accept admin keys, not project keys.
+                session (requests.Session, optional): HTTP session used for all requests. Defaults to the process-wide pooled session, see `finops_crawler.session`.
 
             Raises:
                 ValueError: If neither the parameters nor the corresponding environment variables are set.
             
             Note:
-                API documentation: https://platform.openai.com/docs/api-reference/authentication
+                API documentation: https://platform.openai.com/docs/api-reference/usage
         """
         if openai_org_id is None:
             openai_org_id = os.getenv('OPENAI_ORG_ID')
@@ -31,35 +53,213 @@ class OpenAIAPI(CloudAPI):
         if not openai_api_key:
             raise ValueError('OPENAI_API_KEY not set')
 
+        self.session = session if session is not None else get_shared_session()
         self.base_url = 'https://api.openai.com/v1'
         self.headers = {'Authorization': f'Bearer {openai_api_key}', 'OpenAI-Organization': openai_org_id}
 
 
-    def get_cost(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime]):
+    def split_by_day(self, data):
+        days = {}
+        for item in data or []:
+            days.setdefault(item['date'], []).append(item)
+        return days
+
+    def _get(self, path: str, params: dict, operation: str, scope: Optional[str] = None):
+        # all organization endpoints share the organization's limiter, the API throttles per organization
+        labels = {'provider': self.name, 'scope': scope, 'operation': operation}
+        response = ratelimit.request(self.session, 'GET', f'{self.base_url}{path}', limiter=ratelimit.get_limiter(self.name),
+                                     labels=labels, headers=self.headers, params=params)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            print(f"API returned error {response.status_code}: {response.reason}. Message: {_error_message(response.text)}")
+            raise
+        return response.json()
+
+    def get_projects(self, include_archived: bool = True):
+        """
+        Returns the IDs of the projects of the organization.
+
+        Args:
+            include_archived (bool, optional): Also return archived projects, which may still have costs in the past.
+        """
+        project_ids = []
+        params = {'limit': 100, 'include_archived': str(include_archived).lower()}
+        while True:
+            result = self._get('/organization/projects', params, 'projects')
+            project_ids += [project['id'] for project in result['data']]
+            if not result.get('has_more'):
+                return project_ids
+            params = dict(params, after=result['last_id'])
+
+    def get_cost(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime],
+                 group_by: Sequence[str] = ('project_id', 'line_item'), project_ids: Optional[Sequence[str]] = None,
+                 max_workers: int = 4, window_days: Optional[int] = None):
+        """
+        Retrieves the daily costs of the organization from the organization costs endpoint.
+
+        The range is split into windows of `window_days` that are fetched concurrently (and per
+        project, if `project_ids` are given), each following its own cursor pagination. All
+        requests go through the OpenAI rate limiter.
+
+        Args:
+            start_date (datetime.datetime): First day of the range.
+            end_date (datetime.datetime): End of the range, excluded.
+            group_by (list, optional): 'project_id' and/or 'line_item'. Without any, one total per day is returned.
+            project_ids (list, optional): Only return the costs of these projects, every project
+                fetched with requests of its own. See `get_projects`.
+            max_workers (int, optional): Number of windows fetched concurrently.
+            window_days (int, optional): Length of the windows. Defaults to a week.
+
+        Returns:
+            list: A list of dicts with the fields date ('YYYY-MM-DD'), project_id, line_item, cost (float)
+            and currency, in date order.
+
+        Raises:
+            requests.HTTPError: If a request fails, e.g. with a key that isn't an admin key.
+        """
+        params = {'bucket_width': '1d', 'limit': MAX_COST_BUCKETS}
+        if group_by:
+            params['group_by'] = list(group_by)
+        windows = _windows(start_date, end_date, window_days or DEFAULT_WINDOW_DAYS['1d'], project_ids)
+        return self._fetch_windows('/organization/costs', params, windows, _cost_rows, 'costs', max_workers)
+
+    def get_usage(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], kind: str = 'completions',
+                  bucket_width: str = '1d', group_by: Sequence[str] = ('project_id', 'model'), project_ids: Optional[Sequence[str]] = None,
+                  max_workers: int = 4, window_days: Optional[int] = None):
+        """
+        Retrieves the usage of the organization (tokens, requests, images, ...) from an organization usage endpoint.
+
+        Fetched like `get_cost`, in concurrent windows with cursor pagination.
+
+        Args:
+            start_date (datetime.datetime): First day of the range.
+            end_date (datetime.datetime): End of the range, excluded.
+            kind (str, optional): One of `USAGE_KINDS`.
+            bucket_width (str, optional): '1d', '1h' or '1m'.
+            group_by (list, optional): Fields to group by, e.g. 'project_id', 'model', 'api_key_id',
+                'user_id' or 'batch'. Which ones are supported depends on the `kind`.
+            project_ids (list, optional): Only return the usage of these projects, every project
+                fetched with requests of its own.
+            max_workers (int, optional): Number of windows fetched concurrently.
+            window_days (int, optional): Length of the windows. Defaults to what fits in one page:
+                a week of daily or hourly buckets, a day of minute buckets.
+
+        Returns:
+            list: A list of dicts with the fields date ('YYYY-MM-DD'), start_time ('YYYY-MM-DDTHH:MM:SSZ'),
+            the group-by fields and the usage fields of the `kind`, e.g. input_tokens, output_tokens and
+            num_model_requests for completions, in time order.
+
+        Raises:
+            ValueError: If the kind or bucket width is unknown.
+            requests.HTTPError: If a request fails.
+        """
+        if kind not in USAGE_KINDS:
+            raise ValueError(f"Unknown usage kind {kind!r}, expected one of {', '.join(USAGE_KINDS)}")
+        if bucket_width not in MAX_BUCKETS:
+            raise ValueError(f"Unknown bucket width {bucket_width!r}, expected one of {', '.join(MAX_BUCKETS)}")
+        params = {'bucket_width': bucket_width, 'limit': MAX_BUCKETS[bucket_width]}
+        if group_by:
+            params['group_by'] = list(group_by)
+        windows = _windows(start_date, end_date, window_days or DEFAULT_WINDOW_DAYS[bucket_width], project_ids)
+        return self._fetch_windows(f'/organization/usage/{kind}', params, windows, _usage_rows, kind, max_workers)
+
+    def get_cost_table(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], **kwargs):
+        """
+        Same as `get_cost`, but as a `pyarrow.Table` with a date32 `date` column.
+        Requires pyarrow (`pip install finops_crawler[arrow]`).
+        """
+        return columnar.rows_to_arrow(self.get_cost(start_date, end_date, **kwargs), dates=('date',))
+
+    def get_usage_table(self, start_date: Union[str, datetime.datetime], end_date: Union[str, datetime.datetime], **kwargs):
         """
-        no longer works. Using it outside of a browser session has been disabled by OpenAI
+        Same as `get_usage`, but as a `pyarrow.Table` with a date32 `date` and a timestamp `start_time` column.
+        Requires pyarrow (`pip install finops_crawler[arrow]`).
         """
-        if isinstance(start_date, str):
-            start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d')
-        if isinstance(end_date, str):
-            end_date = datetime.datetime.strptime(end_date, '%Y-%m-%d')
+        return columnar.rows_to_arrow(self.get_usage(start_date, end_date, **kwargs), dates=('date',), timestamps=('start_time',))
+
+    def _fetch_windows(self, path: str, params: dict, windows: list, convert, operation: str, max_workers: int):
+        def fetch_window(window):
+            start_time, end_time, project_id = window
+            window_params = dict(params, start_time=start_time, end_time=end_time)
+            if project_id is not None:
+                window_params['project_ids'] = [project_id]
+            rows = []
+            while True:
+                page = self._get(path, window_params, operation, scope=project_id)
+                rows += _page_rows(page, convert, self.name, operation, project_id)
+                if not page.get('has_more') or not page.get('next_page'):
+                    return rows
+                window_params = dict(window_params, page=page['next_page'])
+
+        if max_workers <= 1 or len(windows) <= 1:
+            window_rows = [fetch_window(window) for window in windows]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(windows))) as executor:
+                window_rows = list(executor.map(fetch_window, windows))
+        return _merge_windows(window_rows, windows)
+
+
+def _windows(start_date, end_date, days: int, project_ids: Optional[Sequence[str]] = None):
+    # (start_time, end_time, project_id) of every request, window by window; times in Unix seconds as the API wants them
+    windows = []
+    for window_start, window_end in split_range(start_date, end_date, days=days):
+        start_time, end_time = _timestamp(window_start), _timestamp(window_end)
+        for project_id in project_ids or [None]:
+            windows.append((start_time, end_time, project_id))
+    return windows
+
+
+def _timestamp(date: datetime.date):
+    # buckets start at midnight UTC
+    return int(datetime.datetime(date.year, date.month, date.day, tzinfo=datetime.timezone.utc).timestamp())
+
+
+def _bucket_start(bucket: dict):
+    start = datetime.datetime.fromtimestamp(bucket['start_time'], datetime.timezone.utc)
+    return start.strftime('%Y-%m-%d'), start.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _cost_rows(bucket: dict):
+    # the date is converted once per bucket, not per result
+    date, _ = _bucket_start(bucket)
+    return [{
+        'date': date,
+        'project_id': result.get('project_id'),
+        'line_item': result.get('line_item'),
+        'cost': float(result['amount']['value']),
+        'currency': result['amount'].get('currency'),
+    } for result in bucket['results']]
+
 
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        end_date_str = end_date.strftime('%Y-%m-%d')
-        results_by_time = []
+def _usage_rows(bucket: dict):
+    date, start_time = _bucket_start(bucket)
+    rows = []
+    for result in bucket['results']:
+        row = {'date': date, 'start_time': start_time}
+        row.update(result)
+        row.pop('object', None)
+        rows.append(row)
+    return rows
 
-        url = f'{self.base_url}/dashboard/billing/usage?start_date={start_date_str}&end_date={end_date_str}'
 
-        response = requests.get(url, headers=self.headers)
+def _page_rows(page: dict, convert, provider: str, operation: str, scope: Optional[str]):
+    rows = [row for bucket in page['data'] for row in convert(bucket)]
+    metrics.inc('pages', provider=provider, scope=scope, operation=operation)
+    metrics.inc('rows', len(rows), provider=provider, scope=scope, operation=operation)
+    return rows
 
-        if response.status_code != 200:
-            print(response.reason)
-            raise Exception(f'GET /billing/usage failed with status code {response.status_code}.')
 
-        results_by_time = response.json()['daily_costs']
+def _merge_windows(window_rows: list, windows: list):
+    rows = [row for rows in window_rows for row in rows]
+    if any(project_id is not None for _, _, project_id in windows):
+        # the projects of a window are fetched separately, interleave them back into time order (the sort is stable)
+        rows.sort(key=lambda row: row.get('start_time') or row['date'])
+    return rows
 
-        for item in results_by_time:
-            item_date = datetime.datetime.fromtimestamp(item["timestamp"]).strftime('%Y-%m-%d')
-            item["date"] = item_date
 
-        return results_by_time
+def _error_message(text: str):
+    try:
+        return json.loads(text)['error']['message']
+    except Exception:
+        return text
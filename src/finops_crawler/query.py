@@ -0,0 +1,207 @@
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
+
+# generic dimension name -> (AWS Cost Explorer dimension, Azure Cost Management dimension); None if the platform has no such dimension.
+# Names that aren't listed here are passed to the API as they are, e.g. 'INSTANCE_TYPE' or 'MeterCategory'.
+DIMENSIONS: Dict[str, Tuple[Optional[str], Optional[str]]] = {
+    'service': ('SERVICE', 'ServiceName'),
+    'usage_type': ('USAGE_TYPE', 'Meter'),
+    'account': ('LINKED_ACCOUNT', 'SubscriptionId'),
+    'region': ('REGION', 'ResourceLocation'),
+    'charge_type': ('RECORD_TYPE', 'ChargeType'),
+    'resource': (None, 'ResourceId'),
+    'resource_group': (None, 'ResourceGroupName'),
+    'resource_type': (None, 'ResourceType'),
+    'pricing_model': ('PURCHASE_TYPE', 'PricingModel'),
+}
+
+# generic metric name -> (AWS metric, (Azure cost type, Azure column)); Azure's cost type applies to the whole query
+METRICS: Dict[str, Tuple[str, Tuple[Optional[str], str]]] = {
+    'cost': ('UnblendedCost', ('ActualCost', 'Cost')),
+    'amortized_cost': ('AmortizedCost', ('AmortizedCost', 'Cost')),
+    'usage': ('UsageQuantity', (None, 'UsageQuantity')),
+}
+
+# generic granularity -> (AWS, Azure); None if the platform doesn't support it
+GRANULARITIES: Dict[str, Tuple[Optional[str], Optional[str]]] = {
+    'hourly': ('HOURLY', None),
+    'daily': ('DAILY', 'Daily'),
+    'monthly': ('MONTHLY', 'Monthly'),
+    # a single total for the whole range
+    'total': (None, 'None'),
+}
+
+# both Cost Explorer and Cost Management accept at most two group-by expressions
+MAX_GROUP_BY = 2
+
+TAG_PREFIX = 'tag:'
+
+
+class CostQuery:
+    """
+    What to aggregate and filter on the server side, instead of downloading the most granular
+    data and aggregating it afterwards.
+
+    The same query can be run against AWS (`AWSAPI.get_cost(..., query=...)`) and Azure
+    (`AzureAPI.get_cost(..., query=...)`). Dimensions, metrics and granularities are given by
+    their generic names (see `DIMENSIONS`, `METRICS` and `GRANULARITIES`) or by the name the
+    platform uses. Tags are given as 'tag:<key>'.
+
+    Example:
+        # monthly totals per service, a few hundred rows instead of one per resource and day
+        query = CostQuery(granularity='monthly', group_by=['service'], filters={'tag:env': ['prod']})
+        aws_costs_client.get_cost('2023-01-01', '2024-01-01', query=query)
+    """
+
+    def __init__(self, granularity: str = 'daily', metrics: Sequence[str] = ('cost',), group_by: Sequence[str] = (),
+                 filters: Optional[Dict[str, Union[str, Iterable[str]]]] = None):
+        """
+        Args:
+            granularity (str, optional): 'hourly' (AWS only), 'daily', 'monthly' or 'total' (Azure only).
+            metrics (list, optional): 'cost', 'amortized_cost', 'usage' or the names the platform uses,
+                e.g. 'NetUnblendedCost' for AWS or 'PreTaxCost' for Azure.
+            group_by (list, optional): At most two dimensions or 'tag:<key>' to group by. Without any,
+                one total per period is returned.
+            filters (dict, optional): Dimension or 'tag:<key>' -> value or list of values to include.
+                Several filters must all match.
+
+        Raises:
+            ValueError: If the query can't be expressed by any platform.
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity {granularity!r}, expected one of {', '.join(GRANULARITIES)}")
+        if not metrics:
+            raise ValueError("A query needs at least one metric")
+        if len(group_by) > MAX_GROUP_BY:
+            raise ValueError(f"At most {MAX_GROUP_BY} group-by dimensions are supported, got {len(group_by)}")
+        self.granularity = granularity
+        self.metrics = list(metrics)
+        self.group_by = list(group_by)
+        self.filters = {name: [values] if isinstance(values, str) else list(values) for name, values in (filters or {}).items()}
+
+    def __repr__(self):
+        return (f"CostQuery(granularity={self.granularity!r}, metrics={self.metrics!r}, group_by={self.group_by!r}, "
+                f"filters={self.filters!r})")
+
+    @staticmethod
+    def _dimension(name: str, provider: int):
+        if name not in DIMENSIONS:
+            return name
+        dimension = DIMENSIONS[name][provider]
+        if dimension is None:
+            raise ValueError(f"{('AWS', 'Azure')[provider]} can't group or filter by {name!r}")
+        return dimension
+
+    @staticmethod
+    def _granularity(granularity: str, provider: int):
+        value = GRANULARITIES[granularity][provider]
+        if value is None:
+            raise ValueError(f"{('AWS', 'Azure')[provider]} doesn't support {granularity!r} granularity")
+        return value
+
+    def aws_request(self, start_date: str, end_date: str, account_id: Optional[str] = None):
+        """
+        Returns the keyword arguments of a Cost Explorer GetCostAndUsage request.
+
+        Args:
+            start_date (str): First day, 'YYYY-MM-DD'.
+            end_date (str): End of the range, excluded, 'YYYY-MM-DD'.
+            account_id (str, optional): Only include this linked account.
+        """
+        request = {
+            'TimePeriod': {
+                'Start': start_date,
+                'End': end_date
+            },
+            'Granularity': self._granularity(self.granularity, 0),
+            'Metrics': [METRICS[metric][0] if metric in METRICS else metric for metric in self.metrics],
+        }
+        if self.group_by:
+            request['GroupBy'] = self.aws_group_by
+
+        expressions = [
+            {'Tags': {'Key': name[len(TAG_PREFIX):], 'Values': values}} if name.startswith(TAG_PREFIX)
+            else {'Dimensions': {'Key': self._dimension(name, 0), 'Values': values}}
+            for name, values in self.filters.items()
+        ]
+        if account_id:
+            expressions.append({'Dimensions': {'Key': 'LINKED_ACCOUNT', 'Values': [account_id]}})
+        if len(expressions) == 1:
+            request['Filter'] = expressions[0]
+        elif expressions:
+            request['Filter'] = {'And': expressions}
+        return request
+
+    def azure_body(self, start_date: str, end_date: str):
+        """
+        Returns the body of a Cost Management query request.
+
+        Args:
+            start_date (str): Start of the range, 'YYYY-MM-DDTHH:MM:SSZ'.
+            end_date (str): End of the range, included, 'YYYY-MM-DDTHH:MM:SSZ'.
+
+        Raises:
+            ValueError: If the metrics mix actual and amortized costs, which Azure can't return in one query.
+        """
+        cost_types = {METRICS[metric][1][0] for metric in self.metrics if metric in METRICS} - {None}
+        if len(cost_types) > 1:
+            raise ValueError("Azure returns either actual or amortized costs in one query, not both")
+        aggregation = {}
+        for column in self.azure_metric_columns:
+            # the first cost column keeps the alias the crawler always used
+            alias = 'totalCost' if not aggregation else f'total{column}'
+            aggregation[alias] = {'name': column, 'function': 'Sum'}
+
+        dataset = {}
+        granularity = self._granularity(self.granularity, 1)
+        if granularity != 'None':
+            dataset['granularity'] = granularity
+        dataset['aggregation'] = aggregation
+        if self.group_by:
+            dataset['grouping'] = [
+                {'type': 'TagKey', 'name': name[len(TAG_PREFIX):]} if name.startswith(TAG_PREFIX)
+                else {'type': 'Dimension', 'name': self._dimension(name, 1)}
+                for name in self.group_by
+            ]
+
+        expressions = [
+            {'tags': {'name': name[len(TAG_PREFIX):], 'operator': 'In', 'values': values}} if name.startswith(TAG_PREFIX)
+            else {'dimensions': {'name': self._dimension(name, 1), 'operator': 'In', 'values': values}}
+            for name, values in self.filters.items()
+        ]
+        if len(expressions) == 1:
+            dataset['filter'] = expressions[0]
+        elif expressions:
+            dataset['filter'] = {'and': expressions}
+
+        return {
+            'type': cost_types.pop() if cost_types else 'ActualCost',
+            'timeframe': 'Custom',
+            'timePeriod': {
+                'from': start_date,
+                'to': end_date
+            },
+            'dataset': dataset,
+        }
+
+    @property
+    def aws_group_by(self):
+        """
+        The GroupBy of the Cost Explorer request; the `Keys` of every group are in this order.
+        """
+        return [
+            {'Type': 'TAG', 'Key': name[len(TAG_PREFIX):]} if name.startswith(TAG_PREFIX)
+            else {'Type': 'DIMENSION', 'Key': self._dimension(name, 0)}
+            for name in self.group_by
+        ]
+
+    @property
+    def azure_metric_columns(self):
+        """
+        Names of the columns Azure returns the metrics in.
+        """
+        columns = []
+        for metric in self.metrics:
+            column = METRICS[metric][1][1] if metric in METRICS else metric
+            if column not in columns:
+                columns.append(column)
+        return columns
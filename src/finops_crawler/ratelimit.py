@@ -0,0 +1,342 @@
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from finops_crawler import metrics
+
+# HTTP statuses that are retried: throttling and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# error codes boto3 uses for throttling, see https://docs.aws.amazon.com/general/latest/gr/api-retries.html
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'LimitExceededException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'SlowDown',
+}
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket whose rate adapts to throttling.
+
+    The rate is lowered multiplicatively on every throttled request and raised additively on
+    every successful one (AIMD), so concurrent workers settle at the highest rate the API
+    sustains instead of either hammering it or idling in fixed sleeps. The bucket can also
+    be paused until a given time when the API says when to come back (Retry-After).
+    """
+
+    def __init__(self, rate: float, capacity: float = 1, min_rate: Optional[float] = None, max_rate: Optional[float] = None):
+        """
+        Args:
+            rate (float): Initial number of requests per second.
+            capacity (float, optional): Number of requests that may be sent in a burst.
+            min_rate (float, optional): The rate never drops below this. Defaults to a tenth of `rate`.
+            max_rate (float, optional): The rate never grows above this. Defaults to `rate`, i.e. no growth.
+        """
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.max_rate = max_rate if max_rate is not None else rate
+        self._lock = threading.Lock()
+        # time at which the bucket would be empty again if nobody took tokens (GCRA "theoretical arrival time")
+        self._free_at = 0.0
+
+    def reserve(self):
+        """
+        Takes a token and returns how many seconds the caller has to wait before using it.
+
+        Doesn't sleep itself, so it can be used from both threads and event loops.
+        """
+        with self._lock:
+            now = time.monotonic()
+            interval = 1 / self.rate
+            burst = (self.capacity - 1) * interval
+            self._free_at = max(self._free_at, now)
+            wait = max(0.0, self._free_at - burst - now)
+            self._free_at += interval
+            return wait
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float):
+        """
+        Makes everybody wait at least `seconds` before the next request.
+        """
+        with self._lock:
+            burst = (self.capacity - 1) / self.rate
+            self._free_at = max(self._free_at, time.monotonic() + seconds + burst)
+
+    def on_throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    Args:
+        max_retries (int, optional): How many times a request is retried before giving up.
+        base_delay (float, optional): Upper bound of the first delay in seconds, doubled on every retry.
+        max_delay (float, optional): Upper bound of any single delay in seconds.
+    """
+
+    def __init__(self, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+# (requests per second, burst, maximum requests per second the rate may grow to) per provider
+DEFAULT_LIMITS: Dict[str, Tuple[float, float, float]] = {
+    'azure': (1.0, 4, 5.0),
+    'aws': (2.0, 2, 5.0),
+    'openai': (5.0, 10, 20.0),
+}
+
+_limiters: Dict[Tuple[str, Optional[str]], TokenBucket] = {}
+_limits: Dict[Tuple[str, Optional[str]], Tuple[float, float, float]] = {}
+_limiters_lock = threading.Lock()
+
+
+def configure(provider: str, rate: float, capacity: float = 1, max_rate: Optional[float] = None, scope: Optional[str] = None):
+    """
+    Sets the rate budget of a provider, or of a single scope of it.
+
+    Limiters that were already handed out for the provider (or scope) are replaced.
+
+    Args:
+        provider (str): Provider name, e.g. 'azure'.
+        rate (float): Initial requests per second.
+        capacity (float, optional): Burst size.
+        max_rate (float, optional): Maximum requests per second the adaptive rate may grow to. Defaults to `rate`.
+        scope (str, optional): Only configure this scope. Without it, the budget applies to every scope of the provider.
+    """
+    with _limiters_lock:
+        _limits[(provider, scope)] = (rate, capacity, max_rate if max_rate is not None else rate)
+        for key in list(_limiters):
+            if key[0] == provider and (scope is None or key[1] == scope):
+                del _limiters[key]
+
+
+def get_limiter(provider: str, scope: Optional[str] = None):
+    """
+    Returns the token bucket shared by all clients and threads for a (provider, scope) pair.
+
+    Scopes are throttled separately by most APIs (e.g. Azure Cost Management throttles per
+    subscription), so each gets its own bucket.
+    """
+    key = (provider, scope)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limits = _limits.get(key) or _limits.get((provider, None)) or DEFAULT_LIMITS.get(provider, (1.0, 1, 1.0))
+            rate, capacity, max_rate = limits
+            limiter = _limiters[key] = TokenBucket(rate, capacity, max_rate=max_rate)
+        return limiter
+
+
+def retry_after(headers):
+    """
+    Returns how many seconds the server asked us to wait, or None.
+
+    Understands the standard Retry-After header (in seconds or as an HTTP date) and the
+    Azure `x-ms-ratelimit-*-retry-after` headers. If several are present, the longest wait wins.
+    """
+    delays = []
+    for name, value in headers.items():
+        name = name.lower()
+        if name != 'retry-after' and not (name.startswith('x-ms-ratelimit-') and name.endswith('retry-after')):
+            continue
+        try:
+            delays.append(float(value))
+        except ValueError:
+            # HTTP dates are rare, email.utils is slow to import
+            import email.utils
+            try:
+                delays.append(email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                continue
+    if not delays:
+        return None
+    return max(0.0, max(delays))
+
+
+def quota_exhausted(headers):
+    """
+    Tells whether an Azure response says that the remaining request quota is used up.
+
+    Azure sends `x-ms-ratelimit-remaining-*` headers either as plain numbers or as
+    `name=value` pairs separated by semicolons (Cost Management QPU headers).
+    """
+    for name, value in headers.items():
+        name = name.lower()
+        if not (name.startswith('x-ms-ratelimit-remaining') or (name.startswith('x-ms-ratelimit-') and name.endswith('-remaining'))):
+            continue
+        for part in value.split(';'):
+            part = part.split('=')[-1].strip()
+            try:
+                if float(part) <= 0:
+                    return True
+            except ValueError:
+                continue
+    return False
+
+
+def request(session: 'requests.Session', method: str, url: str, limiter: Optional[TokenBucket] = None,
+            retry_policy: Optional[RetryPolicy] = None, labels: Optional[dict] = None, **kwargs):
+    """
+    Sends an HTTP request, pacing it with `limiter` and retrying throttled and failed attempts.
+
+    429 and 5xx responses are retried after the delay the server asked for, or after an
+    exponential backoff with jitter if it didn't say. Connection errors and timeouts are retried
+    the same way. Once the retries are used up, the last response is returned so the caller
+    can report the error as usual.
+
+    Args:
+        session (requests.Session): Session to send the request with.
+        method (str): HTTP method.
+        url (str): URL.
+        limiter (TokenBucket, optional): Rate limiter to take a token from before every attempt.
+        retry_policy (RetryPolicy, optional): Defaults to `DEFAULT_RETRY_POLICY`.
+        labels (dict, optional): Labels of the recorded metrics, e.g. provider, scope and operation.
+            See `finops_crawler.metrics`.
+        **kwargs: Passed on to `session.request`.
+
+    Returns:
+        requests.Response: The response of the last attempt.
+    """
+    # imported here so that modules using only `call` (AWS) don't load requests
+    import requests
+
+    retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+    labels = labels or {}
+    operation_labels = {label: value for label, value in labels.items() if label != 'operation'}
+    attempt = 0
+    while True:
+        if limiter is not None:
+            wait = limiter.acquire()
+            if wait > 0:
+                metrics.inc('sleep_seconds', wait, reason='rate_limit', **operation_labels)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            metrics.observe('request_seconds', time.perf_counter() - start, status='error', **labels)
+            if attempt >= retry_policy.max_retries:
+                raise
+            delay = retry_policy.backoff(attempt)
+            metrics.inc('retries', reason='connection', **labels)
+            metrics.inc('sleep_seconds', delay, reason='retry', **operation_labels)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        metrics.observe('request_seconds', time.perf_counter() - start, status=response.status_code, **labels)
+        if not kwargs.get('stream'):
+            metrics.inc('bytes', len(response.content), **labels)
+
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            if limiter is not None:
+                if quota_exhausted(response.headers):
+                    limiter.on_throttled()
+                else:
+                    limiter.on_success()
+            return response
+
+        if attempt >= retry_policy.max_retries:
+            return response
+        delay = retry_after(response.headers)
+        if delay is None:
+            delay = retry_policy.backoff(attempt)
+        metrics.inc('retries', reason=response.status_code, **labels)
+        response.close()
+        if limiter is not None and response.status_code == 429:
+            # everybody sharing the limiter backs off, not just this thread; the wait is recorded by the next acquire
+            limiter.on_throttled()
+            limiter.pause(delay)
+        else:
+            metrics.inc('sleep_seconds', delay, reason='retry', **operation_labels)
+            time.sleep(delay)
+        attempt += 1
+
+
+def call(function, *args, limiter: Optional[TokenBucket] = None, retry_policy: Optional[RetryPolicy] = None,
+         labels: Optional[dict] = None, connection_errors: tuple = (), **kwargs):
+    """
+    Calls a boto3 client method, pacing it with `limiter` and retrying throttling errors.
+
+    Server errors (5xx) and `connection_errors` are retried as well, but only throttling lowers
+    the rate of the limiter. The client itself should not retry (`total_max_attempts` 1), otherwise
+    its retries hide the throttling from the limiter.
+
+    Args:
+        function (callable): The bound client method, e.g. `client.get_cost_and_usage`.
+        limiter (TokenBucket, optional): Rate limiter to take a token from before every attempt.
+        retry_policy (RetryPolicy, optional): Defaults to `DEFAULT_RETRY_POLICY`.
+        labels (dict, optional): Labels of the recorded metrics, see `request`.
+        connection_errors (tuple, optional): Exception classes of failed connections, e.g. botocore's
+            `ConnectionError` and `HTTPClientError`.
+        *args, **kwargs: Passed on to `function`.
+
+    Raises:
+        botocore.exceptions.ClientError: If the error isn't retryable, or the retries are used up.
+    """
+    retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+    labels = labels or {}
+    operation_labels = {label: value for label, value in labels.items() if label != 'operation'}
+    attempt = 0
+    while True:
+        if limiter is not None:
+            wait = limiter.acquire()
+            if wait > 0:
+                metrics.inc('sleep_seconds', wait, reason='rate_limit', **operation_labels)
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            # botocore's ClientError carries the parsed error response, checking it here keeps botocore out of the imports
+            error_response = getattr(e, 'response', None)
+            error_code = error_response.get('Error', {}).get('Code') if isinstance(error_response, dict) else None
+            status_code = error_response.get('ResponseMetadata', {}).get('HTTPStatusCode') if isinstance(error_response, dict) else None
+            metrics.observe('request_seconds', time.perf_counter() - start, status=error_code or 'error', **labels)
+            throttled = error_code in THROTTLING_ERROR_CODES
+            retryable = throttled or isinstance(e, connection_errors) or (status_code or 0) >= 500
+            if not retryable or attempt >= retry_policy.max_retries:
+                raise
+            delay = retry_policy.backoff(attempt)
+            metrics.inc('retries', reason=error_code or 'connection', **labels)
+            if limiter is not None and throttled:
+                limiter.on_throttled()
+                limiter.pause(delay)
+            else:
+                metrics.inc('sleep_seconds', delay, reason='retry', **operation_labels)
+                time.sleep(delay)
+            attempt += 1
+            continue
+        metrics.observe('request_seconds', time.perf_counter() - start, status='ok', **labels)
+        if limiter is not None:
+            limiter.on_success()
+        return result
@@ -0,0 +1,388 @@
+# A common, provider independent format for cost data, modelled on the FinOps Open Cost and
+# Usage Specification (FOCUS). Records are kept column-wise as Python lists: the converters still
+# touch every value in Python (one list comprehension per column), but build no dict per row and
+# parse repeated dates and resource IDs once. pyarrow compute kernels don't pay off here, turning
+# their results back into lists costs more than they save (about 3.5x slower for Azure query pages).
+from typing import Dict, Iterable, List, Optional, Sequence
+
+# column -> the FOCUS column it corresponds to
+COLUMNS = {
+    'charge_date': 'ChargePeriodStart',
+    'provider': 'ProviderName',
+    'account_id': 'SubAccountId',
+    'service': 'ServiceName',
+    'resource_id': 'ResourceId',
+    'charge_type': 'ChargeCategory',
+    'usage_type': 'SkuId',
+    'cost': 'BilledCost',
+    'currency': 'BillingCurrency',
+}
+
+
+class CostRecords:
+    """
+    A batch of normalized cost records, stored as one list per column of `COLUMNS`.
+
+    `charge_date` is an ISO date string ('2023-10-01'), `cost` a float, everything else strings
+    or None. Batches from different providers can be concatenated.
+    """
+
+    def __init__(self, columns: Optional[Dict[str, List]] = None):
+        columns = columns or {}
+        length = len(next(iter(columns.values()))) if columns else 0
+        self.columns = {name: columns.get(name, [None] * length) for name in COLUMNS}
+
+    def __len__(self):
+        return len(self.columns['cost'])
+
+    def __repr__(self):
+        return f"CostRecords({len(self)} rows)"
+
+    def extend(self, other: 'CostRecords'):
+        for name in COLUMNS:
+            self.columns[name].extend(other.columns[name])
+        return self
+
+    @classmethod
+    def concat(cls, batches: Iterable['CostRecords']):
+        records = cls()
+        for batch in batches:
+            records.extend(batch)
+        return records
+
+    def take(self, indices: Sequence[int]):
+        """
+        Returns a new batch with the records at `indices`.
+        """
+        return CostRecords({name: [values[i] for i in indices] for name, values in self.columns.items()})
+
+    def rows(self):
+        """
+        Yields the records as tuples in `COLUMNS` order.
+        """
+        return zip(*(self.columns[name] for name in COLUMNS))
+
+    def to_dicts(self):
+        names = list(COLUMNS)
+        return [dict(zip(names, row)) for row in self.rows()]
+
+    def to_arrow(self, focus_names: bool = False):
+        """
+        Returns a `pyarrow.Table`, with `charge_date` as date32 and `cost` as float64. Requires pyarrow.
+
+        Args:
+            focus_names (bool, optional): Name the columns as in FOCUS (e.g. `BilledCost`).
+        """
+        from finops_crawler import columnar
+        pa = columnar._pyarrow()
+        arrays = []
+        for name in COLUMNS:
+            if name == 'charge_date':
+                arrays.append(pa.compute.cast(pa.array(self.columns[name], pa.string()), pa.date32()))
+            elif name == 'cost':
+                arrays.append(pa.array(self.columns[name], pa.float64()))
+            else:
+                arrays.append(pa.array(self.columns[name], pa.string()))
+        names = list(COLUMNS.values()) if focus_names else list(COLUMNS)
+        return pa.Table.from_arrays(arrays, names=names)
+
+
+# Cost Explorer group-by dimension -> the column its key goes to; keys of other dimensions and of tags are dropped
+AWS_GROUP_BY_COLUMNS = {
+    'SERVICE': 'service',
+    'USAGE_TYPE': 'usage_type',
+    'LINKED_ACCOUNT': 'account_id',
+    'RECORD_TYPE': 'charge_type',
+}
+
+
+def from_aws(results_by_time: Sequence[dict], account_id: Optional[str] = None, metric: str = 'UnblendedCost',
+             group_by: Sequence[str] = ('SERVICE', 'USAGE_TYPE')):
+    """
+    Converts the `ResultsByTime` of `AWSAPI.get_cost`.
+
+    Args:
+        results_by_time (list): As returned by `AWSAPI.get_cost`.
+        account_id (str, optional): The account the costs belong to, if known. Grouping by
+            LINKED_ACCOUNT overrides it per record.
+        metric (str, optional): The metric to use as the cost.
+        group_by (list, optional): The group-by keys of the request, in request order, e.g.
+            `[group['Key'] for group in query.aws_group_by]`. See `AWS_GROUP_BY_COLUMNS` for
+            the ones that are kept.
+    """
+    targets = [AWS_GROUP_BY_COLUMNS.get(key) for key in group_by]
+    dates, amounts, units = [], [], []
+    keys = {target: [] for target in targets if target}
+    for result in results_by_time:
+        groups = result.get('Groups') or [{'Keys': [None] * len(targets), 'Metrics': result.get('Total', {})}]
+        date = result['TimePeriod']['Start'][:10]
+        for group in groups:
+            value = group['Metrics'].get(metric)
+            if value is None:
+                continue
+            dates.append(date)
+            for target, key in zip(targets, group['Keys']):
+                if target:
+                    keys[target].append(key)
+            amounts.append(value['Amount'])
+            units.append(value['Unit'])
+    length = len(dates)
+    if 'account_id' in keys:
+        # the totals of periods without groups have no key
+        keys['account_id'] = [account_id if key is None else key for key in keys['account_id']]
+    return CostRecords(dict({
+        'charge_date': dates,
+        'provider': ['aws'] * length,
+        'account_id': [account_id] * length,
+        'cost': list(map(float, amounts)),
+        'currency': units,
+    }, **keys))
+
+
+# the date column of an Azure query result, by granularity; a query with 'total' granularity has none
+AZURE_QUERY_DATE_COLUMNS = ('UsageDate', 'BillingMonth')
+
+
+def from_azure_query(rows: Sequence[dict], subscription_id: Optional[str] = None):
+    """
+    Converts the rows of `AzureAPI.get_cost` (dicts with UsageDate, ResourceId, ChargeType, Cost and Currency).
+
+    The service is the resource provider namespace of the resource ID, e.g. `Microsoft.Compute`.
+    Monthly rows (BillingMonth instead of UsageDate) are dated the first day of their month.
+
+    Raises:
+        ValueError: If the rows have no date column, e.g. a query with 'total' granularity.
+    """
+    if not rows:
+        return CostRecords()
+    date_column = azure_query_date_column(rows[0])
+    resource_ids = [row.get('ResourceId') for row in rows]
+    return CostRecords({
+        'charge_date': azure_query_dates([row[date_column] for row in rows], date_column),
+        'provider': ['azure'] * len(rows),
+        'account_id': [subscription_id] * len(rows),
+        'service': _azure_services(resource_ids),
+        'resource_id': resource_ids,
+        'charge_type': [row.get('ChargeType') for row in rows],
+        'cost': [float(row['Cost']) for row in rows],
+        'currency': [row.get('Currency') for row in rows],
+    })
+
+
+def from_azure_query_pages(pages: Iterable[dict], subscription_id: Optional[str] = None):
+    """
+    Converts pages of the Azure query API directly from their positional rows, without building
+    a dict per row, e.g. `AzureAPI._iter_query_pages()`.
+
+    Raises:
+        ValueError: If the pages have no date column, see `from_azure_query`.
+    """
+    batches = []
+    for page in pages:
+        index = {column['name']: i for i, column in enumerate(page['columns'])}
+        date_column = azure_query_date_column(index)
+        rows = page['rows']
+
+        def column(name):
+            i = index.get(name)
+            return [row[i] for row in rows] if i is not None else [None] * len(rows)
+
+        resource_ids = column('ResourceId')
+        batches.append(CostRecords({
+            'charge_date': azure_query_dates(column(date_column), date_column),
+            'provider': ['azure'] * len(rows),
+            'account_id': [subscription_id] * len(rows),
+            'service': _azure_services(resource_ids),
+            'resource_id': resource_ids,
+            'charge_type': column('ChargeType'),
+            'cost': list(map(float, column('Cost'))),
+            'currency': column('Currency'),
+        }))
+    return CostRecords.concat(batches)
+
+
+# cost details CSV columns, lower case; the names differ between agreement types
+_AZURE_DETAILED_FIELDS = {
+    'charge_date': ('date', 'usagedatetime'),
+    'account_id': ('subscriptionid',),
+    'service': ('metercategory', 'servicefamily'),
+    'resource_id': ('resourceid', 'instanceid'),
+    'charge_type': ('chargetype',),
+    'usage_type': ('metersubcategory', 'metername'),
+    'cost': ('costinbillingcurrency', 'cost', 'pretaxcost'),
+    'currency': ('billingcurrencycode', 'billingcurrency', 'currency'),
+}
+
+
+def from_azure_detailed(rows: Sequence[dict], subscription_id: Optional[str] = None):
+    """
+    Converts rows of the Azure cost details CSV, e.g. a batch of `AzureAPI.iter_cost_detailed(batch_size=...)`.
+
+    The column names are looked up once per batch, case-insensitively, so both the EA and the
+    MCA variants of the report work. Dates may be MM/DD/YYYY or ISO.
+
+    Args:
+        rows (list): Rows of the CSV.
+        subscription_id (str, optional): The subscription the report was generated for. If given,
+            it is the `account_id` of every record instead of the SubscriptionId column, so the
+            records land in the partitions of the crawled scope.
+    """
+    if not rows:
+        return CostRecords()
+    names = {name.lower(): name for name in rows[0]}
+    columns = {}
+    for target, candidates in _AZURE_DETAILED_FIELDS.items():
+        source = next((names[candidate] for candidate in candidates if candidate in names), None)
+        columns[target] = [row[source] for row in rows] if source else [None] * len(rows)
+    columns['charge_date'] = _convert_cached(columns['charge_date'], _azure_csv_date)
+    columns['cost'] = [float(value) if value else 0.0 for value in columns['cost']]
+    columns['provider'] = ['azure'] * len(rows)
+    if subscription_id is not None:
+        columns['account_id'] = [subscription_id] * len(rows)
+    return CostRecords(columns)
+
+
+# projection of the cost details CSV for `azure.csvparse.BlobParser`, what `from_azure_detailed_columns` needs
+AZURE_DETAILED_COLUMNS = {
+    ('Date', 'UsageDateTime'): 'category',
+    'SubscriptionId': 'category',
+    ('MeterCategory', 'ServiceFamily'): 'category',
+    ('ResourceId', 'InstanceId'): 'category',
+    'ChargeType': 'category',
+    ('MeterSubCategory', 'MeterName'): 'category',
+    ('CostInBillingCurrency', 'Cost', 'PreTaxCost'): 'float',
+    ('BillingCurrencyCode', 'BillingCurrency', 'Currency'): 'category',
+}
+
+
+def from_azure_detailed_columns(columns: Dict[str, List], subscription_id: Optional[str] = None):
+    """
+    Converts a batch of `AzureAPI.iter_cost_detailed_columns(columns=AZURE_DETAILED_COLUMNS)`.
+
+    Args:
+        columns (dict): Column name -> list of values.
+        subscription_id (str, optional): Use this as the `account_id`, see `from_azure_detailed`.
+    """
+    length = len(columns['CostInBillingCurrency'])
+    return CostRecords({
+        'charge_date': _convert_cached(columns['Date'], _azure_csv_date),
+        'provider': ['azure'] * length,
+        'account_id': columns['SubscriptionId'] if subscription_id is None else [subscription_id] * length,
+        'service': columns['MeterCategory'],
+        'resource_id': columns['ResourceId'],
+        'charge_type': columns['ChargeType'],
+        'usage_type': columns['MeterSubCategory'],
+        'cost': [0.0 if value is None else value for value in columns['CostInBillingCurrency']],
+        'currency': columns['BillingCurrencyCode'],
+    })
+
+
+def from_openai(rows: Sequence[dict]):
+    """
+    Converts the rows of `OpenAIAPI.get_cost` (dicts with date, project_id, line_item, cost and currency),
+    one record per project and line item.
+    """
+    length = len(rows)
+    return CostRecords({
+        'charge_date': [row['date'] for row in rows],
+        'provider': ['openai'] * length,
+        'account_id': [row.get('project_id') for row in rows],
+        'service': [row.get('line_item') for row in rows],
+        'cost': [row['cost'] for row in rows],
+        'currency': [(row.get('currency') or 'usd').upper() for row in rows],
+    })
+
+
+def normalize(provider: str, data, scope: Optional[str] = None):
+    """
+    Converts the result of any client's `get_cost` (or `get_cost_detailed`) into `CostRecords`.
+
+    Args:
+        provider (str): The `name` of the client, e.g. 'aws'.
+        data (list): What the client returned. None counts as no data.
+        scope (str, optional): The scope the data belongs to, e.g. a subscription ID.
+
+    Raises:
+        ValueError: If the provider is unknown, or Azure rows have no date column.
+    """
+    if not data:
+        return CostRecords()
+    if provider == 'aws':
+        return from_aws(data, account_id=scope)
+    if provider == 'azure':
+        # told apart by their columns: the query API names its date column by granularity, the cost details CSV by agreement type
+        columns = set(data[0])
+        if columns.intersection(AZURE_QUERY_DATE_COLUMNS):
+            return from_azure_query(data, subscription_id=scope)
+        if {name.lower() for name in columns}.intersection(_AZURE_DETAILED_FIELDS['charge_date']):
+            return from_azure_detailed(data, subscription_id=scope)
+        raise ValueError(f"Azure rows without a date column can't be normalized, expected one of "
+                         f"{', '.join(AZURE_QUERY_DATE_COLUMNS)} (query) or Date, UsageDateTime (cost details), "
+                         f"got {', '.join(sorted(columns))}")
+    if provider == 'openai':
+        return from_openai(data)
+    raise ValueError(f"Unknown provider {provider}")
+
+
+def normalize_crawl(result):
+    """
+    Converts every result of a `CrawlResult` into one `CostRecords` batch.
+    """
+    return CostRecords.concat(normalize(provider, data, scope) for (provider, scope), data in result.results.items())
+
+
+def _convert_cached(values: List, convert):
+    # dates repeat a lot, convert every distinct value once
+    cache = {}
+    return [cache[value] if value in cache else cache.setdefault(value, convert(value)) for value in values]
+
+
+def azure_query_date_column(columns: Iterable[str]):
+    """
+    Returns which of `AZURE_QUERY_DATE_COLUMNS` the columns (or the keys of a row) of an Azure query result have.
+
+    Raises:
+        ValueError: If there is none, e.g. for a query with 'total' granularity.
+    """
+    columns = set(columns)
+    for name in AZURE_QUERY_DATE_COLUMNS:
+        if name in columns:
+            return name
+    raise ValueError(f"The Azure query result has no date column ({', '.join(AZURE_QUERY_DATE_COLUMNS)}), "
+                     f"a query with 'total' granularity can't be split by date")
+
+
+def azure_query_dates(values: List, column: str = 'UsageDate'):
+    """
+    Converts the values of an Azure query date column to ISO dates: UsageDate is a number like
+    20231001, BillingMonth a datetime string like '2023-10-01T00:00:00'.
+    """
+    if column == 'BillingMonth':
+        return _convert_cached(values, lambda value: str(value)[:10])
+    return _convert_cached(values, lambda value: f'{str(value)[:4]}-{str(value)[4:6]}-{str(value)[6:8]}')
+
+
+def _azure_csv_date(value: Optional[str]):
+    if not value:
+        return None
+    value = value.split(' ')[0]
+    if '/' in value:
+        month, day, year = value.split('/')
+        return f'{year}-{int(month):02d}-{int(day):02d}'
+    return value[:10]
+
+
+def _azure_service(resource_id: Optional[str]):
+    # /subscriptions/<id>/resourceGroups/<group>/providers/Microsoft.Compute/virtualMachines/<name>
+    if not resource_id:
+        return None
+    parts = resource_id.split('/')
+    lower = [part.lower() for part in parts]
+    if 'providers' not in lower:
+        return None
+    i = len(lower) - 1 - lower[::-1].index('providers')
+    return parts[i + 1] if i + 1 < len(parts) else None
+
+
+def _azure_services(resource_ids: List):
+    return _convert_cached(resource_ids, _azure_service)
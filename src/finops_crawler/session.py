@@ -0,0 +1,67 @@
+import threading
+from typing import Optional, Tuple, Union
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeout in seconds. The read timeout applies to every socket read, not to the whole download.
+DEFAULT_TIMEOUT = (10, 300)
+
+
+class PooledSession(requests.Session):
+    """
+    A `requests.Session` with a bounded keep-alive connection pool and a default timeout.
+
+    Reusing one session saves a TCP and TLS handshake on every cost query, pagination link,
+    polling request and blob download. The session can be shared between client instances
+    and threads: urllib3 connection pools are thread-safe, and none of the clients change
+    the session configuration after it has been created.
+    """
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 32, pool_block: bool = False,
+                 timeout: Union[float, Tuple[float, float], None] = DEFAULT_TIMEOUT):
+        """
+        Args:
+            pool_connections (int, optional): Number of hosts to keep connection pools for.
+            pool_maxsize (int, optional): Maximum number of keep-alive connections per host.
+            pool_block (bool, optional): If True, a request waits for a free connection when
+                `pool_maxsize` connections to the host are in use, instead of opening a
+                connection that is thrown away afterwards.
+            timeout (float or tuple, optional): Timeout for requests that don't set one explicitly.
+                Either a single value or a (connect, read) tuple.
+        """
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+_shared_session: Optional[requests.Session] = None
+_shared_session_lock = threading.Lock()
+
+
+def get_shared_session():
+    """
+    Returns the process-wide session used by clients that weren't given one explicitly.
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = PooledSession()
+        return _shared_session
+
+
+def set_shared_session(session: Optional[requests.Session]):
+    """
+    Replaces the process-wide session, e.g. with a `PooledSession` with a bigger pool for a large crawl.
+
+    Clients that were already created keep the session they got. Passing None makes the next
+    `get_shared_session` call create a new default session.
+    """
+    global _shared_session
+    with _shared_session_lock:
+        _shared_session = session
@@ -0,0 +1,370 @@
+# Sinks write normalized cost records (see `finops_crawler.schema`) to files and databases as
+# they are crawled, so a crawl never has to hold its whole result in memory.
+#
+# Every sink is partitioned by (provider, account_id, charge_date). The first time a crawl writes
+# to a partition, whatever the sink already had for it is replaced, so crawling a day again
+# replaces its rows instead of duplicating them. Later writes of the same crawl are appended.
+# A crawl declares the range of every scope with `begin` and ends it with `finish`, which deletes
+# the partitions in that range the crawl didn't write to, e.g. a day whose only cost was refunded.
+import csv
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from typing import Optional, Union
+from finops_crawler.dates import to_date
+from finops_crawler.schema import COLUMNS, CostRecords
+
+
+class Sink:
+    """
+    Base class of the sinks. Subclasses implement `_write(records, new_partitions)` and
+    `_clear(provider, account_id, start_date, end_date, written)`.
+
+    Sinks can be written to from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._replaced = set()
+        self._ranges = {}
+
+    def write(self, records: CostRecords):
+        """
+        Writes a batch of records, replacing the stored data of partitions this crawl hasn't written to yet.
+        """
+        if not len(records):
+            return
+        with self._lock:
+            keys = set(_partition_keys(records))
+            new_partitions = keys - self._replaced
+            self._write(records, new_partitions)
+            self._replaced.update(new_partitions)
+
+    def reset(self):
+        """
+        Starts a new crawl: the next write to any partition replaces it again.
+        """
+        with self._lock:
+            self._replaced.clear()
+            self._ranges.clear()
+
+    def begin(self, provider: str, account_id: Optional[str], start_date: Union[str, datetime.date], end_date: Union[str, datetime.date],
+              end_inclusive: bool = False):
+        """
+        Declares that this crawl fetches the records of a provider and account for a date range.
+        Nothing is deleted until `finish`, so a scope that fails keeps its stored data.
+
+        Args:
+            provider (str): Name of the platform, e.g. 'aws'.
+            account_id (str): The account the records belong to. None stands for every account of
+                the provider, for clients with a single scope (e.g. OpenAI, whose records are per project).
+            start_date (str or date): First day of the range.
+            end_date (str or date): End of the range.
+            end_inclusive (bool, optional): Whether `end_date` itself belongs to the range, as the
+                client's `end_date_inclusive` says.
+        """
+        end = to_date(end_date) + datetime.timedelta(days=1 if end_inclusive else 0)
+        with self._lock:
+            self._ranges[(provider, account_id)] = (to_date(start_date).isoformat(), end.isoformat())
+
+    def finish(self, provider: str, account_id: Optional[str]):
+        """
+        Ends the crawl of a range declared with `begin`: its partitions this crawl didn't write to are
+        deleted, so the sink doesn't keep the rows of days that have no data anymore.
+        """
+        with self._lock:
+            date_range = self._ranges.pop((provider, account_id), None)
+            if date_range is None:
+                return
+            written = {key for key in self._replaced if key[0] == provider and (account_id is None or key[1] == account_id)}
+            self._clear(provider, account_id, date_range[0], date_range[1], written)
+
+    def _write(self, records: CostRecords, new_partitions: set):
+        raise NotImplementedError("This method should be overridden in subclass")
+
+    def _clear(self, provider: str, account_id: Optional[str], start_date: str, end_date: str, written: set):
+        # deletes the partitions from start_date up to (excluding) end_date, except those in `written`
+        raise NotImplementedError("This method should be overridden in subclass")
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PartitionedFileSink(Sink):
+    """
+    Writes one directory per partition, `<directory>/<provider>/<charge_date>/<account_id>/`,
+    with a part file per write. Replacing a partition removes its directory.
+    """
+
+    extension = None
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _partition_dir(self, key):
+        provider, account_id, charge_date = key
+        return os.path.join(self.directory, _safe_name(provider), _safe_name(charge_date), _safe_name(account_id or '_'))
+
+    def _write(self, records: CostRecords, new_partitions: set):
+        for key, part in _split_partitions(records):
+            partition_dir = self._partition_dir(key)
+            if key in new_partitions:
+                shutil.rmtree(partition_dir, ignore_errors=True)
+            os.makedirs(partition_dir, exist_ok=True)
+            part_number = sum(1 for name in os.listdir(partition_dir) if name.endswith(self.extension))
+            path = os.path.join(partition_dir, f'part-{part_number:05d}{self.extension}')
+            # write to a temporary file first so readers never see a half-written part
+            fd, temp_path = tempfile.mkstemp(dir=partition_dir, suffix='.tmp')
+            os.close(fd)
+            try:
+                self._write_file(part, temp_path)
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def _clear(self, provider: str, account_id: Optional[str], start_date: str, end_date: str, written: set):
+        provider_dir = os.path.join(self.directory, _safe_name(provider))
+        if not os.path.isdir(provider_dir):
+            return
+        keep = {self._partition_dir(key) for key in written}
+        for charge_date in os.listdir(provider_dir):
+            # ISO dates compare like strings
+            if not start_date <= charge_date < end_date:
+                continue
+            date_dir = os.path.join(provider_dir, charge_date)
+            accounts = os.listdir(date_dir) if account_id is None else [_safe_name(account_id)]
+            for account in accounts:
+                partition_dir = os.path.join(date_dir, account)
+                if partition_dir not in keep:
+                    shutil.rmtree(partition_dir, ignore_errors=True)
+
+    def _write_file(self, records: CostRecords, path: str):
+        raise NotImplementedError("This method should be overridden in subclass")
+
+
+class CSVSink(PartitionedFileSink):
+    extension = '.csv'
+
+    def _write_file(self, records: CostRecords, path: str):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(records.rows())
+
+
+class JSONLSink(PartitionedFileSink):
+    extension = '.jsonl'
+
+    def _write_file(self, records: CostRecords, path: str):
+        names = list(COLUMNS)
+        with open(path, 'w', encoding='utf-8') as f:
+            for row in records.rows():
+                f.write(json.dumps(dict(zip(names, row))))
+                f.write('\n')
+
+
+class ParquetSink(PartitionedFileSink):
+    """
+    Requires pyarrow (`pip install finops_crawler[arrow]`).
+    """
+
+    extension = '.parquet'
+
+    def __init__(self, directory: str, compression: str = 'zstd'):
+        super().__init__(directory)
+        self.compression = compression
+
+    def _write_file(self, records: CostRecords, path: str):
+        from finops_crawler import columnar
+        columnar.write_parquet(records.to_arrow(), path, compression=self.compression)
+
+
+class DBAPISink(Sink):
+    """
+    Inserts the records into a table through any DB-API 2.0 connection (sqlite3, psycopg2, ...).
+
+    Replacing a partition deletes its rows in the same transaction that inserts the new ones.
+    Dates are stored as ISO strings, and a missing `account_id` as an empty string so that it
+    can be compared in the partition key.
+    """
+
+    def __init__(self, connection, table: str = 'cost_records', paramstyle: str = 'qmark', create_table: bool = True,
+                 batch_size: int = 10000):
+        """
+        Args:
+            connection: An open DB-API connection.
+            table (str, optional): Table to write to.
+            paramstyle (str, optional): The `paramstyle` of the driver: 'qmark' (`?`), 'format' or 'pyformat' (`%s`), or 'numeric' (`:1`).
+            create_table (bool, optional): Create the table if it doesn't exist.
+            batch_size (int, optional): Rows per `executemany` call.
+        """
+        super().__init__()
+        self.connection = connection
+        self.table = table
+        self.paramstyle = paramstyle
+        self.batch_size = batch_size
+        if create_table:
+            self._create_table()
+
+    def _create_table(self):
+        columns = ', '.join(f"{name} {'DOUBLE PRECISION' if name == 'cost' else 'TEXT'}" for name in COLUMNS)
+        cursor = self.connection.cursor()
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({columns})")
+        self.connection.commit()
+
+    def _placeholders(self, count: int):
+        if self.paramstyle == 'qmark':
+            return ', '.join(['?'] * count)
+        if self.paramstyle in ('format', 'pyformat'):
+            return ', '.join(['%s'] * count)
+        if self.paramstyle == 'numeric':
+            return ', '.join(f':{i + 1}' for i in range(count))
+        raise ValueError(f"Unsupported paramstyle {self.paramstyle}")
+
+    def _delete(self, cursor, partitions):
+        if partitions:
+            placeholders = self._placeholders(3).split(', ')
+            cursor.executemany(
+                f"DELETE FROM {self.table} WHERE provider = {placeholders[0]} AND account_id = {placeholders[1]} AND charge_date = {placeholders[2]}",
+                [(provider, account_id or '', charge_date) for provider, account_id, charge_date in partitions],
+            )
+
+    def _clear(self, provider: str, account_id: Optional[str], start_date: str, end_date: str, written: set):
+        placeholders = self._placeholders(4).split(', ')
+        select = f"SELECT DISTINCT account_id, charge_date FROM {self.table} WHERE provider = {placeholders[0]} AND charge_date >= {placeholders[1]} AND charge_date < {placeholders[2]}"
+        parameters = [provider, start_date, end_date]
+        if account_id is not None:
+            select += f" AND account_id = {placeholders[3]}"
+            parameters.append(account_id)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(select, parameters)
+            stale = _stale_partitions(provider, cursor.fetchall(), written)
+            self._delete(cursor, stale)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def _write(self, records: CostRecords, new_partitions: set):
+        account_index = list(COLUMNS).index('account_id')
+        cursor = self.connection.cursor()
+        try:
+            self._delete(cursor, new_partitions)
+            insert = f"INSERT INTO {self.table} ({', '.join(COLUMNS)}) VALUES ({self._placeholders(len(COLUMNS))})"
+            batch = []
+            for row in records.rows():
+                if row[account_index] is None:
+                    row = row[:account_index] + ('',) + row[account_index + 1:]
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    cursor.executemany(insert, batch)
+                    batch = []
+            if batch:
+                cursor.executemany(insert, batch)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def close(self):
+        self.connection.close()
+
+
+class SQLiteSink(DBAPISink):
+    def __init__(self, path: str = 'finops_crawler.sqlite', table: str = 'cost_records', batch_size: int = 10000):
+        # the sink serializes writes itself, so the connection can be used from the crawler's worker threads
+        super().__init__(sqlite3.connect(path, check_same_thread=False), table=table, batch_size=batch_size)
+        with self.connection:
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_partition ON {table} (provider, account_id, charge_date)")
+
+
+class DuckDBSink(DBAPISink):
+    """
+    Writes to a DuckDB database. Batches are inserted as Arrow tables instead of row by row,
+    so this requires pyarrow as well as duckdb.
+    """
+
+    def __init__(self, path: str = 'finops_crawler.duckdb', table: str = 'cost_records'):
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("DuckDBSink requires duckdb, install it with `pip install duckdb`") from e
+        super().__init__(duckdb.connect(path), table=table)
+
+    def _create_table(self):
+        columns = ', '.join(f"{name} {'DOUBLE' if name == 'cost' else 'DATE' if name == 'charge_date' else 'VARCHAR'}" for name in COLUMNS)
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({columns})")
+
+    def _write(self, records: CostRecords, new_partitions: set):
+        records = CostRecords(dict(records.columns, account_id=[account_id or '' for account_id in records.columns['account_id']]))
+        batch = records.to_arrow()
+        self.connection.begin()
+        try:
+            for provider, account_id, charge_date in new_partitions:
+                self.connection.execute(f"DELETE FROM {self.table} WHERE provider = ? AND account_id = ? AND charge_date = ?",
+                                        [provider, account_id or '', charge_date])
+            self.connection.register('finops_crawler_batch', batch)
+            # by name, so a table created with its columns in another order still gets the right values
+            columns = ', '.join(COLUMNS)
+            self.connection.execute(f"INSERT INTO {self.table} ({columns}) SELECT {columns} FROM finops_crawler_batch")
+            self.connection.unregister('finops_crawler_batch')
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def _clear(self, provider: str, account_id: Optional[str], start_date: str, end_date: str, written: set):
+        select = f"SELECT DISTINCT account_id, charge_date FROM {self.table} WHERE provider = ? AND charge_date >= ? AND charge_date < ?"
+        parameters = [provider, start_date, end_date]
+        if account_id is not None:
+            select += " AND account_id = ?"
+            parameters.append(account_id)
+        self.connection.begin()
+        try:
+            stale = _stale_partitions(provider, self.connection.execute(select, parameters).fetchall(), written)
+            for provider, account_id, charge_date in stale:
+                self.connection.execute(f"DELETE FROM {self.table} WHERE provider = ? AND account_id = ? AND charge_date = ?",
+                                        [provider, account_id or '', charge_date])
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+
+def _partition_keys(records: CostRecords):
+    columns = records.columns
+    return zip(columns['provider'], columns['account_id'], columns['charge_date'])
+
+
+def _stale_partitions(provider: str, stored, written: set):
+    # (account_id, charge_date) rows of a table -> the partition keys this crawl didn't write to;
+    # tables store a missing account as '' and DuckDB returns dates as date objects
+    partitions = {(provider, account_id or None, str(charge_date)) for account_id, charge_date in stored}
+    return partitions - {(provider, account_id or None, charge_date) for _, account_id, charge_date in written}
+
+
+def _split_partitions(records: CostRecords):
+    indices = {}
+    for i, key in enumerate(_partition_keys(records)):
+        indices.setdefault(key, []).append(i)
+    if len(indices) == 1:
+        return [(key, records) for key in indices]
+    return [(key, records.take(part)) for key, part in indices.items()]
+
+
+def _safe_name(value: Optional[str]):
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in str(value))
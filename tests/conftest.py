@@ -0,0 +1,52 @@
+# Shared fixtures: the mock Azure server of the benchmarks, clients pointed at it, and a clean
+# slate of rate limiters and metrics for every test.
+import pytest
+from finops_crawler import metrics
+from finops_crawler import ratelimit
+from finops_crawler.azure.api import AzureAPI
+from finops_crawler.azure.auth import TokenProvider
+
+import mock_azure
+
+
+@pytest.fixture(autouse=True)
+def fast_limits(monkeypatch):
+    # the tests measure behaviour, not politeness towards the real APIs
+    monkeypatch.setattr(ratelimit, '_limiters', {})
+    monkeypatch.setattr(ratelimit, '_limits', {})
+    monkeypatch.setattr(ratelimit, 'DEFAULT_RETRY_POLICY', ratelimit.RetryPolicy(max_retries=3, base_delay=0.01))
+    for provider in ratelimit.DEFAULT_LIMITS:
+        ratelimit.configure(provider, rate=1000, capacity=100, max_rate=1000)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.fixture
+def azure_mock():
+    """
+    Starts a mock Azure server, e.g. `azure_mock(blobs=2, rows_per_blob=100)`, see `MockAzureConfig`.
+    """
+    servers = []
+
+    def start(**config):
+        config = dict({'subscriptions': 1, 'pages': 2, 'rows_per_page': 50, 'blobs': 2, 'rows_per_blob': 200, 'report_polls': 1}, **config)
+        server = mock_azure.MockAzure(mock_azure.MockAzureConfig(**config)).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def azure_client():
+    """
+    Returns an `AzureAPI` whose requests go to a mock server, e.g. `azure_client(server, checkpoints=store)`.
+    """
+    def create(server, **kwargs):
+        session = mock_azure.redirect_session(server.url)
+        return AzureAPI('tenant', 'client', 'secret', session=session, token_provider=TokenProvider(session=session), **kwargs)
+
+    return create
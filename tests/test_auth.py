@@ -0,0 +1,71 @@
+import threading
+import types
+from finops_crawler.azure import auth
+from finops_crawler.azure.auth import TokenProvider
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def _provider(monkeypatch, expires_in):
+    clock = _Clock()
+    monkeypatch.setattr(auth, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    provider = TokenProvider(refresh_margin=300)
+    fetched = []
+
+    def fetch_token(tenant_id, client_id, client_secret, scope):
+        fetched.append(clock.now)
+        return f'token-{len(fetched)}', expires_in
+    provider._fetch_token = fetch_token
+    return provider, clock, fetched
+
+
+def test_short_lived_tokens_are_used_for_half_of_their_lifetime(monkeypatch):
+    # the default margin of 5 minutes is longer than the whole lifetime of this token
+    provider, clock, fetched = _provider(monkeypatch, expires_in=120)
+
+    assert provider.get_token('tenant', 'client', 'secret') == 'token-1'
+    clock.now += 59
+    assert provider.get_token('tenant', 'client', 'secret') == 'token-1'
+    clock.now += 1
+    assert provider.get_token('tenant', 'client', 'secret') == 'token-2'
+
+
+def test_long_lived_tokens_are_refreshed_a_margin_before_they_expire(monkeypatch):
+    provider, clock, fetched = _provider(monkeypatch, expires_in=3600)
+
+    provider.get_token('tenant', 'client', 'secret')
+    clock.now += 3299
+    assert provider.cached_token('tenant', 'client') == 'token-1'
+    clock.now += 1
+    assert provider.cached_token('tenant', 'client') is None
+
+
+def test_invalidate_waits_for_a_refresh_in_progress():
+    provider = TokenProvider()
+    fetching, release = threading.Event(), threading.Event()
+
+    def fetch_token(tenant_id, client_id, client_secret, scope):
+        fetching.set()
+        release.wait(5)
+        return 'token', 3600
+    provider._fetch_token = fetch_token
+
+    fetch = threading.Thread(target=provider.get_token, args=('tenant', 'client', 'secret'))
+    fetch.start()
+    fetching.wait(5)
+    invalidate = threading.Thread(target=provider.invalidate, args=('tenant', 'client'))
+    invalidate.start()
+    invalidate.join(0.1)
+    assert invalidate.is_alive()
+    release.set()
+    fetch.join(5)
+    invalidate.join(5)
+
+    # the token the API rejected doesn't survive the refresh that was running
+    assert provider.cached_token('tenant', 'client') is None
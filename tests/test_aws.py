@@ -0,0 +1,157 @@
+import asyncio
+import datetime
+import pytest
+from botocore.credentials import Credentials
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from finops_crawler import metrics
+from finops_crawler import ratelimit
+from finops_crawler.aws.aio import AsyncAWSAPI
+from finops_crawler.aws.api import AWSAPI
+from finops_crawler.aws.clients import ClientPool
+from finops_crawler.query import CostQuery
+
+import aws_stub
+
+
+def _pool():
+    return ClientPool('test', 'test', region_name='us-east-1')
+
+
+def _client_error(code, status_code=400):
+    return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status_code}}, 'GetCostAndUsage')
+
+
+def test_get_cost_follows_the_pages():
+    client = aws_stub.stubbed_client(pages=3, groups_per_page=30)
+
+    results = client.get_cost('2023-10-01', '2023-10-31')
+
+    assert len(results) == 30
+    assert metrics.totals('pages', by='operation') == {'get_cost_and_usage': 3}
+
+
+def test_requests_are_labelled_with_the_linked_account():
+    client = aws_stub.stubbed_client(pages=2, groups_per_page=30)
+
+    client.get_cost('2023-10-01', '2023-10-31', account_id='111111111111')
+
+    assert metrics.totals('pages', by='scope') == {'111111111111': 2}
+
+
+def test_monthly_queries_are_sharded_by_calendar_month():
+    client = AWSAPI(client_pool=_pool())
+    periods = []
+    client._get_cost_and_usage = lambda request, account_id=None: periods.append(request['TimePeriod']) or []
+
+    client.get_cost('2023-10-15', '2023-12-10', shard_days=10, max_workers=2, query=CostQuery(granularity='monthly'))
+
+    assert sorted((period['Start'], period['End']) for period in periods) == [
+        ('2023-10-15', '2023-11-01'), ('2023-11-01', '2023-12-01'), ('2023-12-01', '2023-12-10')]
+
+
+def test_get_scope_cost_assumes_a_role_only_in_other_accounts(monkeypatch):
+    client = AWSAPI(role_name='CostReader', client_pool=_pool())
+    calls = []
+    monkeypatch.setattr(client, 'get_account_info', lambda: '111111111111')
+    monkeypatch.setattr(client, 'get_cost', lambda start_date, end_date, account_id=None: calls.append(('caller', account_id)))
+
+    class Member:
+        def get_cost(self, start_date, end_date):
+            calls.append(('member', None))
+    monkeypatch.setattr(client, 'for_account', lambda account_id: Member())
+
+    client.get_scope_cost('111111111111', '2023-10-01', '2023-10-31')
+    client.get_scope_cost('222222222222', '2023-10-01', '2023-10-31')
+
+    assert calls == [('caller', '111111111111'), ('member', None)]
+
+
+def test_rate_limited_services_are_not_retried_by_botocore():
+    pool = _pool()
+    for service_name in ('ce', 'organizations'):
+        assert pool.client(service_name).meta.config.retries['total_max_attempts'] == 1
+    assert 'total_max_attempts' not in pool.client('sts').meta.config.retries
+
+
+def test_call_retries_server_errors_without_slowing_the_limiter_down():
+    limiter = ratelimit.TokenBucket(rate=100, capacity=10)
+    responses = [_client_error('InternalServerError', 500), _client_error('ServiceUnavailable', 503), {'ok': True}]
+
+    def function():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert ratelimit.call(function, limiter=limiter) == {'ok': True}
+    assert limiter.rate == 100
+    assert metrics.totals('retries', by='reason') == {'InternalServerError': 1, 'ServiceUnavailable': 1}
+
+
+def test_call_retries_throttling_and_connection_errors_only():
+    limiter = ratelimit.TokenBucket(rate=100, capacity=10)
+    responses = [_client_error('ThrottlingException'), ConnectionResetError(), {'ok': True}]
+
+    def function():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert ratelimit.call(function, limiter=limiter, connection_errors=(ConnectionResetError,)) == {'ok': True}
+    assert limiter.rate < 100
+    with pytest.raises(ClientError):
+        ratelimit.call(lambda: (_ for _ in ()).throw(_client_error('ValidationException')), limiter=limiter)
+    with pytest.raises(ConnectionResetError):
+        ratelimit.call(lambda: (_ for _ in ()).throw(ConnectionResetError()), limiter=limiter)
+
+
+def test_get_all_accounts_pages_through_the_limiter():
+    pool = _pool()
+    stubber = Stubber(pool.client('organizations'))
+    stubber.add_response('list_accounts', {'Accounts': [{'Id': '111111111111'}], 'NextToken': 'next'}, {})
+    stubber.add_client_error('list_accounts', 'TooManyRequestsException', http_status_code=400)
+    stubber.add_response('list_accounts', {'Accounts': [{'Id': '222222222222'}]}, {'NextToken': 'next'})
+    stubber.activate()
+
+    accounts = AWSAPI(client_pool=pool).get_all_accounts()
+
+    assert accounts == ['111111111111', '222222222222']
+    assert metrics.totals('retries', by='operation') == {'list_accounts': 1}
+    stubber.assert_no_pending_responses()
+
+
+def test_async_get_scope_cost_delegates_to_the_sync_client(monkeypatch):
+    client = AsyncAWSAPI('test', 'test')
+    calls = []
+    monkeypatch.setattr(client.api, 'get_scope_cost', lambda *args: calls.append(args) or ['data'])
+
+    assert asyncio.run(client.get_scope_cost('111111111111', '2023-10-01', '2023-10-31', True)) == ['data']
+    assert calls == [('111111111111', '2023-10-01', '2023-10-31', True)]
+
+
+def test_pool_credentials_come_before_the_environment(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'environment')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'environment')
+
+    pool = ClientPool(region_name='us-east-1', credentials=Credentials('pool', 'secret'))
+
+    assert pool.session.get_credentials().access_key == 'pool'
+
+
+def test_roles_are_assumed_on_first_use():
+    pool = _pool()
+    stubber = Stubber(pool.client('sts'))
+    stubber.activate()
+
+    role_pool = pool.assume_role('arn:aws:iam::222222222222:role/CostReader')
+
+    # nothing was asked of STS yet, and the same role gets the same pool
+    assert pool.assume_role('arn:aws:iam::222222222222:role/CostReader') is role_pool
+    stubber.add_response('assume_role', {'Credentials': {
+        'AccessKeyId': 'ASIAROLEKEY1234567890', 'SecretAccessKey': 'secret', 'SessionToken': 'token',
+        'Expiration': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1),
+    }}, {'RoleArn': 'arn:aws:iam::222222222222:role/CostReader', 'RoleSessionName': 'finops_crawler'})
+    assert role_pool.session.get_credentials().get_frozen_credentials().access_key == 'ASIAROLEKEY1234567890'
+    stubber.assert_no_pending_responses()
@@ -0,0 +1,113 @@
+import datetime
+import pytest
+import requests
+from finops_crawler import metrics
+from finops_crawler.azure import api as azure_api
+from finops_crawler.azure import blobs
+from finops_crawler.azure.api import AzureAPI
+from finops_crawler.base import EmptyResultError
+from finops_crawler.query import CostQuery
+
+
+def _row(usage_date, resource_id, cost, charge_type='Usage'):
+    return {'Cost': cost, 'UsageDate': usage_date, 'ResourceId': resource_id, 'ChargeType': charge_type, 'Currency': 'EUR'}
+
+
+def test_merge_chunks_keeps_one_row_per_day_and_key():
+    first = [_row(20231001, 'a', 1.0), _row(20231002, 'a', 2.0)]
+    # the next window repeats the boundary day
+    second = [_row(20231002, 'a', 2.5), _row(20231003, 'a', 3.0), _row(20231003, 'b', 4.0)]
+
+    merged = AzureAPI._merge_chunks([first, second])
+
+    assert sorted((row['UsageDate'], row['ResourceId'], row['Cost']) for row in merged) == [
+        (20231001, 'a', 1.0), (20231002, 'a', 2.5), (20231003, 'a', 3.0), (20231003, 'b', 4.0)]
+
+
+def test_merge_chunks_adds_up_a_month_split_over_windows():
+    query = CostQuery(granularity='monthly', group_by=['service'])
+    month = '2023-10-01T00:00:00'
+    first = [{'Cost': 1.5, 'BillingMonth': month, 'ServiceName': 'Storage', 'Currency': 'EUR'}]
+    second = [{'Cost': 2.0, 'BillingMonth': month, 'ServiceName': 'Storage', 'Currency': 'EUR'},
+              {'Cost': 4.0, 'BillingMonth': month, 'ServiceName': 'Compute', 'Currency': 'EUR'}]
+
+    merged = AzureAPI._merge_chunks([first, second], query)
+
+    assert sorted((row['ServiceName'], row['Cost']) for row in merged) == [('Compute', 4.0), ('Storage', 3.5)]
+
+
+def test_merge_chunks_raises_only_when_every_window_is_empty():
+    rows = [_row(20231001, 'a', 1.0)]
+    assert AzureAPI._merge_chunks([rows]) is rows
+    assert AzureAPI._merge_chunks([[], rows]) == rows
+    with pytest.raises(EmptyResultError):
+        AzureAPI._merge_chunks([[], []])
+
+
+def test_chunks_only_split_ranges_longer_than_the_api_accepts():
+    # a week across a month end is one query
+    assert AzureAPI._chunks('2023-10-28', '2023-11-03') == [(datetime.date(2023, 10, 28), datetime.date(2023, 11, 3))]
+    chunks = AzureAPI._chunks('2022-01-01', '2023-06-30')
+    assert len(chunks) == 18
+    assert all(start <= end for start, end in chunks)
+    assert all(end + datetime.timedelta(days=1) == start for (_, end), (start, _) in zip(chunks, chunks[1:]))
+    assert len(AzureAPI._chunks('2023-10-01', '2023-10-31', chunk_days=10)) == 4
+
+
+def test_chunk_body_ends_at_the_end_of_the_last_day():
+    body = AzureAPI._chunk_body((datetime.date(2023, 10, 1), datetime.date(2023, 10, 31)))
+    assert body['timePeriod']['to'].startswith('2023-10-31T23:59:59')
+
+
+def test_split_by_day_reads_the_date_column_of_the_granularity():
+    daily = [_row(20231001, 'a', 1.0), _row(20231001, 'b', 2.0), _row(20231002, 'a', 3.0)]
+    assert {day: len(rows) for day, rows in AzureAPI.split_by_day(None, daily).items()} == {'2023-10-01': 2, '2023-10-02': 1}
+
+    monthly = [{'Cost': 1.0, 'BillingMonth': '2023-10-01T00:00:00', 'Currency': 'EUR'}]
+    assert list(AzureAPI.split_by_day(None, monthly)) == ['2023-10-01']
+
+    with pytest.raises(ValueError, match='no date column'):
+        AzureAPI.split_by_day(None, [{'Cost': 1.0, 'Currency': 'EUR'}])
+
+
+def test_error_message_falls_back_to_the_body():
+    response = requests.Response()
+    response.status_code = 404
+    response._content = b''
+    assert azure_api._error_message(response) == ''
+
+    response._content = b'{"error": {"code": "NotFound", "message": "Report expired"}}'
+    assert azure_api._error_message(response) == 'Report expired'
+
+
+def test_get_cost_follows_the_next_links(azure_mock, azure_client):
+    server = azure_mock(pages=3, rows_per_page=40)
+    client = azure_client(server)
+
+    rows = client.get_cost(server.subscriptions[0], '2023-10-01', '2023-10-31')
+
+    assert len(rows) == 3 * 40
+    assert metrics.totals('pages', by='operation') == {'query': 3}
+
+
+def test_iter_cost_detailed_retries_a_broken_blob(azure_mock, azure_client):
+    server = azure_mock(blobs=2, rows_per_blob=3000, blob_failures=1)
+    client = azure_client(server)
+
+    rows = list(client.iter_cost_detailed(server.subscriptions[0], '2023-10-01', '2023-10-31', blob_retries=1))
+
+    assert len(rows) == 2 * 3000
+    assert sorted(server.blob_downloads.values()) == [2, 2]
+
+
+def test_iter_cost_detailed_columns_passes_the_blob_retries_on(azure_mock, azure_client):
+    server = azure_mock(blobs=1, rows_per_blob=3000, blob_failures=2)
+    client = azure_client(server)
+
+    # the first download breaks off and isn't retried, the second one is
+    with pytest.raises(blobs.DOWNLOAD_ERRORS):
+        list(client.iter_cost_detailed_columns(server.subscriptions[0], '2023-10-01', '2023-10-31', blob_retries=0))
+    batches = list(client.iter_cost_detailed_columns(server.subscriptions[0], '2023-10-01', '2023-10-31', batch_size=1000, blob_retries=1))
+
+    assert sum(len(batch['Date']) for batch in batches) == 3000
+    assert list(server.blob_downloads.values()) == [3]
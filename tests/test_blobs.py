@@ -0,0 +1,95 @@
+import asyncio
+import csv
+import functools
+import io
+import pytest
+import requests
+from finops_crawler import columnar
+from finops_crawler import metrics
+from finops_crawler import schema
+from finops_crawler.azure import blobs
+from finops_crawler.azure.csvparse import BlobParser
+
+
+def _blob(server, report: int = 0):
+    subscription_id = server.subscriptions[0]
+    link = f'{server.url}/mock/blobs/{subscription_id}/0.csv?report={report}'
+    return link, server._blob(subscription_id, 0), (subscription_id, '0.csv')
+
+
+def test_iter_blob_rows_skips_the_rows_it_yielded_before_the_download_broke_off(azure_mock):
+    server = azure_mock(rows_per_blob=5000, blob_failures=2)
+    link, body, key = _blob(server)
+
+    rows = list(blobs.iter_blob_rows(link, retries=2, backoff=0.01))
+
+    assert rows == list(csv.DictReader(io.StringIO(body.decode('utf-8-sig'), newline='')))
+    assert server.blob_downloads[key] == 3
+    assert metrics.totals('retries', by='operation') == {'blob': 2}
+
+
+def test_iter_blob_rows_gives_up_after_the_retries(azure_mock):
+    server = azure_mock(rows_per_blob=5000, blob_failures=2)
+    link, _, _ = _blob(server)
+
+    with pytest.raises(blobs.DOWNLOAD_ERRORS):
+        list(blobs.iter_blob_rows(link, retries=1, backoff=0.01))
+
+
+def test_expired_blob_link_is_not_retried(azure_mock):
+    server = azure_mock()
+    # a link of a report generated before the links expired
+    link, _, key = _blob(server, report=-1)
+
+    with pytest.raises(requests.HTTPError) as error:
+        list(blobs.iter_blob_rows(link, retries=3, backoff=0.01))
+
+    assert error.value.response.status_code == 403
+    assert metrics.totals('retries', by='operation') == {}
+
+
+def test_iter_blob_columns_resumes_mid_batch(azure_mock):
+    server = azure_mock(rows_per_blob=5000, blob_failures=1)
+    link, body, key = _blob(server)
+    parser = BlobParser(schema.AZURE_DETAILED_COLUMNS)
+
+    # batches that don't line up with where the download broke off, so one is yielded in part
+    result = {name: [] for name in parser.names}
+    for batch in blobs.iter_blob_columns(link, parser, batch_size=777, retries=1, backoff=0.01):
+        for name, values in batch.items():
+            result[name].extend(values)
+
+    assert result == parser.read_columns(io.BytesIO(body))
+    assert server.blob_downloads[key] == 2
+
+
+def test_iter_blob_batches_resumes_mid_batch(azure_mock, monkeypatch):
+    pa = pytest.importorskip('pyarrow')
+    server = azure_mock(rows_per_blob=5000, blob_failures=1)
+    link, body, key = _blob(server)
+    # small blocks, so batches are yielded before the download breaks off
+    csv_to_batches = functools.partial(columnar.csv_to_batches, block_size=64 * 1024)
+    monkeypatch.setattr(columnar, 'csv_to_batches', csv_to_batches)
+
+    table = pa.Table.from_batches(list(blobs.iter_blob_batches(link, retries=1, backoff=0.01)))
+
+    expected = pa.Table.from_batches(list(csv_to_batches(io.BytesIO(body))))
+    assert table.to_pylist() == expected.to_pylist()
+    assert server.blob_downloads[key] == 2
+
+
+def test_async_blob_rows_skip_the_rows_yielded_before_the_download_broke_off(azure_mock):
+    pytest.importorskip('aiohttp')
+    from finops_crawler import aio
+    from finops_crawler.azure import aio as azure_aio
+    server = azure_mock(rows_per_blob=5000, blob_failures=1)
+    link, body, key = _blob(server)
+
+    async def download():
+        async with aio.create_session() as session:
+            return [row async for row in azure_aio._iter_blob_rows(session, link, 1, {}, backoff=0.01)]
+
+    rows = asyncio.run(download())
+
+    assert rows == list(csv.DictReader(io.StringIO(body.decode('utf-8-sig'), newline='')))
+    assert server.blob_downloads[key] == 2
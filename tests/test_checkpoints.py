@@ -0,0 +1,95 @@
+import pytest
+from finops_crawler import metrics
+from finops_crawler.checkpoints import CheckpointStore, paginate
+
+PAGES = {None: ('page 0', 't1'), 't1': ('page 1', 't2'), 't2': ('page 2', 't3'), 't3': ('page 3', None)}
+
+
+NEVER = object()
+
+
+class Pages:
+    # serves PAGES, failing once on the token in `fail_on`
+    def __init__(self, fail_on=NEVER, error=RuntimeError):
+        self.fail_on = fail_on
+        self.error = error
+        self.requested = []
+
+    def __call__(self, token):
+        self.requested.append(token)
+        if token == self.fail_on:
+            self.fail_on = NEVER
+            raise self.error('interrupted')
+        return PAGES[token]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    yield store
+    store.close()
+
+
+def test_interrupted_pagination_resumes_at_the_next_page(store):
+    fetch_page = Pages(fail_on='t2')
+    pages = []
+    with pytest.raises(RuntimeError):
+        for page in paginate(store, 'azure', 'sub', {'body': 1}, fetch_page):
+            pages.append(page)
+    assert pages == ['page 0', 'page 1']
+    assert store.pending()[0][:3] == ('azure', 'sub', 2)
+
+    fetch_page.requested.clear()
+    assert list(paginate(store, 'azure', 'sub', {'body': 1}, fetch_page)) == ['page 0', 'page 1', 'page 2', 'page 3']
+    assert fetch_page.requested == ['t2', 't3']
+    assert metrics.totals('resumed_pages', by='scope') == {'sub': 2}
+    # nothing left to resume once every page was handed out
+    assert store.pending() == []
+
+
+def test_other_requests_dont_resume_the_checkpoint(store):
+    with pytest.raises(RuntimeError):
+        list(paginate(store, 'azure', 'sub', {'body': 1}, Pages(fail_on='t2')))
+
+    fetch_page = Pages()
+    assert len(list(paginate(store, 'azure', 'sub', {'body': 2}, fetch_page))) == 4
+    assert fetch_page.requested == [None, 't1', 't2', 't3']
+
+
+def test_expired_token_starts_over(store):
+    class Expired(Exception):
+        pass
+
+    with pytest.raises(RuntimeError):
+        list(paginate(store, 'azure', 'sub', {'body': 1}, Pages(fail_on='t2')))
+
+    fetch_page = Pages(fail_on='t2', error=Expired)
+    pages = list(paginate(store, 'azure', 'sub', {'body': 1}, fetch_page, is_expired=lambda e: isinstance(e, Expired)))
+
+    assert pages == ['page 0', 'page 1', 'page 2', 'page 3']
+    assert fetch_page.requested == ['t2', None, 't1', 't2', 't3']
+
+
+def test_azure_query_resumes_from_the_checkpoint(azure_mock, azure_client, store):
+    server = azure_mock(pages=4, rows_per_page=25)
+    client = azure_client(server, checkpoints=store)
+    subscription_id = server.subscriptions[0]
+    request = client._request
+    queries = []
+
+    def interrupted_request(method, url, operation=None, **kwargs):
+        if operation == 'query':
+            queries.append(url)
+            if len(queries) == 3:
+                raise ConnectionError('interrupted')
+        return request(method, url, operation=operation, **kwargs)
+
+    client._request = interrupted_request
+    with pytest.raises(ConnectionError):
+        client.get_cost(subscription_id, '2023-10-01', '2023-10-31')
+
+    rows = client.get_cost(subscription_id, '2023-10-01', '2023-10-31')
+
+    assert len(rows) == 4 * 25
+    # pages 0 and 1 came from the store, page 2 was requested again, page 3 for the first time
+    assert [url.rsplit('page=', 1)[-1] if 'page=' in url else '0' for url in queries] == ['0', '1', '2', '2', '3']
@@ -0,0 +1,36 @@
+import io
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+
+from finops_crawler import columnar
+
+
+def _csv(rows):
+    lines = ['Date,CostInBillingCurrency,Quantity,Units'] + [f'10/01/2023,{cost},{quantity},{units}' for cost, quantity, units in rows]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def test_cost_columns_stay_float_when_the_first_block_has_whole_numbers():
+    # the first blocks only have whole numbers, the last one fractions
+    content = _csv([(1, 2, 3)] * 2000 + [(1.25, 0.5, 3)] * 10)
+
+    batches = list(columnar.csv_to_batches(io.BytesIO(content), block_size=4096))
+
+    assert len(batches) > 1
+    assert all(batch.schema.field('CostInBillingCurrency').type == pa.float64() for batch in batches)
+    table = columnar.table_from_batches(batches)
+    assert table.num_rows == 2010
+    assert table.column('CostInBillingCurrency').to_pylist()[-1] == 1.25
+
+
+def test_widened_types_parse_fractions_in_a_later_blob():
+    first = list(columnar.csv_to_batches(io.BytesIO(_csv([(1, 2, 3)]))))
+    types = columnar.widen_types(first[0].schema)
+    assert types['Units'] == pa.float64()
+
+    second = list(columnar.csv_to_batches(io.BytesIO(_csv([(1, 2, 3.5)])), column_types=types))
+
+    assert second[0].column(3).to_pylist() == [3.5]
+    assert columnar.cast_batch(first[0], types).schema == second[0].schema
+    assert columnar.cast_batch(second[0], types) is second[0]
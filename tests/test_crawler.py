@@ -0,0 +1,67 @@
+import datetime
+from finops_crawler import cli
+from finops_crawler.base import CloudAPI
+from finops_crawler.crawler import Crawler
+from finops_crawler.dates import to_date
+
+
+class _DayClient(CloudAPI):
+    """
+    Returns one row per day of the range it's asked for, and remembers the ranges.
+    """
+
+    def __init__(self, name, end_date_inclusive):
+        super().__init__(None)
+        self.name = name
+        self.end_date_inclusive = end_date_inclusive
+        self.ranges = []
+
+    def get_scopes(self):
+        return ['scope']
+
+    def get_scope_cost(self, scope, start_date, end_date, detailed=False):
+        self.ranges.append((start_date, end_date))
+        start, stop = to_date(start_date), to_date(end_date) + datetime.timedelta(days=1 if self.end_date_inclusive else 0)
+        return [(start + datetime.timedelta(days=i)).isoformat() for i in range((stop - start).days)]
+
+
+def _days(client, windows):
+    crawler = Crawler(max_workers=2).add(client)
+    days = []
+    for i, (start_date, end_date) in enumerate(windows):
+        result = crawler.crawl(start_date, end_date, end_exclusive=i < len(windows) - 1)
+        days.extend(result.results.get((client.name, 'scope'), []))
+    return days
+
+
+def test_windows_fetch_every_day_once():
+    windows = [('2023-10-01', '2023-10-11'), ('2023-10-11', '2023-10-21'), ('2023-10-21', '2023-10-31')]
+    for end_date_inclusive in (False, True):
+        client = _DayClient('inclusive' if end_date_inclusive else 'exclusive', end_date_inclusive)
+
+        days = _days(client, windows)
+
+        assert days == _days(_DayClient(client.name, end_date_inclusive), [('2023-10-01', '2023-10-31')])
+        assert len(days) == len(set(days))
+
+
+def test_only_end_inclusive_clients_are_asked_for_a_day_less():
+    inclusive, exclusive = _DayClient('inclusive', True), _DayClient('exclusive', False)
+    crawler = Crawler().add(inclusive).add(exclusive)
+
+    crawler.crawl('2023-10-01', '2023-10-11', end_exclusive=True)
+
+    assert inclusive.ranges == [('2023-10-01', '2023-10-10')]
+    assert exclusive.ranges == [('2023-10-01', '2023-10-11')]
+
+
+def test_crawl_ranges_splits_a_backfill_into_windows():
+    args = cli.build_parser().parse_args(['--start', '2023-09-15', '--end', '2023-11-10', '--backfill'])
+
+    assert cli.crawl_ranges(args, datetime.date(2023, 12, 1)) == [
+        (datetime.date(2023, 9, 15), datetime.date(2023, 10, 1)),
+        (datetime.date(2023, 10, 1), datetime.date(2023, 11, 1)),
+        (datetime.date(2023, 11, 1), datetime.date(2023, 11, 10)),
+    ]
+    args = cli.build_parser().parse_args(['--days', '7'])
+    assert cli.crawl_ranges(args, datetime.date(2023, 12, 1)) == [(datetime.date(2023, 11, 24), datetime.date(2023, 12, 1))]
@@ -0,0 +1,61 @@
+import pytest
+from finops_crawler import schema
+from finops_crawler.azure import csvparse
+from finops_crawler.azure.csvparse import BlobParser
+
+import data
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    # split even small files, and scan them in blocks that end in the middle of records
+    monkeypatch.setattr(csvparse, '_MIN_SPLIT_SIZE', 0)
+    monkeypatch.setattr(csvparse, '_SCAN_BLOCK_SIZE', 997)
+
+
+def _assert_record_boundaries(content: bytes, ranges):
+    for start, end in ranges:
+        assert start < end
+        # every part starts right after a line break that is outside of quotes
+        assert content[start - 1:start] == b'\n'
+        assert content.count(b'"', 0, start) % 2 == 0
+    assert ranges[-1][1] == len(content)
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+
+
+def test_record_ranges_split_outside_of_quoted_line_breaks(tmp_path, small_blocks):
+    # every record has a quoted field full of line breaks, so most split targets land inside quotes
+    lines = ['Date,Tags,Cost\n'] + [f'10/01/2023,"{chr(10).join(["tag"] * 50)}",{i}\n' for i in range(200)]
+    content = ''.join(lines).encode()
+    path = tmp_path / 'blob.csv'
+    path.write_bytes(content)
+
+    ranges = csvparse._record_ranges(str(path), len(lines[0]), 7)
+
+    assert len(ranges) > 1
+    _assert_record_boundaries(content, ranges)
+
+
+def test_record_ranges_of_a_cost_details_blob(tmp_path, small_blocks):
+    content = data.azure_detailed_csv('sub', 0, 2000)
+    path = tmp_path / 'blob.csv'
+    path.write_bytes(content)
+    data_start = content.index(b'\n') + 1
+
+    ranges = csvparse._record_ranges(str(path), data_start, 5)
+
+    assert ranges[0][0] == data_start
+    assert len(ranges) == 5
+    _assert_record_boundaries(content, ranges)
+
+
+def test_parse_file_in_parts_equals_parsing_the_whole_file(tmp_path, small_blocks):
+    content = data.azure_detailed_csv('sub', 0, 3000)
+    path = tmp_path / 'blob.csv'
+    path.write_bytes(content)
+    parser = BlobParser(schema.AZURE_DETAILED_COLUMNS)
+
+    with open(path, 'rb') as f:
+        expected = parser.read_columns(f)
+
+    assert parser.parse_file(str(path), processes=3) == expected
@@ -0,0 +1,78 @@
+import pytest
+import requests
+from finops_crawler.azure import jobs
+from finops_crawler.azure.jobs import ReportJobManager
+
+
+@pytest.fixture(autouse=True)
+def fast_polls(monkeypatch):
+    monkeypatch.setattr(jobs, 'MIN_POLL_INTERVAL', 0)
+
+
+def _completed_job(manager, subscription_id):
+    job = manager.submit(subscription_id, '2023-10-01', '2023-10-31')
+    manager._poll(job)
+    assert job.status == 'Completed'
+    return job
+
+
+def test_run_downloads_every_report(azure_mock, azure_client):
+    server = azure_mock(subscriptions=2, report_polls=2)
+    manager = ReportJobManager(azure_client(server))
+    manager.submit_many(server.subscriptions, '2023-10-01', '2023-10-31')
+
+    result = manager.run()
+
+    assert result.ok
+    assert sorted(result.results) == [('azure', subscription_id) for subscription_id in sorted(server.subscriptions)]
+    assert all(len(rows) == 400 for rows in result.results.values())
+
+
+def test_a_restarted_run_generates_reports_with_expired_links_again(azure_mock, azure_client, tmp_path):
+    server = azure_mock()
+    subscription_id = server.subscriptions[0]
+    state_path = str(tmp_path / 'jobs.json')
+    _completed_job(ReportJobManager(azure_client(server), state_path=state_path), subscription_id)
+    # the crawl stopped here, and the links of the saved manifest expired before the restart
+    server.expire_links()
+
+    manager = ReportJobManager(azure_client(server), state_path=state_path)
+    assert manager.jobs[(subscription_id, '2023-10-01', '2023-10-31')].status == 'Completed'
+    result = manager.run()
+
+    assert result.ok
+    assert len(result.results[('azure', subscription_id)]) == 400
+    assert ReportJobManager(azure_client(server), state_path=state_path).jobs[(subscription_id, '2023-10-01', '2023-10-31')].status == 'Downloaded'
+
+
+def test_a_report_is_generated_again_only_once_per_run(azure_mock, azure_client):
+    server = azure_mock()
+    downloads = []
+
+    def download(job, manifest):
+        downloads.append(manifest)
+        response = requests.Response()
+        response.status_code = 403
+        raise requests.HTTPError('403 Client Error', response=response)
+
+    client = azure_client(server)
+    manager = ReportJobManager(client, download=download)
+    _completed_job(manager, server.subscriptions[0])
+
+    result = manager.run()
+
+    assert len(downloads) == 2
+    assert isinstance(result.errors[('azure', server.subscriptions[0])], requests.HTTPError)
+
+
+def test_a_report_whose_location_expired_is_submitted_again(azure_mock, azure_client):
+    server = azure_mock()
+    manager = ReportJobManager(azure_client(server))
+    job = manager.submit(server.subscriptions[0], '2023-10-01', '2023-10-31')
+    # e.g. after a restart long after the report was generated
+    job.location = 'https://management.azure.com/mock/gone'
+
+    result = manager.run()
+
+    assert result.ok
+    assert len(result.results[('azure', server.subscriptions[0])]) == 400
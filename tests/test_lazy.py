@@ -0,0 +1,37 @@
+import importlib
+import os
+import subprocess
+import sys
+import pytest
+
+
+@pytest.mark.parametrize('package, name, module, attribute', [
+    ('finops_crawler', 'aws', 'finops_crawler.aws', None),
+    ('finops_crawler.aws', 'costs_api', 'finops_crawler.aws.api', 'AWSAPI'),
+    ('finops_crawler.azure', 'costs_api', 'finops_crawler.azure.api', 'AzureAPI'),
+])
+def test_exports_are_listed_and_imported_on_first_use(package, name, module, attribute):
+    package = importlib.import_module(package)
+
+    assert name in dir(package)
+    value = getattr(package, name)
+    expected = sys.modules[module]
+    assert value is (expected if attribute is None else getattr(expected, attribute))
+    # cached in the package, later lookups don't go through __getattr__
+    assert vars(package)[name] is value
+
+
+def test_unknown_attributes_raise_attribute_error():
+    import finops_crawler
+    with pytest.raises(AttributeError, match='no attribute'):
+        finops_crawler.gcp
+
+
+def test_importing_the_packages_loads_no_client():
+    code = ('import sys, finops_crawler, finops_crawler.aws, finops_crawler.azure; '
+            'print(sorted(m for m in ("boto3", "finops_crawler.aws.api", "finops_crawler.azure.api") if m in sys.modules))')
+    # in a new interpreter, this one has imported everything by now
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, env=env).stdout
+
+    assert output.strip() == '[]'
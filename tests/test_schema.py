@@ -0,0 +1,55 @@
+import pytest
+from finops_crawler import schema
+
+
+def test_normalize_dates_monthly_azure_rows_by_billing_month():
+    rows = [{'Cost': 3.0, 'BillingMonth': '2023-10-01T00:00:00', 'ResourceId': None, 'Currency': 'EUR'}]
+
+    records = schema.normalize('azure', rows, 'sub')
+
+    assert records.columns['charge_date'] == ['2023-10-01']
+    assert records.columns['account_id'] == ['sub']
+
+
+def test_normalize_rejects_azure_rows_without_a_date():
+    with pytest.raises(ValueError, match='date column'):
+        schema.normalize('azure', [{'Cost': 3.0, 'Currency': 'EUR'}], 'sub')
+
+
+def test_azure_query_date_column():
+    assert schema.azure_query_date_column(['Cost', 'UsageDate']) == 'UsageDate'
+    assert schema.azure_query_date_column({'BillingMonth': 0}) == 'BillingMonth'
+    with pytest.raises(ValueError):
+        schema.azure_query_date_column(['Cost'])
+    assert schema.azure_query_dates([20231001, 20231001], 'UsageDate') == ['2023-10-01', '2023-10-01']
+
+
+def test_from_aws_takes_the_keys_of_the_requested_group_by():
+    results = [
+        {'TimePeriod': {'Start': '2023-10-01', 'End': '2023-10-02'}, 'Groups': [
+            {'Keys': ['111', 'Amazon S3'], 'Metrics': {'UnblendedCost': {'Amount': '1.5', 'Unit': 'USD'}}},
+            {'Keys': ['222', 'AWS Lambda'], 'Metrics': {'UnblendedCost': {'Amount': '2', 'Unit': 'USD'}}},
+        ]},
+        # a period without costs only has a total
+        {'TimePeriod': {'Start': '2023-10-02', 'End': '2023-10-03'}, 'Groups': [],
+         'Total': {'UnblendedCost': {'Amount': '0', 'Unit': 'USD'}}},
+    ]
+
+    records = schema.from_aws(results, account_id='payer', group_by=['LINKED_ACCOUNT', 'SERVICE'])
+
+    assert records.columns['account_id'] == ['111', '222', 'payer']
+    assert records.columns['service'] == ['Amazon S3', 'AWS Lambda', None]
+    assert records.columns['usage_type'] == [None, None, None]
+    assert records.columns['cost'] == [1.5, 2.0, 0.0]
+
+
+def test_from_azure_detailed_records_rows_under_the_given_subscription():
+    rows = [{'date': '10/01/2023', 'SubscriptionId': 'other', 'costInBillingCurrency': '1.5', 'billingCurrency': 'EUR'}]
+
+    assert schema.from_azure_detailed(rows).columns['account_id'] == ['other']
+    records = schema.from_azure_detailed(rows, subscription_id='sub')
+    assert records.columns['account_id'] == ['sub']
+    assert records.columns['charge_date'] == ['2023-10-01']
+    assert records.columns['cost'] == [1.5]
+    # told apart from query rows by the date column
+    assert schema.normalize('azure', rows, 'sub').columns['account_id'] == ['sub']
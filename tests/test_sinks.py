@@ -0,0 +1,151 @@
+import csv
+import json
+import os
+import pytest
+from finops_crawler import schema
+from finops_crawler.crawler import Crawler
+from finops_crawler.schema import CostRecords
+from finops_crawler.sinks import CSVSink, DuckDBSink, JSONLSink, SQLiteSink
+
+
+def _records(account_id, days, cost=1.0, provider='azure'):
+    return CostRecords({
+        'charge_date': [f'2023-10-{day:02d}' for day in days],
+        'provider': [provider] * len(days),
+        'account_id': [account_id] * len(days),
+        'cost': [cost] * len(days),
+        'currency': ['EUR'] * len(days),
+    })
+
+
+def _read_files(directory):
+    stored = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, newline='', encoding='utf-8') as f:
+                if name.endswith('.csv'):
+                    stored.extend(csv.DictReader(f))
+                elif name.endswith('.jsonl'):
+                    stored.extend(json.loads(line) for line in f)
+    return stored
+
+
+def _read_table(connection):
+    cursor = connection.cursor()
+    cursor.execute('SELECT provider, account_id, charge_date, cost FROM cost_records')
+    return [dict(zip(('provider', 'account_id', 'charge_date', 'cost'), row)) for row in cursor.fetchall()]
+
+
+def _duckdb_sink(path):
+    pytest.importorskip('duckdb')
+    pytest.importorskip('pyarrow')
+    return DuckDBSink(str(path / 'costs.duckdb'))
+
+
+@pytest.fixture(params=['sqlite', 'csv', 'jsonl', 'duckdb'])
+def sink(request, tmp_path):
+    """
+    A sink of every kind, with a `stored()` method returning its rows as dicts.
+    """
+    if request.param == 'sqlite':
+        sink = SQLiteSink(str(tmp_path / 'costs.sqlite'))
+        sink.stored = lambda: _read_table(sink.connection)
+    elif request.param == 'duckdb':
+        sink = _duckdb_sink(tmp_path)
+        sink.stored = lambda: _read_table(sink.connection)
+    else:
+        sink = (CSVSink if request.param == 'csv' else JSONLSink)(str(tmp_path / 'costs'))
+        sink.stored = lambda: _read_files(sink.directory)
+    yield sink
+    sink.close()
+
+
+def _partitions(sink):
+    return sorted({(row['account_id'], str(row['charge_date']), float(row['cost'])) for row in sink.stored()})
+
+
+def _crawl(sink, scopes, written):
+    # one crawl of October 1st to 3rd, writing the given records per scope and skipping the scopes without
+    sink.reset()
+    for scope in scopes:
+        sink.begin('azure', scope, '2023-10-01', '2023-10-03', end_inclusive=True)
+        if written.get(scope) is not None:
+            sink.write(written[scope])
+            sink.finish('azure', scope)
+
+
+def test_crawling_a_day_again_replaces_its_rows(sink):
+    _crawl(sink, ['a'], {'a': _records('a', [1, 2, 3])})
+    _crawl(sink, ['a'], {'a': _records('a', [1, 2, 3], cost=2.0)})
+
+    assert _partitions(sink) == [('a', '2023-10-01', 2.0), ('a', '2023-10-02', 2.0), ('a', '2023-10-03', 2.0)]
+
+
+def test_finish_clears_the_days_that_have_no_data_anymore(sink):
+    _crawl(sink, ['a', 'b'], {'a': _records('a', [1, 2, 3]), 'b': _records('b', [1, 2, 3])})
+    # day 2 of 'a' was refunded and comes back without rows
+    _crawl(sink, ['a'], {'a': _records('a', [1, 3])})
+
+    assert _partitions(sink) == [('a', '2023-10-01', 1.0), ('a', '2023-10-03', 1.0),
+                                 ('b', '2023-10-01', 1.0), ('b', '2023-10-02', 1.0), ('b', '2023-10-03', 1.0)]
+
+
+def test_a_failed_scope_keeps_its_data(sink):
+    _crawl(sink, ['a'], {'a': _records('a', [1, 2, 3])})
+    _crawl(sink, ['a'], {'a': None})
+
+    assert len(_partitions(sink)) == 3
+
+
+def test_days_outside_of_the_crawled_range_are_kept(sink):
+    sink.write(_records('a', [10]))
+    _crawl(sink, ['a'], {'a': _records('a', [1])})
+
+    assert _partitions(sink) == [('a', '2023-10-01', 1.0), ('a', '2023-10-10', 1.0)]
+
+
+def test_duckdb_inserts_by_column_name(tmp_path):
+    duckdb = pytest.importorskip('duckdb')
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'costs.duckdb')
+    connection = duckdb.connect(path)
+    columns = list(reversed(list(schema.COLUMNS)))
+    connection.execute(f"CREATE TABLE cost_records ({', '.join(f'{name} VARCHAR' for name in columns)})")
+    connection.close()
+
+    with DuckDBSink(path) as sink:
+        sink.write(_records('a', [1], cost=3.5))
+        row = sink.connection.execute('SELECT provider, account_id, charge_date, cost, currency FROM cost_records').fetchone()
+
+    assert row == ('azure', 'a', '2023-10-01', '3.5', 'EUR')
+
+
+class _DetailedClient:
+    name = 'azure'
+    end_date_inclusive = True
+
+    def iter_cost_detailed_columns(self, scope, start_date, end_date, columns=None, batch_size=None):
+        # a report of a billing scope lists the subscriptions below it, not the crawled scope
+        yield {
+            'Date': ['10/01/2023', '10/02/2023'],
+            'SubscriptionId': ['other', 'other'],
+            'MeterCategory': ['Storage', 'Storage'],
+            'ResourceId': ['r', 'r'],
+            'ChargeType': ['Usage', 'Usage'],
+            'MeterSubCategory': ['Hot', 'Hot'],
+            'CostInBillingCurrency': [1.0, 2.0],
+            'BillingCurrencyCode': ['EUR', 'EUR'],
+        }
+
+
+def test_detailed_crawl_records_rows_under_the_crawled_scope(tmp_path):
+    with SQLiteSink(str(tmp_path / 'costs.sqlite')) as sink:
+        sink.write(_records('scope', [3]))
+        crawler = Crawler(max_workers=1).add(_DetailedClient(), scopes=['scope'], detailed=True)
+        result = crawler.crawl('2023-10-01', '2023-10-03', sink=sink)
+
+        assert result.ok and result.results[('azure', 'scope')] == 2
+        # and so day 3, which has no data anymore, is cleared as well
+        assert sorted((row['account_id'], row['charge_date']) for row in _read_table(sink.connection)) == [
+            ('scope', '2023-10-01'), ('scope', '2023-10-02')]